@@ -347,6 +347,8 @@ def _story_md():
 REQUIRED = [
     ROOT / "export_step1_6_per_scenario.py",
     ROOT / "step1_immutable_ALLINONE.py",
+    ROOT / "friends_parser.py",
+    ROOT / "parallel_jobs.py",
     ROOT / "step_2_helpers_FIXED.py",
     ROOT / "step_2_zoiroi_idiaterotites_FIXED_v3_PATCHED.py",
     ROOT / "step3_amivaia_filia_FIXED.py",
@@ -6,6 +6,8 @@ export_step1_6_per_scenario.py — ΔΙΟΡΘΩΜΕΝΟΣ exporter (1→6)
     build_step1_6_per_scenario(input_excel, output_excel, pick_step4="best")
 
 Τρέχει ΟΛΟΚΛΗΡΗ τη ροή: Βήματα 1→6
+Σενάρια με ίδια τελική διαμέριση (fingerprint Βήματος 7) γράφονται σε ένα sheet·
+τα υπόλοιπα αναφέρονται ως aliases στο sheet «Σύνοψη».
 """
 
 from typing import Optional, List, Tuple
@@ -44,6 +46,7 @@ def build_step1_6_per_scenario(input_excel: str, output_excel: str, pick_step4:
     m_step4 = _import("step4_corrected", root / "step4_corrected.py")
     m_step5 = _import("step5_enhanced", root / "step5_enhanced.py")
     m_step6 = _import("step6_compliant", root / "step6_compliant.py")
+    m_step7 = _import("step7_fixed_final", root / "step7_fixed_final.py")
 
     # Συμβατότητα υπογραφής στο Step4
     if hasattr(m_step4, "count_groups_by_category_per_class_strict"):
@@ -68,6 +71,9 @@ def build_step1_6_per_scenario(input_excel: str, output_excel: str, pick_step4:
         key=_sid
     )
 
+    # fingerprint ΒΗΜΑ6 → sheet όπου γράφτηκε· ίδιες διαμερίσεις γράφονται μία φορά
+    sheet_of_fp = {}
+    summary_rows = []
     with pd.ExcelWriter(output_excel, engine="xlsxwriter") as w:
         for s1col in step1_cols:
             sid = _sid(s1col)
@@ -190,7 +196,8 @@ def build_step1_6_per_scenario(input_excel: str, output_excel: str, pick_step4:
                     lang_col="ΚΑΛΗ_ΓΝΩΣΗ_ΕΛΛΗΝΙΚΩΝ",
                     step_col="ΒΗΜΑ_ΤΟΠΟΘΕΤΗΣΗΣ", 
                     group_col="GROUP_ID",
-                    max_iter=5
+                    max_iter=5,
+                    audit=False
                 )
                 df6 = step6_result["df"]
                 
@@ -220,8 +227,19 @@ def build_step1_6_per_scenario(input_excel: str, output_excel: str, pick_step4:
             keep = [c for c in CORE_COLUMNS if c in df6.columns] + [s1col, s2col, s3col, s4final, s5col, s6col]
             out_df = _dedup(df6[keep].copy())
 
-            sheet_name = f"ΣΕΝΑΡΙΟ_{sid}"
-            out_df.to_excel(w, sheet_name=sheet_name[:31], index=False)
+            sheet_name = f"ΣΕΝΑΡΙΟ_{sid}"[:31]
+            # Κάθε sheet προέρχεται από ξεχωριστό run Βημάτων 2–6: ταύτιση γραμμών κατά ΟΝΟΜΑ, όχι κατά θέση
+            fp = m_step7.scenario_fingerprint(
+                out_df[s6col].tolist(), keys=out_df["ΟΝΟΜΑ"].tolist() if "ΟΝΟΜΑ" in out_df.columns else None)
+            alias_of = sheet_of_fp.get(fp)
+            if alias_of is None:
+                sheet_of_fp[fp] = sheet_name
+                out_df.to_excel(w, sheet_name=sheet_name, index=False)
+            summary_rows.append({"ΣΕΝΑΡΙΟ": sid, "SHEET": alias_of or sheet_name,
+                                 "FINGERPRINT": fp, "ALIAS_ΤΟΥ": alias_of or ""})
+
+        pd.DataFrame(summary_rows, columns=["ΣΕΝΑΡΙΟ", "SHEET", "FINGERPRINT", "ALIAS_ΤΟΥ"]).to_excel(
+            w, sheet_name="Σύνοψη", index=False)
 
 # Aliases για συμβατότητα
 build_step1_4_per_scenario = build_step1_6_per_scenario
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+friends_parser.py
+- Κοινός parser για κελιά ΦΙΛΟΙ / ΣΥΓΚΡΟΥΣΗ, για όλα τα βήματα (1–7)· τα πεδία του app κρατούν τον δικό τους διαχωρισμό
+- Χωρίς eval: python-literal λίστες μόνο μέσω ast.literal_eval
+- LRU memo ανά raw string: κάθε κελί γίνεται parse μία φορά ανά roster,
+  όσες φορές κι αν ξαναζητηθεί από βήματα και εσωτερικούς βρόχους
+- parse_column(series, names): bulk μετατροπή στήλης σε λίστες int ids
+- Τα βήματα κρατούν τα παλιά τους ονόματα (parse_friends_cell, _parse_list_cell, ...) ως aliases του parse_list_cell
+"""
+
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Tuple
+import ast, re
+import pandas as pd
+
+SAFE_SEP = re.compile(r"[,\|\;/·\n]+")
+
+@lru_cache(maxsize=65536)
+def _parse_text(raw: str) -> Tuple[str, ...]:
+    s = raw.strip()
+    if not s or s.lower() == "nan":
+        return ()
+    # Προσπάθεια ως Python list: "['Α','Β']"
+    if s[0] in "[(":
+        try:
+            val = ast.literal_eval(s)
+            if isinstance(val, (list, tuple)):
+                return tuple(str(t).strip() for t in val if str(t).strip())
+        except (ValueError, SyntaxError, TypeError, MemoryError, RecursionError):
+            pass
+    # Διαφορετικά, split με ασφαλές regex
+    return tuple(p.strip() for p in SAFE_SEP.split(s) if p.strip() and p.strip().lower() != "nan")
+
+def parse_list_cell(x: Any) -> List[str]:
+    """Λίστα ονομάτων (stripped) από list/tuple/set, python-literal string ή string με διαχωριστές."""
+    if isinstance(x, (list, tuple, set)):
+        return [str(t).strip() for t in x if str(t).strip()]
+    if x is None:
+        return []
+    try:
+        if pd.isna(x):
+            return []
+    except (TypeError, ValueError):
+        pass
+    return list(_parse_text(str(x)))
+
+def parse_column(series: pd.Series, names: Iterable[Any]) -> pd.Series:
+    """
+    Bulk parse στήλης ΦΙΛΟΙ/ΣΥΓΚΡΟΥΣΗ → Series με λίστα int ids ανά γραμμή.
+    id = θέση του ονόματος στο `names` (πρώτη εμφάνιση, stripped)· άγνωστα ονόματα παραλείπονται.
+    Κάθε διακριτό κελί γίνεται parse μία φορά.
+    """
+    id_of: Dict[str, int] = {}
+    for i, nm in enumerate(names):
+        id_of.setdefault(str(nm).strip(), i)
+    by_raw: Dict[Any, List[int]] = {}
+    out = []
+    for raw in series.tolist():
+        try:
+            ids = by_raw.get(raw)
+        except TypeError:  # μη-hashable κελί (π.χ. list)
+            out.append([id_of[n] for n in parse_list_cell(raw) if n in id_of])
+            continue
+        if ids is None:
+            ids = [id_of[n] for n in parse_list_cell(raw) if n in id_of]
+            by_raw[raw] = ids
+        out.append(list(ids))
+    return pd.Series(out, index=series.index, dtype=object)
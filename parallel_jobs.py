@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+parallel_jobs.py
+- Κοινός εκτελεστής ανεξάρτητων jobs για τα Βήματα 4–6 (ένα sheet/σενάριο ανά job)
+- Εξ ορισμού ΣΕΙΡΙΑΚΑ (workers=1)· process pool μόνο όταν ζητηθεί ρητά workers > 1
+- Οι workers επιστρέφουν τα σφάλματά τους ως τιμή, άρα κάθε εξαίρεση εδώ είναι σφάλμα του pool:
+  fallback σε σειριακή εκτέλεση ΜΟΝΟ για αποτυχία εκκίνησης pool / pickling, με μήνυμα,
+  κρατώντας όσα αποτελέσματα είχαν ήδη ολοκληρωθεί
+- stop(result): προαιρετικό early exit με το ίδιο αποτέλεσμα με τη σειριακή εκτέλεση
+"""
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, List, Optional, Sequence
+import pickle
+
+def _picklable(fn: Callable, jobs: Sequence[Any]) -> bool:
+    """Έλεγχος πριν το pool: συναρτήσεις/κλάσεις από modules εκτός sys.modules δεν περνούν σε διεργασίες."""
+    try:
+        pickle.dumps((fn, jobs[0]))
+        return True
+    except (pickle.PicklingError, AttributeError, TypeError) as e:
+        print(f"⚠️ Παράλληλη εκτέλεση μη διαθέσιμη ({type(e).__name__}: {e}) — σειριακή εκτέλεση.")
+        return False
+
+def run_jobs(fn: Callable[[Any], Any], jobs: Sequence[Any], workers: Optional[int] = 1,
+             stop: Optional[Callable[[Any], bool]] = None) -> List[Any]:
+    """
+    Εκτελεί fn(job) για κάθε job και επιστρέφει τα αποτελέσματα με τη σειρά των jobs.
+
+    Args:
+        workers: πλήθος διεργασιών (1/None = σειριακά)
+        stop: αν stop(result) είναι True, τα επόμενα jobs δεν χρειάζονται· επιστρέφονται τα
+              αποτελέσματα ως και το ΠΡΩΤΟ (κατά σειρά εισόδου) τέτοιο job, όπως σειριακά.
+    """
+    jobs = list(jobs)
+    n_workers = min(len(jobs), workers or 1)
+    results: List[Any] = [None] * len(jobs)
+    done = [False] * len(jobs)
+    first_stop = len(jobs)  # θέση του πρώτου job με stop(result)
+
+    if n_workers > 1 and _picklable(fn, jobs):
+        try:
+            ex = ProcessPoolExecutor(max_workers=n_workers)
+        except OSError as e:
+            print(f"⚠️ Αποτυχία εκκίνησης process pool ({e}) — σειριακή εκτέλεση.")
+        else:
+            try:
+                futures = {ex.submit(fn, job): i for i, job in enumerate(jobs)}
+                for fut in as_completed(futures):
+                    i = futures[fut]
+                    results[i], done[i] = fut.result(), True
+                    if stop is not None and i < first_stop and stop(results[i]):
+                        first_stop = i
+                    if all(done[:first_stop]):
+                        break
+            except BrokenProcessPool as e:
+                print(f"⚠️ Το process pool διακόπηκε ({e}) — τα υπόλοιπα jobs εκτελούνται σειριακά.")
+            finally:
+                # χωρίς αναμονή για jobs μετά το early exit
+                ex.shutdown(wait=False, cancel_futures=True)
+
+    for i in range(len(jobs)):
+        if i > first_stop:
+            break
+        if not done[i]:
+            results[i], done[i] = fn(jobs[i]), True
+            if stop is not None and stop(results[i]):
+                first_stop = i
+    return results[:first_stop + 1]
@@ -9,9 +9,10 @@ step4_multi_groups_v2.py
 - @dataclass config (Step4Config)
 - Input validation & custom exceptions
 - Δημιουργία δυάδων πλήρως αμοιβαίων, αποκλεισμός "σπασμένων"
-- Incremental metrics (χωρίς συνεχές recompute)
+- Incremental metrics (χωρίς συνεχές recompute): K×4 NumPy πίνακας & προϋπολογισμένα delta ανά δυάδα
 - Heuristics τοποθέτησης με weighted class scoring (variance / cap / balance)
-- Early bounds pruning
+- Early bounds pruning: branch-and-bound best-k με admissible κάτω όριο penalty & node budget
+- Beam search mode (use_beam_search) για ποικιλόμορφα σενάρια (απόσταση Hamming ≥ min_hamming)
 - Penalty & summary export με metadata
 - "FILLED" εξαγωγή (μεταφορά αναθέσεων Βημάτων 1–3 μέσα στο Βήμα 4)
 - One‑shot export σε μορφή PER_SCENARIO_EXACT (12 στήλες), όπως το παράδειγμα
@@ -25,14 +26,17 @@ step4_multi_groups_v2.py
 
 API (κύρια):
     run_step4_multi_with_fill_v2(df, config=Step4Config()) -> DataFrame
-    export_step4_nextcol_full_multi_filled_v2(step3_xlsx, out_xlsx, config=Step4Config()) -> str
-    export_step3_to_per_scenario_exact_filled_v2(step3_xlsx, out_xlsx, config=Step4Config()) -> str
+    export_step4_nextcol_full_multi_filled_v2(step3_xlsx, out_xlsx, config=Step4Config(), workers=1) -> str
+    export_step3_to_per_scenario_exact_filled_v2(step3_xlsx, out_xlsx, config=Step4Config(), workers=1) -> str
+    (οι exporters λύνουν τα sheets σειριακά· workers > 1 = παράλληλα σε process pool)
 """
 
 from dataclasses import dataclass
 from typing import Dict, List, Tuple, Optional, Any
-import pandas as pd, numpy as np, re, math, random, statistics
+import pandas as pd, numpy as np, re, math, random, heapq, hashlib
 from datetime import datetime
+from friends_parser import parse_list_cell
+from parallel_jobs import run_jobs
 
 # ------------------------- Exceptions -------------------------
 
@@ -71,6 +75,12 @@ class Step4Config:
     # NEW: ideal strategy flags
     use_ideal_strategy: bool = True
     prefer_opposites: bool = True
+    # branch-and-bound: μέγιστος αριθμός κόμβων αναζήτησης (πάντα τερματίζει γρήγορα)
+    max_nodes: int = 20000
+    # beam search: ποικιλόμορφα σενάρια (ελάχιστη απόσταση Hamming σε αριθμό δυάδων)
+    use_beam_search: bool = False
+    beam_width: int = 32
+    min_hamming: int = 2
 
 STEP_COLUMN_PATTERNS = re.compile(r"^ΒΗΜΑ[1-3]_ΣΕΝΑΡΙΟ_\d+$")
 FRIEND_COLUMN_CANDIDATES = ("ΦΙΛΟΙ","ΦΙΛΟΣ")
@@ -106,9 +116,7 @@ def _greek_norm(x: Any) -> str:
     # unknown -> empty
     return ""
 def _friends_list(x: Any) -> List[str]:
-    if pd.isna(x): return []
-    parts = re.split(r"[;,|/\n]+", str(x))
-    return [p.strip() for p in parts if p.strip()]
+    return parse_list_cell(x)
 
 # ------------------------- Column detection -------------------
 
@@ -118,27 +126,30 @@ def _find_step_cols(df: pd.DataFrame) -> List[str]:
         cols = [c for c in df.columns if str(c).startswith("ΒΗΜΑ1_") or str(c).startswith("ΒΗΜΑ2_") or str(c).startswith("ΒΗΜΑ3_")]
     return cols
 
-def _detect_classes(df: pd.DataFrame) -> List[str]:
-    step_cols = _find_step_cols(df)
-    classes = []
-    for c in step_cols:
-        vals = df[c].dropna().astype(str).unique().tolist()
-        classes.extend(vals)
-    classes = [v for v in classes if str(v).strip() != ""]
-    classes = sorted(set(classes), key=lambda x: (len(str(x)), str(x)))
-    return classes
-
-def _get_current_assignment_row(row: pd.Series, step_cols: List[str]) -> Optional[str]:
+def _ordered_step_cols(df: pd.DataFrame) -> List[str]:
+    """Στήλες βημάτων με σειρά προτεραιότητας ΒΗΜΑ3 → ΒΗΜΑ2 → ΒΗΜΑ1 (σταθερή μέσα σε κάθε βήμα)."""
     def key_order(c):
         if str(c).startswith("ΒΗΜΑ3_"): return 0
         if str(c).startswith("ΒΗΜΑ2_"): return 1
         if str(c).startswith("ΒΗΜΑ1_"): return 2
         return 3
-    for c in sorted(step_cols, key=key_order):
-        v = row.get(c, np.nan)
-        if pd.notna(v) and str(v).strip() != "":
-            return str(v).strip()
-    return None
+    return sorted(_find_step_cols(df), key=key_order)
+
+def _resolve_base_assignment(df: pd.DataFrame) -> Tuple[pd.Categorical, List[str]]:
+    """
+    Ένα vectorised πέρασμα πάνω στις στήλες ΒΗΜΑ3→2→1: η πρώτη μη-κενή τιμή ανά γραμμή
+    (bfill κατά axis=1) ως categorical κωδικοί τμημάτων, μαζί με τη λίστα τμημάτων
+    (όλες οι μη-κενές τιμές των στηλών, ταξινομημένες κατά (μήκος, label)).
+    """
+    step_cols = _ordered_step_cols(df)
+    if not step_cols:
+        return pd.Categorical([np.nan] * len(df), categories=[]), []
+    frame = df[step_cols]
+    labels = frame.astype(str).apply(lambda col: col.str.strip())
+    labels = labels.where(frame.notna() & labels.ne(""))
+    classes = sorted(set(pd.unique(labels.stack())), key=lambda x: (len(str(x)), str(x)))
+    first = labels.bfill(axis=1).iloc[:, 0]
+    return pd.Categorical(first, categories=classes), classes
 
 # ------------------------- Input validation -------------------
 
@@ -166,6 +177,72 @@ def _choose_name_col(df: pd.DataFrame) -> str:
 
 # ------------------------- Grouping / dyads -------------------
 
+class _RosterGraph:
+    """
+    Ό,τι εξαρτάται ΜΟΝΟ από το roster (όχι από το σενάριο): κανονικοποιημένα ονόματα,
+    γράφος αμοιβαίων φιλιών (ζεύγη θέσεων γραμμών), κατηγορίες ζευγών και delta διανύσματα.
+    """
+
+    def __init__(self, df: pd.DataFrame, name_col: str, friends_col: str):
+        names_norm = df[name_col].astype(str).map(str.strip).map(_norm_str).tolist()
+        friend_sets = [{f for f in (_norm_str(x) for x in _friends_list(raw)) if f} for raw in df[friends_col].tolist()]
+        positions_by_name: Dict[str,List[int]] = {}
+        for p, nm in enumerate(names_norm):
+            if nm:
+                positions_by_name.setdefault(nm, []).append(p)
+
+        edges = set()
+        for p, friends in enumerate(friend_sets):
+            me = names_norm[p]
+            if not me:
+                continue
+            for f in friends:
+                for q in positions_by_name.get(f, ()):
+                    if q != p and me in friend_sets[q]:
+                        edges.add((min(p, q), max(p, q)))
+        edges = sorted(edges)
+        self.names_norm = np.asarray(names_norm, dtype=object)
+        self.edge_p = np.asarray([e[0] for e in edges], dtype=np.int64)
+        self.edge_q = np.asarray([e[1] for e in edges], dtype=np.int64)
+
+        self.vecs = _student_metric_vectors(df)
+        empty = pd.Series("", index=df.index)
+        genders = (df["ΦΥΛΟ"] if "ΦΥΛΟ" in df.columns else empty).map(_gender_norm).tolist()
+        greeks = (df["ΚΑΛΗ_ΓΝΩΣΗ_ΕΛΛΗΝΙΚΩΝ"] if "ΚΑΛΗ_ΓΝΩΣΗ_ΕΛΛΗΝΙΚΩΝ" in df.columns else empty).map(_greek_norm).tolist()
+        self._genders, self._greeks = genders, greeks
+        self._cats: Dict[Tuple[int,...],Dict[str,str]] = {}
+
+    def category(self, positions: Tuple[int,...]) -> Dict[str,str]:
+        cat = self._cats.get(positions)
+        if cat is None:
+            cat = _category_from_norms({self._genders[p] for p in positions}, {self._greeks[p] for p in positions})
+            self._cats[positions] = cat
+        return cat
+
+_ROSTER_CACHE: Dict[Tuple[Any,...],_RosterGraph] = {}
+_ROSTER_CACHE_SIZE = 8
+
+def _friends_col(df: pd.DataFrame) -> Optional[str]:
+    return "ΦΙΛΟΙ" if "ΦΙΛΟΙ" in df.columns else ("ΦΙΛΟΣ" if "ΦΙΛΟΣ" in df.columns else None)
+
+def _roster_graph(df: pd.DataFrame) -> _RosterGraph:
+    """Roster-level cache: ίδιο roster σε πολλά sheets/σενάρια → ένα parse φιλιών & κατηγοριών."""
+    name_col = _choose_name_col(df)
+    friends_col = _friends_col(df)
+    if friends_col is None:
+        raise InsufficientDataError("Δεν βρέθηκε στήλη ΦΙΛΟΙ/ΦΙΛΟΣ.")
+    cols = [c for c in (name_col, friends_col, "ΦΥΛΟ", "ΚΑΛΗ_ΓΝΩΣΗ_ΕΛΛΗΝΙΚΩΝ") if c in df.columns]
+    digest = hashlib.blake2b(pd.util.hash_pandas_object(df[cols].astype(str), index=True).to_numpy().tobytes(),
+                             digest_size=16).hexdigest()
+    key = (tuple(cols), len(df), digest)
+    graph = _ROSTER_CACHE.get(key)
+    if graph is None:
+        graph = _RosterGraph(df, name_col, friends_col)
+        if len(_ROSTER_CACHE) >= _ROSTER_CACHE_SIZE:
+            _ROSTER_CACHE.pop(next(iter(_ROSTER_CACHE)))
+        _ROSTER_CACHE[key] = graph
+    return graph
+
 def build_unplaced_and_mutual_dyads(df: pd.DataFrame,
                                     broken_col="ΣΠΑΣΜΕΝΕΣ_ΦΙΛΙΕΣ") -> Tuple[pd.DataFrame, List[Tuple[int,int]]]:
     step_cols = _find_step_cols(df)
@@ -174,75 +251,32 @@ def build_unplaced_and_mutual_dyads(df: pd.DataFrame,
         mask_unplaced &= df[c].isna()
     unplaced_df = df[mask_unplaced].copy()
 
-    name_col = _choose_name_col(df)
-    friends_col = "ΦΙΛΟΙ" if "ΦΙΛΟΙ" in df.columns else ("ΦΙΛΟΣ" if "ΦΙΛΟΣ" in df.columns else None)
-    if friends_col is None:
-        raise InsufficientDataError("Δεν βρέθηκε στήλη ΦΙΛΟΙ/ΦΙΛΟΣ.")
-
-    names = unplaced_df[name_col].astype(str).fillna("").map(str.strip)
-    names_norm = names.map(_norm_str)
-
-    # Map normalized name -> index (unique)
-    index_by_norm = {}
-    for idx, nm in zip(unplaced_df.index.tolist(), names_norm.tolist()):
-        if nm and nm not in index_by_norm:
-            index_by_norm[nm] = idx
-
-    # Precompute normalized friend sets per index
-    raw_lists = unplaced_df[friends_col].tolist()
-    friend_sets = {}
-    for idx, raw in zip(unplaced_df.index.tolist(), raw_lists):
-        lst = [_norm_str(f) for f in _friends_list(raw)]
-        friend_sets[idx] = set([f for f in lst if f])
-
-    broken_mask = unplaced_df[broken_col] if (broken_col in unplaced_df.columns) else pd.Series(False, index=unplaced_df.index)
-
-    dyads_set = set()
-    pos_indices = unplaced_df.index.tolist()
-    for i_pos, idx_i in enumerate(pos_indices):
-        if bool(broken_mask.loc[idx_i]):
-            continue
-        me_norm = names_norm.iloc[i_pos]
-        if not me_norm:
-            continue
-        for f_norm in friend_sets[idx_i]:
-            j_idx = index_by_norm.get(f_norm)
-            if j_idx is None or j_idx == idx_i:
-                continue
-            if bool(broken_mask.loc[j_idx]):
-                continue
-            # check mutual via normalized names
-            if me_norm in friend_sets[j_idx]:
-                pair = tuple(sorted([idx_i, j_idx]))
-                dyads_set.add(pair)
-
-    dyads = sorted(list(dyads_set))
+    graph = _roster_graph(df)
+
+    # Ανά σενάριο: μόνο η τομή του (cached) γράφου με τους μη-τοποθετημένους.
+    unplaced = mask_unplaced.to_numpy()
+    broken = (df[broken_col].map(bool).to_numpy() if broken_col in df.columns
+              else np.zeros(len(df), dtype=bool))
+    eligible = unplaced & ~broken & (graph.names_norm != "")
+    # κάθε όνομα αντιστοιχεί στην ΠΡΩΤΗ μη-τοποθετημένη γραμμή με αυτό το όνομα
+    first = np.zeros(len(df), dtype=bool)
+    un_pos = np.flatnonzero(unplaced)
+    first[un_pos[~pd.Series(graph.names_norm[un_pos]).duplicated().to_numpy()]] = True
+
+    p, q = graph.edge_p, graph.edge_q
+    keep = eligible[p] & eligible[q] & (first[p] | first[q])
+    labels = df.index.to_numpy()
+    dyads = sorted({tuple(sorted((labels[a], labels[b]))) for a, b in zip(p[keep].tolist(), q[keep].tolist())})
     return unplaced_df, dyads
 
-def group_category(rows: List[pd.Series]) -> Dict[str,str]:
-    genders = {_gender_norm(r.get("ΦΥΛΟ","")) for r in rows}
-    greeks = {_greek_norm(r.get("ΚΑΛΗ_ΓΝΩΣΗ_ΕΛΛΗΝΙΚΩΝ","")) for r in rows}
+def _category_from_norms(genders: set, greeks: set) -> Dict[str,str]:
     gender_cat = "ΑΓΟΡΙΑ" if genders == {"ΑΓΟΡΙ"} else ("ΚΟΡΙΤΣΙΑ" if genders == {"ΚΟΡΙΤΣΙ"} else "ΜΙΚΤΟ ΦΥΛΟ")
     greek_cat  = "ΚΑΛΗ" if greeks == {"Ν"} else ("ΟΧΙ ΚΑΛΗ" if greeks == {"Ο"} else "ΜΙΚΤΗ")
     return {"gender_cat": gender_cat, "greek_cat": greek_cat}
 
 # ------------------------- Metrics / penalty ------------------
 
-def empty_metrics(classes: List[str]) -> Dict[str,Dict[str,int]]:
-    return {c: {"total":0, "boys":0, "girls":0, "greek_good":0} for c in classes}
-
-def apply_student_to_metrics(df: pd.DataFrame, idx: int, cl: str, metrics: Dict[str,Dict[str,int]]) -> None:
-    # metrics must be pre-initialized for all classes
-    row = df.loc[idx]
-    m = metrics[cl]
-    m["total"] += 1
-    g = _gender_norm(row.get("ΦΥΛΟ",""))
-    if g == "ΑΓΟΡΙ":
-        m["boys"] += 1
-    elif g == "ΚΟΡΙΤΣΙ":
-        m["girls"] += 1
-    if _greek_norm(row.get("ΚΑΛΗ_ΓΝΩΣΗ_ΕΛΛΗΝΙΚΩΝ","")) == "Ν":
-        m["greek_good"] += 1
+METRIC_KEYS = ("total", "boys", "girls", "greek_good")
 
 def metrics_diff_tuple(mets: Dict[str,Dict[str,int]]) -> Tuple[int,int,int,int]:
     totals = [m["total"] for m in mets.values()] or [0]
@@ -251,70 +285,215 @@ def metrics_diff_tuple(mets: Dict[str,Dict[str,int]]) -> Tuple[int,int,int,int]:
     girls  = [m["girls"] for m in mets.values()] or [0]
     return (max(totals)-min(totals), max(boys)-min(boys), max(girls)-min(girls), max(goods)-min(goods))
 
-def ranges_ok(mets: Dict[str,Dict[str,int]], cfg: Step4Config) -> bool:
-    d_pop, d_boys, d_girls, d_good = metrics_diff_tuple(mets)
+def _diffs_ok(diffs: Tuple[int,int,int,int], cfg: Step4Config) -> bool:
+    d_pop, d_boys, d_girls, d_good = diffs
     if d_pop > cfg.max_pop_diff: return False
     if d_good > cfg.max_greek_diff: return False
     if d_boys > cfg.max_gender_diff: return False
     if d_girls > cfg.max_gender_diff: return False
     return True
 
-def penalty_score(mets: Dict[str,Dict[str,int]]) -> int:
-    d_pop, d_boys, d_girls, d_good = metrics_diff_tuple(mets)
+def _penalty_from_diffs(diffs: Tuple[int,int,int,int]) -> int:
+    d_pop, d_boys, d_girls, d_good = diffs
     pop_pen = max(0, d_pop - 1)
     grk_pen = max(0, d_good - 2)
     sex_pen = max(0, d_boys - 1) + max(0, d_girls - 1)
     return int(pop_pen + grk_pen + sex_pen)
 
-def variance_score(mets: Dict[str,Dict[str,int]]) -> Tuple[float,float,float]:
-    vals = list(mets.values())
-    if not vals:
-        return (0.0, 0.0, 0.0)
-    totals = [max(0, int(m.get("total", 0))) for m in vals]
-    boys   = [max(0, int(m.get("boys", 0)))  for m in vals]
-    girls  = [max(0, int(m.get("girls", 0))) for m in vals]
-    goods  = [max(0, int(m.get("greek_good", 0))) for m in vals]
-    v_tot = statistics.pvariance(totals) if len(totals) > 1 else 0.0
-    v_gen = statistics.pvariance([b - g for b,g in zip(boys, girls)]) if len(boys) > 1 else 0.0
-    v_grk = statistics.pvariance(goods) if len(goods) > 1 else 0.0
-    return (v_tot, v_gen, v_grk)
+def ranges_ok(mets: Dict[str,Dict[str,int]], cfg: Step4Config) -> bool:
+    return _diffs_ok(metrics_diff_tuple(mets), cfg)
+
+def penalty_score(mets: Dict[str,Dict[str,int]]) -> int:
+    return _penalty_from_diffs(metrics_diff_tuple(mets))
+
+# ------------------------- Encoded metric vectors -------------
+
+def _student_metric_vectors(df: pd.DataFrame) -> np.ndarray:
+    """N×4 πίνακας (total, boys, girls, greek_good) ανά θέση γραμμής του df."""
+    n = len(df)
+    empty = pd.Series("", index=df.index)
+    genders = (df["ΦΥΛΟ"] if "ΦΥΛΟ" in df.columns else empty).map(_gender_norm)
+    greeks = (df["ΚΑΛΗ_ΓΝΩΣΗ_ΕΛΛΗΝΙΚΩΝ"] if "ΚΑΛΗ_ΓΝΩΣΗ_ΕΛΛΗΝΙΚΩΝ" in df.columns else empty).map(_greek_norm)
+    vecs = np.zeros((n, len(METRIC_KEYS)), dtype=np.int64)
+    vecs[:, 0] = 1
+    vecs[:, 1] = (genders.to_numpy() == "ΑΓΟΡΙ")
+    vecs[:, 2] = (genders.to_numpy() == "ΚΟΡΙΤΣΙ")
+    vecs[:, 3] = (greeks.to_numpy() == "Ν")
+    return vecs
+
+def _pvariance_cols(mat: np.ndarray) -> np.ndarray:
+    """Πληθυσμιακή διακύμανση ανά στήλη, ακριβής σε ακέραιους (ίδια με statistics.pvariance)."""
+    k = mat.shape[0]
+    if k <= 1:
+        return np.zeros(mat.shape[1:], dtype=float)
+    s1 = mat.sum(axis=0)
+    s2 = (mat * mat).sum(axis=0)
+    return (k * s2 - s1 * s1) / float(k * k)
+
+class Step4Metrics:
+    """
+    Μετρικά τμημάτων ως K×4 ακέραιος πίνακας (γραμμές = classes, στήλες = METRIC_KEYS).
+    Η τοποθέτηση/αναίρεση μιας ομάδας είναι ένα vector add/sub με το προϋπολογισμένο delta της.
+    Τα max/min κάθε μετρικού διατηρούνται με ιστογράμματα, άρα diff_tuple/ranges_ok είναι O(1).
+    """
+
+    def __init__(self, classes: List[str], mat: Optional[np.ndarray] = None):
+        self.classes = list(classes)
+        self.mat = (np.zeros((len(self.classes), len(METRIC_KEYS)), dtype=np.int64)
+                    if mat is None else np.array(mat, dtype=np.int64))
+        self._rebuild_tracking()
+
+    def _rebuild_tracking(self) -> None:
+        # Ανά μετρικό: ιστόγραμμα "πόσα τμήματα έχουν τιμή v" + τρέχον max/min,
+        # ώστε τα ranges να ενημερώνονται σε O(1) (amortized) σε κάθε place/unplace.
+        self._hist: List[List[int]] = []
+        self._max: List[int] = []
+        self._min: List[int] = []
+        for j in range(len(METRIC_KEYS)):
+            col = self.mat[:, j].tolist()
+            hist = [0] * ((max(col) if col else 0) + 1)
+            for v in col:
+                hist[v] += 1
+            self._hist.append(hist)
+            self._max.append(max(col) if col else 0)
+            self._min.append(min(col) if col else 0)
+
+    @classmethod
+    def from_base(cls, df: pd.DataFrame, base: pd.Series, classes: List[str], vecs: np.ndarray) -> "Step4Metrics":
+        codes = pd.Categorical(base.reindex(df.index), categories=classes).codes.astype(np.int64)
+        sel = codes >= 0
+        mat = np.zeros((len(classes), len(METRIC_KEYS)), dtype=np.int64)
+        np.add.at(mat, codes[sel], vecs[sel])
+        return cls(classes, mat)
+
+    def copy(self) -> "Step4Metrics":
+        new = Step4Metrics.__new__(Step4Metrics)
+        new.classes = self.classes
+        new.mat = self.mat.copy()
+        new._hist = [h[:] for h in self._hist]
+        new._max = self._max[:]
+        new._min = self._min[:]
+        return new
+
+    def _shift(self, ci: int, delta: np.ndarray, sign: int) -> None:
+        row = self.mat[ci].tolist()
+        for j, d in enumerate(delta.tolist()):
+            if not d:
+                continue
+            old = row[j]
+            new = old + sign * d
+            hist = self._hist[j]
+            if new >= len(hist):
+                hist.extend([0] * (new + 1 - len(hist)))
+            hist[old] -= 1
+            hist[new] += 1
+            if new > self._max[j]:
+                self._max[j] = new
+            elif old == self._max[j] and not hist[old]:
+                while not hist[self._max[j]]:
+                    self._max[j] -= 1
+            if new < self._min[j]:
+                self._min[j] = new
+            elif old == self._min[j] and not hist[old]:
+                while not hist[self._min[j]]:
+                    self._min[j] += 1
+        if sign > 0:
+            self.mat[ci] += delta
+        else:
+            self.mat[ci] -= delta
+
+    def place(self, ci: int, delta: np.ndarray) -> None:
+        self._shift(ci, delta, +1)
+
+    def unplace(self, ci: int, delta: np.ndarray) -> None:
+        self._shift(ci, delta, -1)
+
+    def would_break_cap(self, ci: int, size: int, cfg: Step4Config) -> bool:
+        return int(self.mat[ci, 0]) + size > cfg.cap_per_class
+
+    def diff_tuple(self) -> Tuple[int,int,int,int]:
+        mx, mn = self._max, self._min
+        return (mx[0] - mn[0], mx[1] - mn[1], mx[2] - mn[2], mx[3] - mn[3])
+
+    def _second_min(self, j: int) -> float:
+        """Ελάχιστη τιμή αν αφαιρεθεί ΕΝΑ τμήμα από το τρέχον min (inf αν δεν μένει κανένα)."""
+        hist, mn = self._hist[j], self._min[j]
+        if hist[mn] > 1:
+            return mn
+        for v in range(mn + 1, len(hist)):
+            if hist[v]:
+                return v
+        return math.inf
+
+    def ranges_ok(self, cfg: Step4Config) -> bool:
+        return _diffs_ok(self.diff_tuple(), cfg)
+
+    def penalty(self) -> int:
+        return _penalty_from_diffs(self.diff_tuple())
+
+    def weighted_score(self, cfg: Step4Config) -> float:
+        m = np.maximum(self.mat, 0)
+        v_tot, v_grk = _pvariance_cols(m[:, [0, 3]])
+        v_gen = _pvariance_cols((m[:, 1] - m[:, 2])[:, None])[0]
+        return cfg.w_pop_variance*v_tot + cfg.w_gender_variance*v_gen + cfg.w_greek_variance*v_grk
+
+    def batch_eval(self, delta: np.ndarray, size: int, cfg: Step4Config) -> Tuple[np.ndarray,np.ndarray,np.ndarray]:
+        """
+        Προβολή τοποθέτησης της ομάδας σε ΚΑΘΕ τμήμα ταυτόχρονα (broadcasting, χωρίς simulate/undo).
+        Επιστρέφει (weighted scores, ranges ok, χωράει στο cap) — ένα στοιχείο ανά τμήμα.
+        """
+        m = self.mat
+        k = m.shape[0]
+        fits = m[:, 0] + size <= cfg.cap_per_class
+        # variance μέσω αθροισμάτων: S1' = S1 + d, S2'(c) = S2 + 2·x_c·d + d²
+        cols = np.column_stack([m[:, 0], m[:, 1] - m[:, 2], m[:, 3]])
+        d = np.array([delta[0], delta[1] - delta[2], delta[3]], dtype=np.int64)
+        s1 = cols.sum(axis=0) + d
+        s2 = (cols * cols).sum(axis=0) + 2 * cols * d + d * d
+        if k > 1:
+            var = (k * s2 - s1 * s1) / float(k * k)
+        else:
+            var = np.zeros((k, 3), dtype=float)
+        scores = cfg.w_pop_variance*var[:, 0] + cfg.w_gender_variance*var[:, 1] + cfg.w_greek_variance*var[:, 2]
+        # ranges από τα τρέχοντα max/min (delta ≥ 0): νέο max = max(max, x_c+d),
+        # νέο min = min(min χωρίς το c, x_c+d) — O(K) συνολικά, χωρίς K simulate/undo
+        moved = m + np.asarray(delta, dtype=np.int64)
+        mx = np.asarray(self._max, dtype=float)
+        mn = np.asarray(self._min, dtype=float)
+        mn_wo = np.asarray([self._second_min(j) for j in range(len(METRIC_KEYS))], dtype=float)
+        rest_min = np.where(m == mn, mn_wo, mn)
+        rng = np.maximum(mx, moved) - np.minimum(rest_min, moved)
+        ok = ((rng[:, 0] <= cfg.max_pop_diff) & (rng[:, 3] <= cfg.max_greek_diff)
+              & (rng[:, 1] <= cfg.max_gender_diff) & (rng[:, 2] <= cfg.max_gender_diff))
+        return scores, ok, fits
+
+    def to_dict(self) -> Dict[str,Dict[str,int]]:
+        return {c: {k: int(v) for k, v in zip(METRIC_KEYS, row)} for c, row in zip(self.classes, self.mat)}
 
 # ------------------------- Core algorithm ---------------------
 
 def _base_assignment_series(df: pd.DataFrame) -> pd.Series:
-    step_cols = _find_step_cols(df)
-    base = pd.Series(index=df.index, dtype=object)
-    for ridx, row in df.iterrows():
-        val = _get_current_assignment_row(row, step_cols)
-        if val is not None:
-            base.loc[ridx] = val
-    return base
-
-def _classes_from_base(base: pd.Series) -> List[str]:
-    classes = sorted(set(str(v) for v in base.dropna().unique().tolist()))
-    return [c for c in classes if c.strip() != ""]
-
-def _init_metrics_from_base(df: pd.DataFrame, base: pd.Series, classes: List[str]) -> Dict[str,Dict[str,int]]:
-    mets = empty_metrics(classes)
-    class_set = set(classes)
-    for idx, cl in base.items():
-        if pd.isna(cl):
-            continue
-        cl = str(cl)
-        if cl not in class_set:
-            continue
-        apply_student_to_metrics(df, idx, cl, mets)
-    return mets
+    base_cat, _ = _resolve_base_assignment(df)
+    return pd.Series(np.asarray(base_cat, dtype=object), index=df.index, dtype=object)
+
+def _init_metrics_state(df: pd.DataFrame, base: pd.Series, classes: List[str], vecs: np.ndarray) -> Step4Metrics:
+    return Step4Metrics.from_base(df, base, classes, vecs)
 
-def _dyad_catalog(df: pd.DataFrame, dyads: List[Tuple[int,int]]) -> List[Dict[str,Any]]:
+def _dyad_items(df: pd.DataFrame, dyads: List[Tuple[int,int]], graph: _RosterGraph) -> List[Dict[str,Any]]:
+    """Κατηγορία & delta ανά δυάδα από το roster cache (χωρίς df.loc ανά μαθητή)."""
+    pos = df.index.get_indexer([sid for pair in dyads for sid in pair]).reshape(-1, 2) if dyads else np.zeros((0, 2), dtype=np.int64)
     info = []
-    cat_counts = {}
-    for (i,j) in dyads:
-        rows = [df.loc[i], df.loc[j]]
-        cat = group_category(rows)
+    for (i,j), (pi,pj) in zip(dyads, pos.tolist()):
+        cat = graph.category((pi, pj))
         key = (cat["gender_cat"], cat["greek_cat"])
-        cat_counts[key] = cat_counts.get(key, 0) + 1
-        info.append({"pair": (i,j), "size": 2, "cat": cat, "key": key})
+        info.append({"pair": (i,j), "size": 2, "cat": cat, "key": key, "delta": graph.vecs[pi] + graph.vecs[pj]})
+    return info
+
+def _dyad_catalog(df: pd.DataFrame, dyads: List[Tuple[int,int]], graph: Optional[_RosterGraph] = None) -> List[Dict[str,Any]]:
+    info = _dyad_items(df, dyads, graph if graph is not None else _roster_graph(df))
+    cat_counts = {}
+    for item in info:
+        cat_counts[item["key"]] = cat_counts.get(item["key"], 0) + 1
     # scarcity = 1 / count; rare categories first
     for item in info:
         cnt = cat_counts[item["key"]]
@@ -323,16 +502,95 @@ def _dyad_catalog(df: pd.DataFrame, dyads: List[Tuple[int,int]]) -> List[Dict[st
     info.sort(key=lambda x: (-x["scarcity"], x["pair"]))
     return info
 
-def _class_weighted_score(mets: Dict[str,Dict[str,int]], cfg: Step4Config) -> float:
-    v_tot, v_gen, v_grk = variance_score(mets)
-    return cfg.w_pop_variance*v_tot + cfg.w_gender_variance*v_gen + cfg.w_greek_variance*v_grk
-
-def _place_pair(df: pd.DataFrame, pair: Tuple[int,int], cl: str, mets: Dict[str,Dict[str,int]]) -> None:
-    apply_student_to_metrics(df, pair[0], cl, mets)
-    apply_student_to_metrics(df, pair[1], cl, mets)
-
-def _would_break_cap(mets: Dict[str,Dict[str,int]], cl: str, size: int, cfg: Step4Config) -> bool:
-    return (mets.get(cl, {"total":0})["total"] + size) > cfg.cap_per_class
+def _remaining_deltas(items: List[Dict[str,Any]]) -> np.ndarray:
+    """suffix[i] = άθροισμα delta των ομάδων items[i:] (το «μείγμα» που μένει να τοποθετηθεί)."""
+    suffix = np.zeros((len(items) + 1, len(METRIC_KEYS)), dtype=np.int64)
+    for i in range(len(items) - 1, -1, -1):
+        suffix[i] = suffix[i + 1] + items[i]["delta"]
+    return suffix
+
+def _fill_level(vals_sorted: List[int], budget: int) -> float:
+    """Υψηλότερο επίπεδο L ώστε Σ max(0, L - x) ≤ budget (water-filling στα χαμηλότερα τμήματα)."""
+    level, used, k = vals_sorted[0], 0, len(vals_sorted)
+    for i in range(1, k + 1):
+        nxt = vals_sorted[i] if i < k else math.inf
+        need = (nxt - level) * i
+        if used + need > budget:
+            return level + (budget - used) // i
+        used += need
+        level = nxt
+    return level
+
+def _range_lower_bounds(state: Step4Metrics, remaining: np.ndarray) -> Tuple[int,int,int,int]:
+    """
+    Admissible κάτω όριο για τα τελικά ranges (total, boys, girls, greek_good):
+    οι τιμές μόνο αυξάνονται, άρα max_τελικό ≥ max_τώρα, και στην καλύτερη περίπτωση
+    οι υπόλοιπες μονάδες «γεμίζουν» τα χαμηλότερα τμήματα (χαλάρωση: χωρίς cap/σύζευξη).
+    """
+    if not len(state.classes):
+        return (0, 0, 0, 0)
+    cols = np.sort(state.mat, axis=0).T.tolist()
+    out = []
+    for j, vals in enumerate(cols):
+        level = _fill_level(vals, int(remaining[j]))
+        out.append(int(max(0, vals[-1] - level)))
+    return tuple(out)
+
+class _BestK:
+    """Κρατά τις k καλύτερες λύσεις ανά (penalty, diffs)· σε ισοβαθμία προηγείται η παλαιότερη."""
+
+    def __init__(self, k: int):
+        self.k = max(1, int(k))
+        self._heap: List[Tuple[Tuple[int,...], int, Dict[str,Any]]] = []
+        self._seq = 0
+
+    def full(self) -> bool:
+        return len(self._heap) >= self.k
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def worst(self) -> Optional[Tuple[int,...]]:
+        return tuple(-x for x in self._heap[0][0]) if self._heap else None
+
+    def accepts(self, key: Tuple[int,...]) -> bool:
+        return not self.full() or key < self.worst()
+
+    def push(self, key: Tuple[int,...], sol: Dict[str,Any]) -> None:
+        self._seq += 1
+        entry = (tuple(-x for x in key), -self._seq, sol)
+        if not self.full():
+            heapq.heappush(self._heap, entry)
+        elif key < self.worst():
+            heapq.heapreplace(self._heap, entry)
+
+    def sorted(self) -> List[Dict[str,Any]]:
+        return [sol for _, _, sol in sorted(self._heap, key=lambda e: (tuple(-x for x in e[0]), -e[1]))]
+
+def _member_rows(df: pd.DataFrame, items: List[Dict[str,Any]]) -> Tuple[np.ndarray,np.ndarray]:
+    """(θέσεις γραμμών όλων των μελών με τη σειρά των items, μέγεθος κάθε ομάδας)."""
+    rows = df.index.get_indexer([sid for it in items for sid in it["pair"]]).astype(np.int64)
+    sizes = np.array([len(it["pair"]) for it in items], dtype=np.int64)
+    return rows, sizes
+
+def _sparse_solution(rows: np.ndarray, sizes: np.ndarray, choice: List[int],
+                     state: Step4Metrics, pen: int) -> Dict[str,Any]:
+    """Λύση ως (θέσεις γραμμών, κωδικοί τμημάτων) — χωρίς Series μεγέθους N."""
+    codes = np.repeat(np.asarray(choice, dtype=np.int32), sizes)
+    return {"rows": rows, "codes": codes, "metrics": state.to_dict(), "penalty": pen}
+
+def _solution_column(sol: Dict[str,Any], base_values: np.ndarray, classes: List[str]) -> np.ndarray:
+    """Στήλη ΒΗΜΑ4 με μία vectorised ανάθεση πάνω στη βάση (fill-forward Βημάτων 1–3)."""
+    col = base_values.copy()
+    col[sol["rows"]] = np.asarray(classes, dtype=object)[sol["codes"]]
+    return col
+
+def _bound_prunes(state: Step4Metrics, remaining: np.ndarray, top: _BestK, cfg: Step4Config) -> bool:
+    """True αν κανένα φύλλο κάτω από τον κόμβο δεν μπορεί να είναι εφικτό ή να μπει στο top-k."""
+    lb = _range_lower_bounds(state, remaining)
+    if not _diffs_ok(lb, cfg):
+        return True
+    return not top.accepts((_penalty_from_diffs(lb),) + lb)
 
 def generate_scenarios_for_dyads_v2(df: pd.DataFrame,
                                     dyads: List[Tuple[int,int]],
@@ -340,99 +598,72 @@ def generate_scenarios_for_dyads_v2(df: pd.DataFrame,
                                     classes: List[str],
                                     cfg: Step4Config) -> List[Dict[str,Any]]:
     """Backtracking με incremental metrics, scarcity ordering & weighted class scoring."""
-    base_metrics = _init_metrics_from_base(df, base_assign, classes)
-    dyad_info = _dyad_catalog(df, dyads)
+    graph = _roster_graph(df)
+    state = _init_metrics_state(df, base_assign, classes, graph.vecs)  # working metrics (K×4)
+    dyad_info = _dyad_catalog(df, dyads, graph)
 
-    solutions: List[Dict[str,Any]] = []
-    new_assign: Dict[int,str] = {}
-    mets = {c: m.copy() for c,m in base_metrics.items()}  # working metrics
+    remaining = _remaining_deltas(dyad_info)
+    top = _BestK(cfg.max_scenarios)
+    rows, sizes = _member_rows(df, dyad_info)
+    choice: List[int] = [-1] * len(dyad_info)
+    nodes = 0
 
     def backtrack(idx: int):
-        if len(solutions) >= cfg.max_scenarios:
+        nonlocal nodes
+        nodes += 1
+        if nodes > cfg.max_nodes:
             return
         if idx >= len(dyad_info):
             # accept if ranges ok
-            if not ranges_ok(mets, cfg): return
-            pen = penalty_score(mets)
-            assign_ser = pd.Series(index=df.index, dtype=object)
-            for sid, cl in new_assign.items():
-                assign_ser.loc[sid] = cl
-            solutions.append({"assign": assign_ser, "metrics": {c: m.copy() for c,m in mets.items()}, "penalty": pen})
+            if not state.ranges_ok(cfg): return
+            pen = state.penalty()
+            key = (pen,) + state.diff_tuple()
+            if not top.accepts(key): return
+            top.push(key, _sparse_solution(rows, sizes, choice, state, pen))
+            return
+        if _bound_prunes(state, remaining[idx], top, cfg):
             return
 
         item = dyad_info[idx]
-        pair, size = item["pair"], item["size"]
+        size, delta = item["size"], item["delta"]
 
-        # order classes by lowest projected weighted score
-        class_scores: List[Tuple[float,str]] = []
-        for cl in classes:
-            if _would_break_cap(mets, cl, size, cfg):
-                continue
-            # simulate
-            _place_pair(df, pair, cl, mets)
-            ok_now = ranges_ok(mets, cfg)  # early pruning (tight bound)
-            score = _class_weighted_score(mets, cfg) + (1000.0 if not ok_now else 0.0)
-            # undo
-            # We need to revert metrics: subtract pair
-            # Create a cheap revert by manual subtraction
-            for sid in pair:
-                row = df.loc[sid]
-                m = mets[cl]
-                m["total"] -= 1
-                g = _gender_norm(row.get("ΦΥΛΟ",""))
-                if g == "ΑΓΟΡΙ": m["boys"] -= 1
-                elif g == "ΚΟΡΙΤΣΙ": m["girls"] -= 1
-                if _greek_norm(row.get("ΚΑΛΗ_ΓΝΩΣΗ_ΕΛΛΗΝΙΚΩΝ","")) == "Ν": m["greek_good"] -= 1
-            class_scores.append((score, cl))
-
-        class_scores.sort(key=lambda t: t[0])
-
-        for _, cl in class_scores:
-            if len(solutions) >= cfg.max_scenarios:
+        # order classes by lowest projected weighted score (all K classes in one batch)
+        scores, ok_now, fits = state.batch_eval(delta, size, cfg)
+        scores = scores + np.where(ok_now, 0.0, 1000.0)  # early pruning (tight bound)
+        cand = np.flatnonzero(fits)
+        class_order = cand[np.argsort(scores[cand], kind="stable")]
+
+        for ci in class_order.tolist():
+            if nodes > cfg.max_nodes:
                 break
             # apply
-            for sid in pair: new_assign[sid] = cl
-            _place_pair(df, pair, cl, mets)
+            choice[idx] = ci
+            state.place(ci, delta)
 
             # deeper
             backtrack(idx+1)
 
             # revert
-            for sid in pair: del new_assign[sid]
-            # subtract pair from mets
-            for sid in pair:
-                row = df.loc[sid]
-                m = mets[cl]
-                m["total"] -= 1
-                g = _gender_norm(row.get("ΦΥΛΟ",""))
-                if g == "ΑΓΟΡΙ": m["boys"] -= 1
-                elif g == "ΚΟΡΙΤΣΙ": m["girls"] -= 1
-                if _greek_norm(row.get("ΚΑΛΗ_ΓΝΩΣΗ_ΕΛΛΗΝΙΚΩΝ","")) == "Ν": m["greek_good"] -= 1
+            choice[idx] = -1
+            state.unplace(ci, delta)
 
     backtrack(0)
 
-    # sort & tie-breakers
-    def diffs_tuple(m):
-        d_pop, d_boys, d_girls, d_good = metrics_diff_tuple(m)
-        return (d_pop, d_boys, d_girls, d_good)
-    solutions.sort(key=lambda s: (s["penalty"],) + diffs_tuple(s["metrics"]))
-    return solutions[:cfg.max_scenarios]
+    # best-k: ήδη ταξινομημένες ανά (penalty, diffs)
+    return top.sorted()
 
 
 
 def generate_scenarios_for_dyads_ideal(df, dyads, base_assign, classes, cfg):
     # Fallback minimal ideal strategy: equalize category counts per class with alternation.
     K = len(classes)
-    mets = _init_metrics_from_base(df, base_assign, classes)
-    # Build category counts and dyads per category
-    info = []
+    graph = _roster_graph(df)
+    state = _init_metrics_state(df, base_assign, classes, graph.vecs)
+    # Build category counts and dyads per category (gender_cat/greek_cat from roster cache)
+    info = _dyad_items(df, dyads, graph)
     cat_counts = {}
-    for (i,j) in dyads:
-        rows = [df.loc[i], df.loc[j]]
-        cat = group_category(rows)  # uses gender_cat/greek_cat
-        key = (cat["gender_cat"], cat["greek_cat"])
-        cat_counts[key] = cat_counts.get(key, 0) + 1
-        info.append({"pair": (i,j), "key": key})
+    for item in info:
+        cat_counts[item["key"]] = cat_counts.get(item["key"], 0) + 1
     # Ideal per category (students)
     per_class_cat = {key: {cl:0 for cl in classes} for key in cat_counts.keys()}
     ideals = {key: round((sum(per_class_cat[key].values()) + 2*sum(1 for x in info if x["key"]==key))/max(1,K)) for key in cat_counts.keys()}
@@ -440,73 +671,122 @@ def generate_scenarios_for_dyads_ideal(df, dyads, base_assign, classes, cfg):
     # Order by scarcity
     info.sort(key=lambda x: -1.0/cat_counts[x["key"]])
 
+    remaining = _remaining_deltas(info)
     last_key = {cl: None for cl in classes}
-    sols = []
-    assign = {}
+    top = _BestK(cfg.max_scenarios)
+    rows, sizes = _member_rows(df, info)
+    choice = [-1] * len(info)
+    nodes = 0
     def backtrack(pos):
-        if len(sols) >= cfg.max_scenarios: return
+        nonlocal nodes
+        nodes += 1
+        if nodes > cfg.max_nodes: return
         if pos >= len(info):
-            if not ranges_ok(mets, cfg): return
-            pen = penalty_score(mets)
-            ser = pd.Series(index=df.index, dtype=object)
-            for sid, cl in assign.items(): ser.loc[sid] = cl
-            sols.append({"assign": ser, "metrics": {c: m.copy() for c,m in mets.items()}, "penalty": pen})
+            if not state.ranges_ok(cfg): return
+            pen = state.penalty()
+            key = (pen,) + state.diff_tuple()
+            if not top.accepts(key): return
+            top.push(key, _sparse_solution(rows, sizes, choice, state, pen))
             return
+        if _bound_prunes(state, remaining[pos], top, cfg): return
         item = info[pos]
-        pair, key = item["pair"], item["key"]
+        key, delta = item["key"], item["delta"]
         cands = []
-        for cl in classes:
-            # cap check
-            if _would_break_cap(mets, cl, 2, cfg): 
-                continue
+        # cap check + quick range ok for all classes at once
+        _, ok, fits = state.batch_eval(delta, 2, cfg)
+        for ci in np.flatnonzero(ok & fits).tolist():
+            cl = classes[ci]
             # score by gap to ideal + alternation bonus
             gap = abs((per_class_cat[key][cl] + 2) - ideals[key])
             alt_bonus = -0.5 if (cfg.prefer_opposites and last_key[cl] is not None and last_key[cl] != key) else 0.0
-            # simulate quick range ok
-            _place_pair(df, pair, cl, mets)
-            ok = ranges_ok(mets, cfg)
-            # revert
-            for sid in pair:
-                row = df.loc[sid]; m = mets[cl]
-                m["total"] -= 1
-                g = _gender_norm(row.get("ΦΥΛΟ",""))
-                if g == "ΑΓΟΡΙ": m["boys"] -= 1
-                elif g == "ΚΟΡΙΤΣΙ": m["girls"] -= 1
-                if _greek_norm(row.get("ΚΑΛΗ_ΓΝΩΣΗ_ΕΛΛΗΝΙΚΩΝ","")) == "Ν": m["greek_good"] -= 1
-            if ok:
-                cands.append(((gap + alt_bonus), cl))
+            cands.append(((gap + alt_bonus), ci))
         if not cands:
             return
         cands.sort(key=lambda x: x[0])
-        best = [cl for sc,cl in cands if sc == cands[0][0]]
-        for cl in best[:max(2, cfg.max_scenarios - len(sols))]:
-            assign[pair[0]] = cl; assign[pair[1]] = cl
-            _place_pair(df, pair, cl, mets)
+        best = [ci for sc,ci in cands if sc == cands[0][0]]
+        for ci in best[:max(2, cfg.max_scenarios - len(top))]:
+            if nodes > cfg.max_nodes: break
+            cl = classes[ci]
+            choice[pos] = ci
+            state.place(ci, delta)
             per_class_cat[key][cl] += 2
             prev = last_key[cl]; last_key[cl] = key
             backtrack(pos+1)
             last_key[cl] = prev
             per_class_cat[key][cl] -= 2
-            for sid in pair:
-                del assign[sid]
-                row = df.loc[sid]; m = mets[cl]
-                m["total"] -= 1
-                g = _gender_norm(row.get("ΦΥΛΟ",""))
-                if g == "ΑΓΟΡΙ": m["boys"] -= 1
-                elif g == "ΚΟΡΙΤΣΙ": m["girls"] -= 1
-                if _greek_norm(row.get("ΚΑΛΗ_ΓΝΩΣΗ_ΕΛΛΗΝΙΚΩΝ","")) == "Ν": m["greek_good"] -= 1
+            choice[pos] = -1
+            state.unplace(ci, delta)
     backtrack(0)
-    sols.sort(key=lambda s: (s["penalty"],) + metrics_diff_tuple(s["metrics"]))
-    return sols[:cfg.max_scenarios]
+    return top.sorted()
+
+def generate_scenarios_for_dyads_beam(df: pd.DataFrame,
+                                      dyads: List[Tuple[int,int]],
+                                      base_assign: pd.Series,
+                                      classes: List[str],
+                                      cfg: Step4Config) -> List[Dict[str,Any]]:
+    """
+    Beam search: σε κάθε δυάδα κρατά τις cfg.beam_width καλύτερες μερικές λύσεις
+    κατά (προβλεπόμενο penalty από το κάτω όριο, weighted score). Οι τελικές λύσεις
+    επιλέγονται greedy ώστε να απέχουν ανά δύο ≥ cfg.min_hamming δυάδες.
+    Κόστος O(D · beam_width · K), ανεξάρτητο από το μέγεθος του δέντρου.
+    """
+    graph = _roster_graph(df)
+    root = _init_metrics_state(df, base_assign, classes, graph.vecs)
+    dyad_info = _dyad_catalog(df, dyads, graph)
+    remaining = _remaining_deltas(dyad_info)
+    rows, sizes = _member_rows(df, dyad_info)
+    width = max(1, int(cfg.beam_width))
+
+    beam: List[Tuple[Step4Metrics, List[int]]] = [(root, [])]
+    for idx, item in enumerate(dyad_info):
+        size, delta = item["size"], item["delta"]
+        ranked = []
+        for b, (state, _) in enumerate(beam):
+            scores, _, fits = state.batch_eval(delta, size, cfg)
+            for ci in np.flatnonzero(fits).tolist():
+                state.place(ci, delta)
+                lb = _range_lower_bounds(state, remaining[idx + 1])
+                state.unplace(ci, delta)
+                if not _diffs_ok(lb, cfg):
+                    continue
+                ranked.append(((_penalty_from_diffs(lb),) + lb + (float(scores[ci]),), b, ci))
+        if not ranked:
+            return []
+        ranked.sort(key=lambda t: t[0])
+        next_beam = []
+        for _, b, ci in ranked[:width]:
+            state, choice = beam[b]
+            child = state.copy()
+            child.place(ci, delta)
+            next_beam.append((child, choice + [ci]))
+        beam = next_beam
+
+    finals = []
+    for state, choice in beam:
+        if not state.ranges_ok(cfg):
+            continue
+        pen = state.penalty()
+        finals.append(((pen,) + state.diff_tuple() + (float(state.weighted_score(cfg)),), state, choice))
+    finals.sort(key=lambda t: t[0])
+
+    picked: List[np.ndarray] = []
+    sols = []
+    for _, state, choice in finals:
+        if len(sols) >= cfg.max_scenarios:
+            break
+        vec = np.asarray(choice, dtype=np.int64)
+        if any(int(np.count_nonzero(vec != other)) < max(1, cfg.min_hamming) for other in picked):
+            continue
+        picked.append(vec)
+        sols.append(_sparse_solution(rows, sizes, choice, state, state.penalty()))
+    return sols
 # ------------------------- Public APIs --------------------------------------
 
 def run_step4_multi_with_fill_v2(df: pd.DataFrame, config: Step4Config = Step4Config()) -> pd.DataFrame:
     _require_columns(df)
-    base_assign = _base_assignment_series(df)
-    classes = _detect_classes(df)
-    if not classes:
-        # αν δεν βρεθούν από στήλες 1..3, πάρε από base
-        classes = _classes_from_base(base_assign)
+    # ένα πέρασμα: βάση (ΒΗΜΑ3→2→1) + labels τμημάτων
+    base_cat, classes = _resolve_base_assignment(df)
+    base_assign = pd.Series(np.asarray(base_cat, dtype=object), index=df.index, dtype=object)
     if not classes:
         raise InsufficientDataError("Δεν εντοπίστηκαν labels τμημάτων από τα Βήματα 1–3.")
     if len(classes) < 2:
@@ -525,23 +805,27 @@ def run_step4_multi_with_fill_v2(df: pd.DataFrame, config: Step4Config = Step4Co
         out["Σύνοψη_ΒΗΜΑ4"] = "Δεν βρέθηκαν πλήρως αμοιβαίες δυάδες μεταξύ μη-τοποθετημένων."
         return out
 
-    sols = (generate_scenarios_for_dyads_ideal(df, dyads, base_assign, classes, config)
-        if getattr(config, 'use_ideal_strategy', True) else
-        generate_scenarios_for_dyads_v2(df, dyads, base_assign, classes, config))
+    if getattr(config, 'use_beam_search', False):
+        sols = generate_scenarios_for_dyads_beam(df, dyads, base_assign, classes, config)
+    else:
+        sols = (generate_scenarios_for_dyads_ideal(df, dyads, base_assign, classes, config)
+            if getattr(config, 'use_ideal_strategy', True) else
+            generate_scenarios_for_dyads_v2(df, dyads, base_assign, classes, config))
     if not sols:
         out["Σύνοψη_ΒΗΜΑ4"] = "Δεν βρέθηκαν αποδεκτά σενάρια με βάση τα όρια."
         return out
 
-    # Γράψε έως 5 σενάρια
+    # Γράψε έως 5 σενάρια — FILLED: κάθε στήλη ξεκινά από τη βάση (Βήματα 1–3)
+    # και οι τοποθετήσεις του Βήματος 4 γράφονται με μία vectorised ανάθεση
+    base_values = base_assign.to_numpy(dtype=object)
+    written = set()
     for k,sol in enumerate(sols, start=1):
         col = f"ΒΗΜΑ4_ΣΕΝΑΡΙΟ_{k}"
-        out[col] = np.nan
-        for idx, cl in sol["assign"].items():
-            if pd.notna(cl):
-                out.loc[idx, col] = cl
+        out[col] = _solution_column(sol, base_values, classes)
+        written.add(col)
 
-    # FILLED: μεταφορά όλων των υπαρχουσών αναθέσεων (βάση)
-    for c in [c for c in out.columns if re.match(r"^ΒΗΜΑ4_ΣΕΝΑΡΙΟ_\d+$", str(c))]:
+    # προϋπάρχουσες στήλες ΒΗΜΑ4: μεταφορά υπαρχουσών αναθέσεων (βάση)
+    for c in [c for c in out.columns if re.match(r"^ΒΗΜΑ4_ΣΕΝΑΡΙΟ_\d+$", str(c)) and c not in written]:
         out[c] = out[c].where(out[c].notna(), base_assign)
 
     # penalties snapshot στην πρώτη γραμμή (αν θες να επιλέγεις “best” αργότερα)
@@ -553,18 +837,44 @@ def run_step4_multi_with_fill_v2(df: pd.DataFrame, config: Step4Config = Step4Co
 
     return out
 
-def export_step4_nextcol_full_multi_filled_v2(step3_xlsx_path: str, out_xlsx_path: str, config: Step4Config = Step4Config()) -> str:
+# ------------------------- Parallel sheet solving ------------------------
+
+def _solve_step4_sheet(job: Tuple[str, pd.DataFrame, Step4Config]) -> Tuple[Optional[pd.DataFrame], Optional[BaseException]]:
+    """Worker: λύνει ένα sheet· τα σφάλματα επιστρέφονται (όχι raise) για τη σύνοψη."""
+    _, df, cfg = job
+    try:
+        return run_step4_multi_with_fill_v2(df, config=cfg), None
+    except Exception as ex:
+        return None, ex
+
+def _solve_step4_sheets(frames: List[Tuple[str, pd.DataFrame]],
+                        config: Step4Config,
+                        workers: Optional[int] = 1) -> List[Tuple[Optional[pd.DataFrame], Optional[BaseException]]]:
+    """
+    Parse → solve (σειριακά ή, με workers > 1, σε process pool) → ο caller γράφει με τη σειρά των sheets.
+    Όλα τα sheets λύνονται με το ίδιο config, όπως στη σειριακή ροή.
+    """
+    jobs = [(sh, df, config) for sh, df in frames]
+    return run_jobs(_solve_step4_sheet, jobs, workers)
+
+def _is_summary_sheet(sh: str) -> bool:
+    return str(sh).strip().lower().startswith("σύνοψη")
+
+def export_step4_nextcol_full_multi_filled_v2(step3_xlsx_path: str, out_xlsx_path: str, config: Step4Config = Step4Config(),
+                                              workers: Optional[int] = 1) -> str:
     xls = pd.ExcelFile(step3_xlsx_path)
+    sheets = [(sh, xls.parse(sh)) for sh in xls.sheet_names]
+    solvable = [(sh, df) for sh, df in sheets if not _is_summary_sheet(sh)]
+    solved = dict(zip([sh for sh, _ in solvable], _solve_step4_sheets(solvable, config, workers)))
     summary_rows = []
     with pd.ExcelWriter(out_xlsx_path, engine="openpyxl") as writer:
-        for sh in xls.sheet_names:
-            df = xls.parse(sh)
-            if str(sh).strip().lower().startswith("σύνοψη"):
+        for sh, df in sheets:
+            if _is_summary_sheet(sh):
                 # αντιγράφουμε σύνοψη, για πληρότητα
                 df.to_excel(writer, index=False, sheet_name=str(sh)[:31])
                 continue
-            try:
-                out_df = run_step4_multi_with_fill_v2(df, config=config)
+            out_df, ex = solved[sh]
+            if ex is None:
                 step4_cols = [c for c in out_df.columns if re.match(r"^ΒΗΜΑ4_ΣΕΝΑΡΙΟ_\d+$", str(c))]
                 placed_counts = [int(out_df[c].notna().sum()) for c in step4_cols] if step4_cols else []
                 summary_rows.append({
@@ -572,7 +882,7 @@ def export_step4_nextcol_full_multi_filled_v2(step3_xlsx_path: str, out_xlsx_pat
                     "Σενάρια ΒΗΜΑ4": len(step4_cols),
                     "Τοποθετημένοι (ανά σενάριο)": ", ".join(map(str, placed_counts)) if placed_counts else "(κανένας)"
                 })
-            except Exception as ex:
+            else:
                 out_df = df.copy()
                 out_df["Σύνοψη_ΒΗΜΑ4"] = f"ERROR: {type(ex).__name__}: {ex}"
                 summary_rows.append({
@@ -612,16 +922,17 @@ def _pick_best_step4_col(df: pd.DataFrame) -> Tuple[Optional[int], Optional[str]
     k = int(re.search(r"\d+$", first_col).group(0))
     return k, first_col
 
-def export_step3_to_per_scenario_exact_filled_v2(step3_xlsx_path: str, out_xlsx_path: str, config: Step4Config = Step4Config()) -> str:
+def export_step3_to_per_scenario_exact_filled_v2(step3_xlsx_path: str, out_xlsx_path: str, config: Step4Config = Step4Config(),
+                                                 workers: Optional[int] = 1) -> str:
     TARGET_BASE_COLS = ['Α/Α','ΟΝΟΜΑ','ΦΥΛΟ','ΖΩΗΡΟΣ','ΙΔΙΑΙΤΕΡΟΤΗΤΑ','ΠΑΙΔΙ_ΕΚΠΑΙΔΕΥΤΙΚΟΥ','ΚΑΛΗ_ΓΝΩΣΗ_ΕΛΛΗΝΙΚΩΝ','ΦΙΛΟΙ']
     xls = pd.ExcelFile(step3_xlsx_path)
+    frames = [(sh, xls.parse(sh)) for sh in xls.sheet_names if not _is_summary_sheet(sh)]
+    solved = _solve_step4_sheets(frames, config, workers)
     with pd.ExcelWriter(out_xlsx_path, engine="openpyxl") as writer:
         chosen_rows = []
-        for sh in xls.sheet_names:
-            if str(sh).strip().lower().startswith("σύνοψη"):
-                continue
-            df = xls.parse(sh)
-            filled_df = run_step4_multi_with_fill_v2(df, config=config)
+        for (sh, _), (filled_df, ex) in zip(frames, solved):
+            if ex is not None:
+                raise ex
             m = re.search(r"ΒΗΜΑ3_ΣΕΝΑΡΙΟ_(\d+)", str(sh))
             sid = int(m.group(1)) if m else 1
 
@@ -677,7 +988,8 @@ def apply_step4_with_enhanced_strategy(
     return run_step4_multi_with_fill_v2(df, config=cfg)
 
 
-def export_step3_to_per_scenario_exact_like_template(step3_xlsx_path: str, out_xlsx_path: str, config: Step4Config = Step4Config()) -> str:
+def export_step3_to_per_scenario_exact_like_template(step3_xlsx_path: str, out_xlsx_path: str, config: Step4Config = Step4Config(),
+                                                     workers: Optional[int] = 1) -> str:
     """
     Export EXACTLY like the provided template:
     - Only sheets named 'ΣΕΝΑΡΙΟ_{k}'.
@@ -686,12 +998,12 @@ def export_step3_to_per_scenario_exact_like_template(step3_xlsx_path: str, out_x
     """
     TARGET_BASE_COLS = ['Α/Α','ΟΝΟΜΑ','ΦΥΛΟ','ΖΩΗΡΟΣ','ΙΔΙΑΙΤΕΡΟΤΗΤΑ','ΠΑΙΔΙ_ΕΚΠΑΙΔΕΥΤΙΚΟΥ','ΚΑΛΗ_ΓΝΩΣΗ_ΕΛΛΗΝΙΚΩΝ','ΦΙΛΟΙ']
     xls = pd.ExcelFile(step3_xlsx_path)
+    frames = [(sh, xls.parse(sh)) for sh in xls.sheet_names if not _is_summary_sheet(sh)]
+    solved = _solve_step4_sheets(frames, config, workers)
     with pd.ExcelWriter(out_xlsx_path, engine="openpyxl") as writer:
-        for sh in xls.sheet_names:
-            if str(sh).strip().lower().startswith("σύνοψη"):
-                continue
-            df = xls.parse(sh)
-            filled_df = run_step4_multi_with_fill_v2(df, config=config)
+        for (sh, _), (filled_df, ex) in zip(frames, solved):
+            if ex is not None:
+                raise ex
             m = re.search(r"ΒΗΜΑ3_ΣΕΝΑΡΙΟ_(\d+)", str(sh))
             sid = int(m.group(1)) if m else 1
 
@@ -13,9 +13,11 @@ step_5_ypoloipoi_mathites_CORRECTED_ENHANCED.py
 """
 
 from __future__ import annotations
-import random, re
+import random, re, heapq
 from typing import List, Dict, Tuple, Any, Optional
 import pandas as pd
+from friends_parser import parse_list_cell
+from parallel_jobs import run_jobs
 
 def _auto_num_classes(df: pd.DataFrame, override: Optional[int] = None) -> int:
     """Αυτόματος υπολογισμός αριθμού τμημάτων (25 μαθητές/τμήμα, min=2)."""
@@ -40,27 +42,7 @@ def _is_no(x: Any) -> bool:
     """Έλεγχος αν η τιμή είναι 'όχι'."""
     return _norm_str(x) in NO_TOKENS
 
-def _parse_list_cell(x: Any) -> List[str]:
-    """Parsing λίστας από διάφορα formats (string, list, κ.ά.)."""
-    if isinstance(x, list):
-        return [str(t).strip() for t in x if str(t).strip()]
-    
-    s = "" if pd.isna(x) else str(x)
-    s = s.strip()
-    if not s or s.upper() == "NAN":
-        return []
-    
-    # Δοκιμή python list parsing
-    try:
-        v = eval(s, {}, {})
-        if isinstance(v, list):
-            return [str(t).strip() for t in v if str(t).strip()] 
-    except Exception:
-        pass
-    
-    # Split με διάφορους διαχωριστές
-    parts = re.split(r"[,\|\;/·\n]+", s)
-    return [p.strip() for p in parts if p.strip()]
+_parse_list_cell = parse_list_cell
 
 def _is_good_greek(row: pd.Series) -> bool:
     """Έλεγχος καλής γνώσης ελληνικών (backward/forward compatible)."""
@@ -76,27 +58,45 @@ def _get_class_labels(df: pd.DataFrame, scenario_col: str) -> List[str]:
                    if re.match(r"^Α\d+$", str(v))])
     return labs or [f"Α{i+1}" for i in range(2)]
 
+def _good_greek_mask(df: pd.DataFrame) -> pd.Series:
+    """Vectorised εκδοχή του _is_good_greek για όλο το DataFrame."""
+    if "ΚΑΛΗ_ΓΝΩΣΗ_ΕΛΛΗΝΙΚΩΝ" in df.columns:
+        return df["ΚΑΛΗ_ΓΝΩΣΗ_ΕΛΛΗΝΙΚΩΝ"].map(_is_yes).astype(bool)
+    if "ΓΝΩΣΗ_ΕΛΛΗΝΙΚΩΝ" in df.columns:
+        return df["ΓΝΩΣΗ_ΕΛΛΗΝΙΚΩΝ"].map(_norm_str).isin({"ΚΑΛΗ", "GOOD", "Ν"})
+    return pd.Series(False, index=df.index)
+
+def _class_counts(df: pd.DataFrame, scenario_col: str, labs: List[str]) -> pd.DataFrame:
+    """Ένα groupby πέρασμα: πληθυσμός/αγόρια/κορίτσια/καλή γνώση ανά τμήμα (γραμμές = labs)."""
+    gender = df["ΦΥΛΟ"].astype(str).str.upper()
+    flags = pd.DataFrame({
+        "size": 1,
+        "boys": gender.eq("Α").astype(int),
+        "girls": gender.eq("Κ").astype(int),
+        "greek": _good_greek_mask(df).astype(int),
+    }, index=df.index)
+    in_labs = df[scenario_col].isin(labs)
+    return flags[in_labs].groupby(df.loc[in_labs, scenario_col]).sum().reindex(labs, fill_value=0)
+
 def _count_broken_pairs(df: pd.DataFrame, scenario_col: str) -> int:
-    """Δυναμικός υπολογισμός σπασμένων πλήρως αμοιβαίων φιλιών."""
-    by_class = dict(zip(df["ΟΝΟΜΑ"].astype(str).str.strip(), df[scenario_col].astype(str)))
-    broken = set()
-    
-    for _, r in df.iterrows():
-        if not _is_yes(r.get("ΠΛΗΡΩΣ_ΑΜΟΙΒΑΙΑ", False)):
-            continue
-            
-        me = str(r["ΟΝΟΜΑ"]).strip()
-        c_me = by_class.get(me)
-        
-        for fr in _parse_list_cell(r.get("ΦΙΛΟΙ", [])):
-            if me < fr:  # Αποφυγή διπλής καταμέτρησης
-                friend_row = df[df["ΟΝΟΜΑ"].astype(str).str.strip() == fr]
-                if not friend_row.empty and _is_yes(friend_row.iloc[0].get("ΠΛΗΡΩΣ_ΑΜΟΙΒΑΙΑ", False)):
-                    c_fr = by_class.get(fr)
-                    if pd.notna(c_me) and pd.notna(c_fr) and c_me != c_fr:
-                        broken.add((me, fr))
-    
-    return len(broken)
+    """Δυναμικός υπολογισμός σπασμένων πλήρως αμοιβαίων φιλιών (hash join ονομάτων, O(N + φίλοι))."""
+    if "ΠΛΗΡΩΣ_ΑΜΟΙΒΑΙΑ" not in df.columns:
+        return 0
+    names = df["ΟΝΟΜΑ"].astype(str).str.strip()
+    by_class = dict(zip(names, df[scenario_col].astype(str)))
+    mutual = df["ΠΛΗΡΩΣ_ΑΜΟΙΒΑΙΑ"].map(_is_yes).astype(bool)
+    # ΠΛΗΡΩΣ_ΑΜΟΙΒΑΙΑ της ΠΡΩΤΗΣ γραμμής με κάθε όνομα
+    first_mutual = dict(zip(names[~names.duplicated()], mutual[~names.duplicated()]))
+
+    friends = (df.loc[mutual, "ΦΙΛΟΙ"].map(_parse_list_cell) if "ΦΙΛΟΙ" in df.columns
+               else pd.Series([[] for _ in range(int(mutual.sum()))], index=df.index[mutual], dtype=object))
+    edges = pd.DataFrame({"me": names[mutual], "fr": friends}).explode("fr").dropna(subset=["fr"])
+    edges = edges[edges["me"] < edges["fr"]]  # Αποφυγή διπλής καταμέτρησης
+    edges = edges[edges["fr"].map(lambda fr: first_mutual.get(fr, False)).astype(bool)]
+    c_me = edges["me"].map(by_class)
+    c_fr = edges["fr"].map(by_class)
+    broken = edges[c_me.notna() & c_fr.notna() & (c_me != c_fr)]
+    return int(len(broken.drop_duplicates(subset=["me", "fr"])))
 
 def calculate_penalty_score(df: pd.DataFrame, scenario_col: str, 
                           num_classes: Optional[int] = None) -> int:
@@ -112,30 +112,23 @@ def calculate_penalty_score(df: pd.DataFrame, scenario_col: str,
         num_classes = _auto_num_classes(df, None)
 
     penalty = 0
+    counts = _class_counts(df, scenario_col, labs)
 
     # 1. Ισορροπία Γνώσης Ελληνικών
-    greek_counts = []
-    for lab in labs:
-        sub = df[df[scenario_col] == lab].copy()
-        greek_counts.append(int(sub.apply(_is_good_greek, axis=1).sum()))
-    
+    greek_counts = counts["greek"].tolist()
     if greek_counts:
         greek_diff = max(greek_counts) - min(greek_counts)
         penalty += max(0, greek_diff - 2)  # +1 για κάθε διαφορά > 2
 
     # 2. Ισορροπία Πληθυσμού  
-    class_sizes = [int((df[scenario_col] == lab).sum()) for lab in labs]
+    class_sizes = counts["size"].tolist()
     if class_sizes:
         pop_diff = max(class_sizes) - min(class_sizes)
         penalty += max(0, pop_diff - 1)  # +1 για κάθε διαφορά > 1
 
     # 3. Ισορροπία Φύλου
-    boys_counts = [int(((df[scenario_col] == lab) & 
-                       (df["ΦΥΛΟ"].astype(str).str.upper() == "Α")).sum()) 
-                   for lab in labs]
-    girls_counts = [int(((df[scenario_col] == lab) & 
-                        (df["ΦΥΛΟ"].astype(str).str.upper() == "Κ")).sum()) 
-                    for lab in labs]
+    boys_counts = counts["boys"].tolist()
+    girls_counts = counts["girls"].tolist()
     
     if boys_counts:
         boys_diff = max(boys_counts) - min(boys_counts)
@@ -153,10 +146,42 @@ def calculate_penalty_score(df: pd.DataFrame, scenario_col: str,
     
     penalty += 5 * broken_friendships  # +5 για κάθε σπασμένη φιλία
 
-    return penalty
+    return int(penalty)
+
+class _RangeCounter:
+    """
+    Μετρητής ανά τμήμα με O(1) εύρος (max − min): ιστόγραμμα τιμών + τρέχον max/min.
+    Οι τιμές μόνο αυξάνουν κατά 1, άρα ένα μοναδικό min γίνεται min+1 χωρίς σάρωση.
+    """
+
+    def __init__(self, counts: Dict[str, int]):
+        self.counts = dict(counts)
+        vals = list(self.counts.values()) or [0]
+        self.hist: Dict[int, int] = {}
+        for v in vals:
+            self.hist[v] = self.hist.get(v, 0) + 1
+        self.max, self.min = max(vals), min(vals)
+
+    def range_with(self, lab: str, add: int) -> int:
+        """Εύρος αν το `lab` αυξανόταν κατά `add` (0/1) — χωρίς αλλαγή της κατάστασης."""
+        if not add:
+            return self.max - self.min
+        v = self.counts[lab]
+        new_min = self.min + 1 if (v == self.min and self.hist[v] == 1) else self.min
+        return max(self.max, v + 1) - new_min
+
+    def increment(self, lab: str) -> None:
+        v = self.counts[lab]
+        self.counts[lab] = v + 1
+        self.hist[v] -= 1
+        self.hist[v + 1] = self.hist.get(v + 1, 0) + 1
+        self.max = max(self.max, v + 1)
+        if v == self.min and self.hist[v] == 0:
+            self.min = v + 1
 
 def step5_place_remaining_students(df: pd.DataFrame, scenario_col: str, 
-                                 num_classes: Optional[int] = None) -> Tuple[pd.DataFrame, int]:
+                                 num_classes: Optional[int] = None,
+                                 rng: Optional[random.Random] = None) -> Tuple[pd.DataFrame, int]:
     """
     Βήμα 5: Τοποθέτηση υπολοίπων μαθητών χωρίς (πλήρως αμοιβαίες) φιλίες.
     
@@ -164,6 +189,11 @@ def step5_place_remaining_students(df: pd.DataFrame, scenario_col: str,
     1. Τμήμα με μικρότερο πληθυσμό (< 25 μαθητές)
     2. Σε ισοπαλία: προτίμηση όσων κρατούν διαφορά πληθυσμού ≤2
     3. Σε ισοπαλία: καλύτερη ισορροπία φύλου σε ΌΛΑ τα τμήματα
+
+    Οι μετρητές (μέγεθος/αγόρια/κορίτσια) ανά τμήμα κρατιούνται σε dicts και τα
+    μικρότερα τμήματα βγαίνουν από priority queue· το εύρος αγοριών/κοριτσιών ανά υποψήφιο
+    είναι O(1) (_RangeCounter), άρα κάθε μαθητής κοστίζει O(log K + υποψήφιοι). Οι τοποθετήσεις γράφονται με μία
+    vectorised ανάθεση στο τέλος. Με `rng` (random.Random) η ισοβαθμία είναι ντετερμινιστική.
     """
     df = df.copy()
     labs = _get_class_labels(df, scenario_col)
@@ -186,88 +216,112 @@ def step5_place_remaining_students(df: pd.DataFrame, scenario_col: str,
          (broken_friendship))            # Σπασμένες φιλίες
     )
 
-    remaining_students = df[mask_step5].copy()
+    remaining_students = df[mask_step5]
+
+    # Μετρητές ανά τμήμα (ένα πέρασμα) αντί για full-frame σύγκριση ανά μαθητή
+    gender_raw = df["ΦΥΛΟ"].astype(str).str.upper()
+    assigned = df[scenario_col]
+    sizes = {lab: 0 for lab in labs}
+    boys = {lab: 0 for lab in labs}
+    girls = {lab: 0 for lab in labs}
+    for lab, g in zip(assigned.tolist(), gender_raw.tolist()):
+        if lab in sizes:
+            sizes[lab] += 1
+            boys[lab] += (g == "Α")
+            girls[lab] += (g == "Κ")
+
+    boy_range, girl_range = _RangeCounter(boys), _RangeCounter(girls)
+
+    # Priority queue (μέγεθος, σειρά label) με lazy διαγραφή παλιών εγγραφών
+    order = {lab: i for i, lab in enumerate(labs)}
+    heap = [(sizes[lab], order[lab], lab) for lab in labs]
+    heapq.heapify(heap)
+
+    def _smallest_classes() -> List[str]:
+        while heap and heap[0][0] != sizes[heap[0][2]]:
+            heapq.heappop(heap)
+        min_size = heap[0][0]
+        tied = []
+        while heap and heap[0][0] == min_size:
+            entry = heapq.heappop(heap)
+            if entry[0] == sizes[entry[2]]:
+                tied.append(entry)
+        for entry in tied:
+            heapq.heappush(heap, entry)
+        return [lab for _, _, lab in sorted(tied, key=lambda e: e[1])]
+
+    placed_idx: List[Any] = []
+    placed_cls: List[str] = []
 
     # Διαδοχική τοποθέτηση κάθε μαθητή
-    for _, row in remaining_students.iterrows():
-        name = str(row["ΟΝΟΜΑ"]).strip()
-        gender = str(row["ΦΥΛΟ"]).strip().upper()
-
+    for ridx, gender, g_raw in zip(remaining_students.index.tolist(),
+                                   remaining_students["ΦΥΛΟ"].astype(str).str.strip().str.upper().tolist(),
+                                   gender_raw[mask_step5].tolist()):
         # 1. Εύρεση διαθέσιμων τμημάτων με ελάχιστο πληθυσμό
-        class_sizes = {lab: int((df[scenario_col] == lab).sum()) for lab in labs}
-        min_size = min(class_sizes.values())
-        available_classes = [lab for lab, size in class_sizes.items() 
-                           if size == min_size and size < 25]
-        
+        available_classes = [lab for lab in _smallest_classes() if sizes[lab] < 25]
+
         if not available_classes:
             continue  # Όλα τα τμήματα γεμάτα
 
         if len(available_classes) == 1:
             chosen_class = available_classes[0]
         else:
-            # 2. Προτίμηση υποψηφίων που κρατούν διαφορά πληθυσμού ≤2
-            candidates_with_pop_diff = []
+            # 2. Όλοι οι υποψήφιοι έχουν το ίδιο (ελάχιστο) μέγεθος, άρα η διαφορά πληθυσμού
+            #    μετά την προσθήκη είναι ίδια για όλους — το φίλτρο ≤2 δεν ξεχωρίζει κανέναν.
+            # 3. Ισορροπία φύλου - υπολογισμός για ΌΛΑ τα τμήματα (από τους μετρητές)
+            best_score = float('inf')
+            best_classes = []
             for candidate in available_classes:
-                new_sizes = {lab: int((df[scenario_col] == lab).sum()) + (1 if lab == candidate else 0)
-                           for lab in labs}
-                pop_diff = max(new_sizes.values()) - min(new_sizes.values())
-                candidates_with_pop_diff.append((candidate, pop_diff))
-            
-            # Φιλτράρισμα: προτίμηση όσων κρατούν pop_diff ≤ 2
-            preferred_pool = [c for c, d in candidates_with_pop_diff if d <= 2]
-            pool = preferred_pool if preferred_pool else [c for c, _ in candidates_with_pop_diff]
-            
-            if len(pool) == 1:
-                chosen_class = pool[0]
-            else:
-                # 3. Ισορροπία φύλου - υπολογισμός για ΌΛΑ τα τμήματα
-                best_score = float('inf')
-                best_classes = []
-                
-                for candidate in pool:
-                    # Προσομοίωση προσθήκης μαθητή στο candidate τμήμα
-                    boys_counts = []
-                    girls_counts = []
-                    
-                    for lab in labs:
-                        boys_in_class = int(((df[scenario_col] == lab) & 
-                                           (df["ΦΥΛΟ"].astype(str).str.upper() == "Α")).sum())
-                        girls_in_class = int(((df[scenario_col] == lab) & 
-                                            (df["ΦΥΛΟ"].astype(str).str.upper() == "Κ")).sum())
-                        
-                        # Προσθήκη μαθητή στο candidate
-                        if lab == candidate:
-                            if gender == "Α":
-                                boys_in_class += 1
-                            elif gender == "Κ":
-                                girls_in_class += 1
-                        
-                        boys_counts.append(boys_in_class)
-                        girls_counts.append(girls_in_class)
-                    
-                    # Υπολογισμός διαφοράς φύλου
-                    boys_diff = max(boys_counts) - min(boys_counts) if boys_counts else 0
-                    girls_diff = max(girls_counts) - min(girls_counts) if girls_counts else 0
-                    total_gender_diff = boys_diff + girls_diff
-                    
-                    if total_gender_diff < best_score:
-                        best_score = total_gender_diff
-                        best_classes = [candidate]
-                    elif total_gender_diff == best_score:
-                        best_classes.append(candidate)
-                
-                # Τυχαία επιλογή σε ισοπαλία
-                chosen_class = random.choice(best_classes)
-
-        # Τοποθέτηση μαθητή
-        df.loc[df["ΟΝΟΜΑ"] == name, scenario_col] = chosen_class
+                total_gender_diff = (boy_range.range_with(candidate, 1 if gender == "Α" else 0)
+                                     + girl_range.range_with(candidate, 1 if gender == "Κ" else 0))
+                if total_gender_diff < best_score:
+                    best_score = total_gender_diff
+                    best_classes = [candidate]
+                elif total_gender_diff == best_score:
+                    best_classes.append(candidate)
+
+            # Τυχαία επιλογή σε ισοπαλία
+            chosen_class = (rng or random).choice(best_classes)
+
+        # Τοποθέτηση μαθητή (μόνο στους μετρητές· μία εγγραφή στο τέλος)
+        sizes[chosen_class] += 1
+        if g_raw == "Α":
+            boy_range.increment(chosen_class)
+        if g_raw == "Κ":
+            girl_range.increment(chosen_class)
+        heapq.heappush(heap, (sizes[chosen_class], order[chosen_class], chosen_class))
+        placed_idx.append(ridx)
+        placed_cls.append(chosen_class)
+
+    if placed_idx:
+        df.loc[placed_idx, scenario_col] = pd.Series(placed_cls, index=placed_idx, dtype=object)
 
     return df, calculate_penalty_score(df, scenario_col, num_classes)
 
+def _step5_job(job: Tuple[str, pd.DataFrame, str, Optional[int], int]) -> Tuple[str, Optional[pd.DataFrame], Optional[int], Optional[BaseException]]:
+    """Worker: ένα σενάριο με δικό του seeded RNG· τα σφάλματα επιστρέφονται ως τιμή."""
+    scenario_name, scenario_df, scenario_col, num_classes, seed = job
+    try:
+        updated_df, score = step5_place_remaining_students(
+            scenario_df, scenario_col, num_classes, rng=random.Random(seed))
+        return scenario_name, updated_df, score, None
+    except Exception as e:
+        return scenario_name, None, None, e
+
 def apply_step5_to_all_scenarios(scenarios_dict: Dict[str, pd.DataFrame], 
-                               scenario_col: str, num_classes: Optional[int] = None) -> Tuple[pd.DataFrame, int, str]:
+                               scenario_col: str, num_classes: Optional[int] = None,
+                               workers: Optional[int] = 1,
+                               seed: Optional[int] = None,
+                               early_exit: bool = False) -> Tuple[pd.DataFrame, int, str]:
     """
     Εφαρμογή Βήματος 5 σε όλα τα σενάρια και επιλογή του βέλτιστου.
+
+    Args:
+        workers: πλήθος διεργασιών (1/None = σειριακά, >1 = process pool)
+        seed: βάση για τα RNG ισοβαθμίας (σενάριο i → seed + i)· None = τυχαία βάση.
+              Με δεδομένο seed το αποτέλεσμα δεν εξαρτάται από τα workers.
+        early_exit: σταματά στο πρώτο κατά σειρά εισόδου σενάριο με penalty 0 (το θεωρητικό
+                    ελάχιστο)· τα επόμενα ακυρώνονται, τα προηγούμενα ολοκληρώνονται.
     
     Returns:
         Tuple[pd.DataFrame, int, str]: Το σενάριο με το χαμηλότερο penalty score, 
@@ -275,26 +329,30 @@ def apply_step5_to_all_scenarios(scenarios_dict: Dict[str, pd.DataFrame],
     """
     if not scenarios_dict:
         raise ValueError("Δεν δόθηκαν σενάρια προς επεξεργασία")
-    
+
+    if seed is None:
+        seed = random.randrange(2**32)
+    jobs = [(name, scenario_df, scenario_col, num_classes, seed + i)
+            for i, (name, scenario_df) in enumerate(scenarios_dict.items())]
+
+    # early exit: σταματά στο πρώτο (κατά σειρά εισόδου) σενάριο με penalty 0 — ίδιο με σειριακά
+    stop = (lambda out: out[3] is None and out[2] <= 0) if early_exit else None
     results = {}
-    for scenario_name, scenario_df in scenarios_dict.items():
-        try:
-            updated_df, score = step5_place_remaining_students(
-                scenario_df, scenario_col, num_classes)
-            results[scenario_name] = {"df": updated_df, "penalty_score": score}
-        except Exception as e:
-            print(f"Σφάλμα στο σενάριο {scenario_name}: {e}")
+    for scenario_name, updated_df, score, err in run_jobs(_step5_job, jobs, workers, stop=stop):
+        if err is not None:
+            print(f"Σφάλμα στο σενάριο {scenario_name}: {err}")
             continue
+        results[scenario_name] = {"df": updated_df, "penalty_score": score}
 
     if not results:
         raise ValueError("Κανένα σενάριο δεν επεξεργάστηκε επιτυχώς")
 
-    # Εύρεση βέλτιστου σεναρίου
+    # Εύρεση βέλτιστου σεναρίου (σειρά εισόδου, ανεξάρτητα από τη σειρά ολοκλήρωσης)
     min_score = min(v["penalty_score"] for v in results.values())
-    best_scenarios = [k for k, v in results.items() if v["penalty_score"] == min_score]
+    best_scenarios = [k for k in scenarios_dict if k in results and results[k]["penalty_score"] == min_score]
     
-    # Τυχαία επιλογή σε ισοβαθμία
-    chosen_scenario = random.choice(best_scenarios)
+    # Seeded επιλογή σε ισοβαθμία
+    chosen_scenario = random.Random(seed).choice(best_scenarios)
     
     print(f"Επιλέχθηκε σενάριο: {chosen_scenario} με penalty score: {min_score}")
     return results[chosen_scenario]["df"], results[chosen_scenario]["penalty_score"], chosen_scenario
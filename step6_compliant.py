@@ -27,10 +27,11 @@ BASE = ["Α/Α","ΟΝΟΜΑ","ΦΥΛΟ","ΖΩΗΡΟΣ","ΙΔΙΑΙΤΕΡΟΤΗΤ
 3. Πλήρης audit trail με Population αιτία
 """
 _IDCOL = "ID"
-import itertools
+import itertools, heapq, math, random, time
 from typing import Dict, List, Tuple, Optional, Any
 import pandas as pd
 import numpy as np
+from parallel_jobs import run_jobs
 
 # --------------------------
 # Constants / Config
@@ -46,6 +47,16 @@ TARGET_GENDER_DIFF = 3
 TARGET_LANG_DIFF = 3
 
 MAX_ITER = 5
+TOP_K_SWAPS = 5     # πόσες εφικτές βελτιώνουσες ανταλλαγές συλλέγει ο lazy generator ανά γύρο
+
+# Τοπική αναζήτηση μετά το greedy (apply_step6(optimizer=...))
+OPTIMIZERS = ("greedy", "tabu", "anneal")
+SEARCH_TIME_LIMIT = 2.0   # δευτερόλεπτα
+TABU_TENURE = 7           # γύροι που μια μονάδα δεν ξανακινείται
+TABU_SAMPLES = 48         # τυχαίοι γείτονες ανά γύρο tabu
+ANNEAL_T0 = 2.0
+ANNEAL_T_END = 0.05
+SEARCH_MAX_IDLE = 200     # διαδοχικοί γύροι χωρίς κανέναν εφικτό γείτονα → τέλος αναζήτησης
 
 # Αποδεκτές τιμές για στήλη ΒΗΜΑ_ΤΟΠΟΘΕΤΗΣΗΣ
 STEP4_MARKERS = {4, "4", "Βήμα 4", "Step4", "Step4_Group", "Β4", "Β4_Δυάδα"}
@@ -84,6 +95,11 @@ def _metrics(df: pd.DataFrame, class_col: str, gender_col: str, lang_col: str, g
     """
     per_class = {}
     broken_per_class = {}
+    broken_gids = set()
+    if group_col in df.columns:
+        # Μία φορά: πλήθος διακριτών τμημάτων ανά ομάδα
+        n_classes = df.dropna(subset=[group_col]).groupby(group_col)[class_col].nunique()
+        broken_gids = set(n_classes.index[n_classes > 1])
     
     for c, sub in df.groupby(class_col):
         per_class[c] = dict(
@@ -97,13 +113,8 @@ def _metrics(df: pd.DataFrame, class_col: str, gender_col: str, lang_col: str, g
         if group_col in df.columns:
             # Βρίσκω όλες τις δυάδες που έχουν τουλάχιστον ένα μέλος σε αυτό το τμήμα
             groups_in_class = sub.dropna(subset=[group_col])[group_col].unique()
-            broken_count = 0
-            for gid in groups_in_class:
-                # Ελέγχω αν η δυάδα είναι σπασμένη (μέλη σε >1 τμήματα)
-                group_classes = df[df[group_col] == gid][class_col].nunique()
-                if group_classes > 1:
-                    broken_count += 1
-            broken_per_class[c] = broken_count
+            # Σπασμένη = μέλη σε >1 τμήματα
+            broken_per_class[c] = sum(1 for gid in groups_in_class if gid in broken_gids)
         else:
             broken_per_class[c] = 0
     
@@ -152,14 +163,17 @@ def penalty_score(df: pd.DataFrame, class_col: str, gender_col: str, lang_col: s
     """
     try:
         M = _metrics(df, class_col, gender_col, lang_col)
-        d = M["deltas"]
-        boys_over = max(0, d["boys"] - 1)
-        girls_over = max(0, d["girls"] - 1)
-        return 3 * max(0, d["pop"] - 1) + 1 * max(0, d["lang"] - 2) + 2 * (boys_over + girls_over)
+        return _penalty_from_deltas(M["deltas"])
     except Exception as e:
         print(f"Warning: penalty_score calculation failed: {e}")
         return 9999
 
+def _penalty_from_deltas(d: Dict[str, int]) -> int:
+    """Penalty από τις αποκλίσεις (κοινό για penalty_score και _SwapState)."""
+    boys_over = max(0, d["boys"] - 1)
+    girls_over = max(0, d["girls"] - 1)
+    return 3 * max(0, d["pop"] - 1) + 1 * max(0, d["lang"] - 2) + 2 * (boys_over + girls_over)
+
 def _is_step4(val) -> bool: 
     """Ελέγχει αν η τιμή αντιστοιχεί σε Βήμα 4."""
     return val in STEP4_MARKERS
@@ -247,117 +261,22 @@ def _eligible_units(df: pd.DataFrame, class_col: str, step_col: str, group_col:
 
     return singles, pairs
 
-def _check_size_ok(df: pd.DataFrame, class_col: str) -> bool:
-    """Ελέγχει ότι κανένα τμήμα δεν υπερβαίνει τα 25 άτομα."""
-    try:
-        return (df[class_col].value_counts() <= MAX_PER_CLASS).all()
-    except Exception:
-        return False
-
-def _check_protected_constraints(df_baseline: pd.DataFrame, df_after: pd.DataFrame, 
-                                class_col: str, step_col: str) -> bool:
-    """
-    ✅ ΔΙΟΡΘΩΣΗ: Ελέγχει ότι δεν αλλάζει η κατανομή Ζωηρών/Ιδιαιτερότητας/Παιδιών εκπαιδευτικών
-    ανά τμήμα με ΣΩΣΤΗ BASELINE ΑΝΑ ΚΑΤΗΓΟΡΙΑ:
-    - ΖΩΗΡΟΣ & ΙΔΙΑΙΤΕΡΟΤΗΤΑ: έναντι Βήματος 2
-    - ΠΑΙΔΙ_ΕΚΠΑΙΔΕΥΤΙΚΟΥ: έναντι Βήματος 1
-    """
-    try:
-        for col_name, description in PROTECTED_COLS.items():
-            if col_name not in df_baseline.columns or col_name not in df_after.columns:
-                continue
-                
-            # ✅ ΚΡΙΣΙΜΗ ΔΙΟΡΘΩΣΗ: Baseline ανά κατηγορία
-            baseline_class_col = _find_baseline_col_for_category(df_baseline, col_name)
-            if baseline_class_col is None:
-                print(f"Warning: No baseline found for {col_name}, using current class column")
-                baseline_class_col = class_col
-                
-            baseline_counts = df_baseline.groupby(baseline_class_col)[col_name].apply(
-                lambda x: (x == GOOD).sum()
-            ).to_dict()
-            
-            after_counts = df_after.groupby(class_col)[col_name].apply(
-                lambda x: (x == GOOD).sum()
-            ).to_dict()
-            
-            # Έλεγχος ότι δεν άλλαξε η κατανομή για κάθε τμήμα
-            for class_name in set(baseline_counts.keys()) | set(after_counts.keys()):
-                baseline_val = baseline_counts.get(class_name, 0)
-                after_val = after_counts.get(class_name, 0)
-                if baseline_val != after_val:
-                    return False
-                
-        return True
-    except Exception as e:
-        print(f"Warning: Error checking protected constraints: {e}")
-        return False
-
-def _check_friendship_constraints(df_before: pd.DataFrame, df_after: pd.DataFrame, 
-                                 class_col: str, group_col: str) -> bool:
+def _baseline_protected_counts(df_baseline: pd.DataFrame, class_col: str) -> Dict[str, Dict[Any, int]]:
     """
-    ✅ ΔΙΟΡΘΩΣΗ: Ελέγχει τις φιλίες σύμφωνα με προδιαγραφές:
-    1. Μη αύξηση αριθμού σπασμένων φιλιών (σε σχέση με το Βήμα 5)
-    2. Απαγόρευση επανένωσης προϋπάρχουσων σπασμένων φιλιών
-    3. Δεν επιτρέπεται διάσπαση ήδη ενωμένων δυάδων
-    
-    ΔΕΝ απαιτεί όλες οι δυάδες να είναι ενωμένες - επιτρέπει προϋπάρχουσες σπασμένες.
+    Πλήθος 'Ν' ανά baseline τμήμα για κάθε προστατευόμενη κατηγορία.
+    Υπολογίζεται μία φορά ανά εκτέλεση (η baseline δεν αλλάζει κατά τα swaps).
     """
-    try:
-        if group_col not in df_before.columns or group_col not in df_after.columns:
-            return True
-            
-        def get_group_status(df):
-            """
-            Επιστρέφει dict: {group_id: {'classes': set, 'is_split': bool}}
-            """
-            groups_with_data = df.dropna(subset=[group_col])
-            if groups_with_data.empty:
-                return {}
-                
-            result = {}
-            for gid, group_df in groups_with_data.groupby(group_col):
-                classes = set(group_df[class_col])
-                result[gid] = {
-                    'classes': classes,
-                    'is_split': len(classes) > 1
-                }
-            return result
-        
-        before_groups = get_group_status(df_before)
-        after_groups = get_group_status(df_after)
-        
-        # Βρίσκουμε όλες τις δυάδες που υπήρχαν πριν ή μετά
-        all_group_ids = set(before_groups.keys()) | set(after_groups.keys())
-        
-        split_before_count = sum(1 for g in before_groups.values() if g['is_split'])
-        split_after_count = sum(1 for g in after_groups.values() if g['is_split'])
-        
-        # 1. Μη αύξηση αριθμού σπασμένων φιλιών
-        if split_after_count > split_before_count:
-            return False
-        
-        # 2. Έλεγχος για επανενώσεις και νέες διασπάσεις
-        for gid in all_group_ids:
-            before_status = before_groups.get(gid, {'classes': set(), 'is_split': False})
-            after_status = after_groups.get(gid, {'classes': set(), 'is_split': False})
-            
-            was_split = before_status['is_split']
-            is_now_split = after_status['is_split']
-            
-            # Απαγόρευση επανένωσης: προϋπάρχουσα σπασμένη δεν γίνεται ενωμένη
-            if was_split and not is_now_split and len(after_status['classes']) > 0:
-                return False
-                
-            # Απαγόρευση νέας διάσπασης: ενωμένη δεν γίνεται σπασμένη
-            if not was_split and is_now_split:
-                return False
-                
-        return True
-        
-    except Exception as e:
-        print(f"Warning: Error checking friendship constraints: {e}")
-        return False
+    out = {}
+    for col_name in PROTECTED_COLS:
+        if col_name not in df_baseline.columns:
+            continue
+        baseline_class_col = _find_baseline_col_for_category(df_baseline, col_name)
+        if baseline_class_col is None:
+            print(f"Warning: No baseline found for {col_name}, using current class column")
+            baseline_class_col = class_col
+        flags = (df_baseline[col_name] == GOOD).astype(int)
+        out[col_name] = {k: int(v) for k, v in flags.groupby(df_baseline[baseline_class_col]).sum().items()}
+    return out
 
 # --------------------------
 # Swap Operations
@@ -367,7 +286,10 @@ def _apply_swap(df: pd.DataFrame, class_col: str,
                 fromB_ids: List[str], to_class_A: str,
                 reason: str, swap_idx: int,
                 step_col: str, group_col: str) -> pd.DataFrame:
-    """Εφαρμόζει ανταλλαγή μεταξύ δύο τμημάτων."""
+    """
+    Εφαρμόζει ανταλλαγή μεταξύ δύο τμημάτων (μόνο η στήλη τμήματος).
+    Η καταγραφή γίνεται στο journal (_journal_entry)· οι audit στήλες αποδίδονται στο τέλος.
+    """
     df = df.copy()
     
     # Εφαρμογή ανταλλαγής
@@ -375,30 +297,263 @@ def _apply_swap(df: pd.DataFrame, class_col: str,
         df.loc[df[_IDCOL].isin(fromA_ids), class_col] = to_class_B
     if fromB_ids:
         df.loc[df[_IDCOL].isin(fromB_ids), class_col] = to_class_A
-
-    # Audit trail
-    swap_id = f"SWAP_{swap_idx}"
-    moved_ids = list(fromA_ids) + list(fromB_ids)
-    if moved_ids:
-        mask = df[_IDCOL].isin(moved_ids)
-        df.loc[mask, "ΒΗΜΑ6_ΚΙΝΗΣΗ"] = swap_id
-        df.loc[mask, "ΑΙΤΙΑ_ΑΛΛΑΓΗΣ"] = reason
-        df.loc[mask, "ΠΗΓΗ_ΒΗΜΑ"] = np.where(
-            df.loc[mask, group_col].notna(), 
-            "Β4_Δυάδα", 
-            "Β5_Μεμονωμένος"
-        )
     
     return df
 
-def _determine_reason(df_before: pd.DataFrame, class_col: str, gender_col: str, 
-                     lang_col: str, objective: str) -> str:
+# --------------------------
+# Swap journal / audit
+# --------------------------
+AUDIT_COLS = ["ΒΗΜΑ6_ΚΙΝΗΣΗ", "ΑΙΤΙΑ_ΑΛΛΑΓΗΣ", "ΠΗΓΗ_ΒΗΜΑ"]
+
+def _journal_entry(swap_idx: int, fromA_ids: List[Any], classA: Any, fromB_ids: List[Any], classB: Any,
+                   reason: str, penalty_before: int, penalty_after: int) -> Dict[str, Any]:
+    """Μία εγγραφή του append-only journal: ids_A πάνε classA→classB, ids_B πάνε classB→classA."""
+    return {
+        "swap_id": f"SWAP_{swap_idx}",
+        "ids_A": list(fromA_ids), "class_A": classA,
+        "ids_B": list(fromB_ids), "class_B": classB,
+        "reason": reason,
+        "penalty_before": int(penalty_before), "penalty_after": int(penalty_after),
+    }
+
+def render_step6_audit(df: pd.DataFrame, journal: List[Dict[str, Any]],
+                       id_col: Optional[str] = None, group_col: str = "GROUP_ID") -> pd.DataFrame:
     """
-    Καθορίζει την αιτία ανταλλαγής βάσει στόχου και τρέχουσας κατάστασης.
+    Audit στήλες (ΒΗΜΑ6_ΚΙΝΗΣΗ, ΑΙΤΙΑ_ΑΛΛΑΓΗΣ, ΠΗΓΗ_ΒΗΜΑ) από το journal των ανταλλαγών.
+    Για κάθε μαθητή κρατείται η τελευταία ανταλλαγή που τον κίνησε.
     """
-    metrics = _metrics(df_before, class_col, gender_col, lang_col)
-    deltas = metrics["deltas"]
-    
+    id_col = id_col or _IDCOL
+    df = df.copy()
+    for col in AUDIT_COLS:
+        if col not in df.columns:
+            df[col] = None
+    last: Dict[Any, Dict[str, Any]] = {}
+    for e in journal:
+        for i in list(e["ids_A"]) + list(e["ids_B"]):
+            last[i] = e
+    if not last:
+        return df
+    mask = df[id_col].isin(list(last))
+    ids = df.loc[mask, id_col]
+    df.loc[mask, "ΒΗΜΑ6_ΚΙΝΗΣΗ"] = [last[i]["swap_id"] for i in ids]
+    df.loc[mask, "ΑΙΤΙΑ_ΑΛΛΑΓΗΣ"] = [last[i]["reason"] for i in ids]
+    in_group = df.loc[mask, group_col].notna() if group_col in df.columns else pd.Series(False, index=ids.index)
+    df.loc[mask, "ΠΗΓΗ_ΒΗΜΑ"] = np.where(in_group, "Β4_Δυάδα", "Β5_Μεμονωμένος")
+    return df
+
+# --------------------------
+# Delta evaluation (μετρητές ανά τμήμα)
+# --------------------------
+class _SwapState:
+    """
+    Κατάσταση Βήματος 6 σε πίνακες, για αξιολόγηση ανταλλαγών χωρίς df.copy():
+    - codes[r]: κωδικός τμήματος της γραμμής r (-1 = κενό τμήμα)
+    - counts[k]: (total, boys, girls, good) του τμήματος k
+    Μια ανταλλαγή περιγράφεται ως moves = {γραμμή: νέος κωδικός}· μόνο η
+    τελικά επιλεγμένη γράφεται στο DataFrame (_apply_swap).
+    """
+    def __init__(self, df: pd.DataFrame, df_baseline: pd.DataFrame, class_col: str,
+                 gender_col: str, lang_col: str, group_col: str,
+                 baseline_counts: Optional[Dict[str, Dict[Any, int]]] = None):
+        labels = df[class_col]
+        classes = list(pd.unique(labels.dropna()))
+        try:
+            classes = sorted(classes)   # ίδια σειρά με το groupby του _metrics
+        except TypeError:
+            pass
+        self.classes = classes
+        self.code_of = {c: k for k, c in enumerate(classes)}
+        self.codes = pd.Categorical(labels, categories=classes).codes.astype(np.int64)
+
+        self.rows_of: Dict[Any, List[int]] = {}
+        for r, i in enumerate(df[_IDCOL].tolist()):
+            self.rows_of.setdefault(i, []).append(r)
+
+        n = len(df)
+        self.vals = np.zeros((n, 4), dtype=np.int64)
+        self.vals[:, 0] = 1
+        self.vals[:, 1] = (df[gender_col] == BOY).to_numpy()
+        self.vals[:, 2] = (df[gender_col] == GIRL).to_numpy()
+        self.vals[:, 3] = (df[lang_col] == GOOD).to_numpy()
+        self.gender = df[gender_col].to_numpy()
+        self.lang = df[lang_col].to_numpy()
+        self.counts = np.zeros((len(classes), 4), dtype=np.int64)
+        placed = self.codes >= 0
+        np.add.at(self.counts, self.codes[placed], self.vals[placed])
+
+        # Προστατευόμενες κατηγορίες: σημαία ανά γραμμή, τρέχοντα πλήθη ανά τμήμα,
+        # πλήθη baseline (μία φορά) και σύνολο ετικετών που σήμερα αποκλίνουν από τη baseline
+        if baseline_counts is None:
+            baseline_counts = _baseline_protected_counts(df_baseline, class_col)
+        self.protected = []
+        for col_name, base in baseline_counts.items():
+            if col_name not in df.columns:
+                continue
+            flag = (df[col_name] == GOOD).to_numpy()
+            cur = np.bincount(self.codes[placed & flag], minlength=len(classes)).astype(np.int64)
+            self.protected.append({"flag": flag, "base": base, "cur": cur, "bad": set()})
+        for p in self.protected:
+            self._refresh_bad(p)
+
+        # Ομάδες φιλίας: κωδικός ομάδας ανά γραμμή (-1 = χωρίς ομάδα),
+        # ευρετήριο GROUP_ID → γραμμές μελών και cache {τμήμα: πλήθος μελών} ανά ομάδα
+        if group_col in df.columns:
+            self.gcodes = pd.factorize(df[group_col])[0].astype(np.int64)
+        else:
+            self.gcodes = np.full(n, -1, dtype=np.int64)
+        G = int(self.gcodes.max()) + 1 if n else 0
+        self.group_rows: List[List[int]] = [[] for _ in range(G)]
+        self.group_classes: List[Dict[int, int]] = [{} for _ in range(G)]
+        for r in np.flatnonzero(self.gcodes >= 0).tolist():
+            g = int(self.gcodes[r]); k = int(self.codes[r])
+            self.group_rows[g].append(r)
+            self.group_classes[g][k] = self.group_classes[g].get(k, 0) + 1
+        # Σπασμένες ομάδες ανά τμήμα (όπως broken_friendships_per_class του _metrics)
+        self.broken = np.zeros(len(classes), dtype=np.int64)
+        for g in range(G):
+            self._add_broken(g, +1)
+
+    # ---- κινήσεις ----
+    def moves(self, fromA_ids: List[Any], to_class_B: Any,
+              fromB_ids: List[Any], to_class_A: Any) -> Dict[int, int]:
+        """Ίδια σημασιολογία με _apply_swap: πρώτα fromA→B, μετά fromB→A."""
+        mv: Dict[int, int] = {}
+        for ids, target in ((fromA_ids, to_class_B), (fromB_ids, to_class_A)):
+            t = self.code_of[target]
+            for i in ids:
+                for r in self.rows_of.get(i, ()):
+                    mv[r] = t
+        return mv
+
+    def counts_after(self, mv: Dict[int, int]) -> np.ndarray:
+        c = self.counts.copy()
+        for r, t in mv.items():
+            k = self.codes[r]
+            if k == t:
+                continue
+            if k >= 0:
+                c[k] -= self.vals[r]
+            c[t] += self.vals[r]
+        return c
+
+    def codes_after(self, mv: Dict[int, int]) -> np.ndarray:
+        codes = self.codes.copy()
+        if mv:
+            codes[list(mv.keys())] = list(mv.values())
+        return codes
+
+    def apply(self, mv: Dict[int, int]) -> None:
+        for g, after in self._touched_groups(mv).items():
+            self._add_broken(g, -1)
+            self.group_classes[g] = after
+            self._add_broken(g, +1)
+        for p in self.protected:
+            for k, dv in self._protected_delta(p, mv).items():
+                p["cur"][k] += dv
+            self._refresh_bad(p)
+        self.counts = self.counts_after(mv)
+        self.codes = self.codes_after(mv)
+
+    # ---- μετρικές ----
+    def deltas(self, counts: Optional[np.ndarray] = None) -> Dict[str, int]:
+        c = self.counts if counts is None else counts
+        c = c[c[:, 0] > 0]   # όπως το groupby: μόνο μη κενά τμήματα
+        if len(c) == 0:
+            return {}
+        rng = [int(x) for x in c.max(axis=0) - c.min(axis=0)]
+        return dict(pop=rng[0], boys=rng[1], girls=rng[2], gender=max(rng[1], rng[2]), lang=rng[3])
+
+    def penalty(self, counts: Optional[np.ndarray] = None) -> int:
+        try:
+            return _penalty_from_deltas(self.deltas(counts))
+        except Exception as e:
+            print(f"Warning: penalty_score calculation failed: {e}")
+            return 9999
+
+    def per_class(self, counts: Optional[np.ndarray] = None) -> Dict[Any, Dict[str, int]]:
+        c = self.counts if counts is None else counts
+        return {cl: dict(total=int(c[k, 0]), boys=int(c[k, 1]), girls=int(c[k, 2]), good=int(c[k, 3]))
+                for k, cl in enumerate(self.classes) if c[k, 0] > 0}
+
+    # ---- έλεγχοι ----
+    def size_ok(self, counts: np.ndarray) -> bool:
+        return bool((counts[:, 0] <= MAX_PER_CLASS).all())
+
+    def _current(self, p: Dict[str, Any], label: Any) -> int:
+        k = self.code_of.get(label)
+        return int(p["cur"][k]) if k is not None else 0
+
+    def _refresh_bad(self, p: Dict[str, Any]) -> None:
+        labels = set(p["base"]) | set(self.classes)
+        p["bad"] = {lb for lb in labels if p["base"].get(lb, 0) != self._current(p, lb)}
+
+    def _protected_delta(self, p: Dict[str, Any], mv: Dict[int, int]) -> Dict[int, int]:
+        delta: Dict[int, int] = {}
+        flag = p["flag"]
+        for r, t in mv.items():
+            k = self.codes[r]
+            if not flag[r] or k == t:
+                continue
+            if k >= 0:
+                delta[k] = delta.get(k, 0) - 1
+            delta[t] = delta.get(t, 0) + 1
+        return delta
+
+    def protected_ok(self, mv: Dict[int, int]) -> bool:
+        """
+        Κατανομή προστατευόμενων ανά τμήμα μετά την κίνηση == baseline (ανά κατηγορία).
+        O(|moved|): ελέγχονται μόνο τα τμήματα που αγγίζουν σημαδεμένοι μαθητές
+        και όσα ήδη αποκλίνουν από τη baseline.
+        """
+        for p in self.protected:
+            delta = self._protected_delta(p, mv)
+            if not delta and not p["bad"]:
+                continue
+            labels = set(p["bad"]) | {self.classes[k] for k in delta}
+            for lb in labels:
+                after = self._current(p, lb) + delta.get(self.code_of.get(lb, -1), 0)
+                if after != p["base"].get(lb, 0):
+                    return False
+        return True
+
+    def _add_broken(self, g: int, sign: int) -> None:
+        placed = [k for k in self.group_classes[g] if k >= 0]
+        if len(placed) > 1:
+            for k in placed:
+                self.broken[k] += sign
+
+    def _touched_groups(self, mv: Dict[int, int]) -> Dict[int, Dict[int, int]]:
+        """{ομάδα: νέο {τμήμα: πλήθος}} μόνο για τις ομάδες των γραμμών που κινούνται."""
+        out: Dict[int, Dict[int, int]] = {}
+        for r, t in mv.items():
+            g = int(self.gcodes[r]); k = int(self.codes[r])
+            if g < 0 or k == t:
+                continue
+            cnt = out.get(g)
+            if cnt is None:
+                cnt = out[g] = dict(self.group_classes[g])
+            cnt[k] -= 1
+            if cnt[k] == 0:
+                del cnt[k]
+            cnt[t] = cnt.get(t, 0) + 1
+        return out
+
+    def friendship_ok(self, mv: Dict[int, int]) -> bool:
+        """
+        Καμία ομάδα δεν αλλάζει κατάσταση: ούτε νέα διάσπαση ούτε επανένωση σπασμένης.
+        Ελέγχονται μόνο οι ομάδες των μαθητών που κινούνται.
+        """
+        for g, after in self._touched_groups(mv).items():
+            if (len(self.group_classes[g]) > 1) != (len(after) > 1):
+                return False
+        return True
+
+    def broken_per_class(self) -> Dict[Any, int]:
+        present = self.counts[:, 0] > 0
+        return {cl: int(self.broken[k]) for k, cl in enumerate(self.classes) if present[k]}
+
+def _reason_from_deltas(deltas: Dict[str, int], objective: str) -> str:
+    """Αιτία ανταλλαγής από τις τρέχουσες αποκλίσεις και τον στόχο."""
     within_targets = (
         deltas["pop"] <= TARGET_POP_DIFF and
         deltas["gender"] <= TARGET_GENDER_DIFF and 
@@ -415,278 +570,409 @@ def _determine_reason(df_before: pd.DataFrame, class_col: str, gender_col: str,
         # Μικτή κατάσταση - προτεραιότητα στο φύλο
         return "Gender" if deltas["gender"] >= deltas["lang"] else "Language"
 
-def _rank_candidates(df_before: pd.DataFrame, df_baseline: pd.DataFrame,
-                     class_col: str, gender_col: str, lang_col: str,
-                     step_col: str, group_col: str,
-                     candidates: List, objective: str) -> List:
+def _swap_key(state: _SwapState, counts: np.ndarray, base_d: Dict[str, int], base_pen: int,
+              objective: str, n_moved: int) -> Optional[Tuple[int, int, int, int]]:
     """
-    Κατατάσσει υποψήφιες ανταλλαγές βάσει στόχου με πλήρεις ελέγχους συμμόρφωσης.
-    ✅ ΔΙΟΡΘΩΣΗ: Περιλαμβάνει έλεγχο baseline constraints.
+    Κλειδί κατάταξης μιας ανταλλαγής από τους νέους μετρητές ή None αν απορρίπτεται
+    (μέγεθος τμήματος, πληθυσμός, επιδείνωση του άλλου δείκτη). Εξαρτάται μόνο από τους μετρητές.
     """
-    base_M = _metrics(df_before, class_col, gender_col, lang_col)
-    base_d = base_M["deltas"]
-    base_pen = penalty_score(df_before, class_col, gender_col, lang_col)
-    ranked = []
-
-    for (fromA, classA, fromB, classB, base_reason) in candidates:
-        try:
-            # Καθορισμός σωστής αιτίας
-            reason = _determine_reason(df_before, class_col, gender_col, lang_col, objective)
-            
-            tmp = _apply_swap(df_before, class_col, fromA, classB, fromB, classA, 
-                            reason, 9999, step_col=step_col, group_col=group_col)
-            
-            # 1. Έλεγχος μεγέθους τμημάτων
-            if not _check_size_ok(tmp, class_col):
-                continue
-                
-            # 2. ✅ ΔΙΟΡΘΩΣΗ: Έλεγχος απαραβίαστων περιορισμών με baseline ανά κατηγορία
-            if not _check_protected_constraints(df_baseline, tmp, class_col, step_col):
-                continue
-                
-            # 3. Έλεγχος φιλιών (σπασμένες/επανενώσεις)
-            if not _check_friendship_constraints(df_before, tmp, class_col, group_col):
-                continue
-                
-            M = _metrics(tmp, class_col, gender_col, lang_col)
-            d = M["deltas"]
-            
-            # 4. Πληθυσμιακός έλεγχος (αυστηροποίηση)
-            if d["pop"] > TARGET_POP_DIFF:
-                continue
-            if base_d["pop"] <= TARGET_POP_DIFF and d["pop"] > base_d["pop"]:
-                continue
-
-            pen = penalty_score(tmp, class_col, gender_col, lang_col)
-            dlang_gain   = base_d["lang"]   - d["lang"]
-            dgender_gain = base_d["gender"] - d["gender"]
-            pen_gain     = base_pen - pen
-
-            # 5. Έλεγχος μη-επιδείνωσης του άλλου δείκτη
-            if objective == "LANG"   and dgender_gain < 0: 
-                continue
-            if objective == "GENDER" and dlang_gain   < 0: 
-                continue
-            if objective == "BOTH"   and (dlang_gain < 0 or dgender_gain < 0): 
-                continue
-
-            # Κατάταξη βάσει στόχου
-            if objective in ("GENDER", "BOTH"):
-                key = (-dgender_gain, -dlang_gain, -pen_gain, len(fromA) + len(fromB))
-            else:
-                key = (-dlang_gain, -dgender_gain, -pen_gain, len(fromA) + len(fromB))
-                
-            ranked.append((key, fromA, classA, fromB, classB, reason))
-            
-        except Exception as e:
-            print(f"Warning: Error evaluating candidate swap: {e}")
-            continue
-
-    ranked.sort(key=lambda x: x[0])
-    return [(fromA, classA, fromB, classB, reason) for _, fromA, classA, fromB, classB, reason in ranked]
+    # 1. Έλεγχος μεγέθους τμημάτων
+    if not state.size_ok(counts):
+        return None
+    d = state.deltas(counts)
+
+    # 4. Πληθυσμιακός έλεγχος (αυστηροποίηση)
+    if d["pop"] > TARGET_POP_DIFF:
+        return None
+    if base_d["pop"] <= TARGET_POP_DIFF and d["pop"] > base_d["pop"]:
+        return None
+
+    pen = state.penalty(counts)
+    dlang_gain   = base_d["lang"]   - d["lang"]
+    dgender_gain = base_d["gender"] - d["gender"]
+    pen_gain     = base_pen - pen
+
+    # 5. Έλεγχος μη-επιδείνωσης του άλλου δείκτη
+    if objective == "LANG"   and dgender_gain < 0: 
+        return None
+    if objective == "GENDER" and dlang_gain   < 0: 
+        return None
+    if objective == "BOTH"   and (dlang_gain < 0 or dgender_gain < 0): 
+        return None
+
+    # Κατάταξη βάσει στόχου
+    if objective in ("GENDER", "BOTH"):
+        return (-dgender_gain, -dlang_gain, -pen_gain, n_moved)
+    return (-dlang_gain, -dgender_gain, -pen_gain, n_moved)
 
 # --------------------------
-# Candidate Generation
+# Lazy, ranked candidate generation
 # --------------------------
-def _enum_LANG(df: pd.DataFrame, class_col: str, gender_col: str, lang_col: str,
-               step_col: str, group_col: str, top_k: int = 2) -> List:
+def _swap_families(state: _SwapState, singles: Dict[Any, List], pairs: Dict[Any, List],
+                   objective: str, top_k: int = 2) -> List[Tuple]:
     """
-    Παράγει υποψήφιες ανταλλαγές για διόρθωση γλώσσας.
-    ✅ ΔΙΟΡΘΩΣΗ: ΔΕΝ φιλτράρει σπασμένες δυάδες - τις επιτρέπει σε swaps.
+    Οικογένειες υποψηφίων (1↔1, 2↔2, 2↔1+1) ανά ζεύγος ακραίων τμημάτων, χωρίς να αναπτυχθούν τα γινόμενα:
+    (μονάδες_A, classA, μονάδες_B, classB, take_A, take_B, order). Οι μονάδες A πάνε στο classB
+    και οι B στο classA· take=2 σημαίνει ζεύγος μεμονωμένων (combinations)· order = σειρά
+    απαρίθμησης για ισοβαθμίες (βλ. _bucket_swaps).
     """
-    M = _metrics(df, class_col, gender_col, lang_col)
-    per_class = M["per_class"]
-    
-    # Ταξινόμηση τμημάτων κατά 'good' γλώσσα
-    classes_sorted = sorted(per_class.keys(), key=lambda c: per_class[c]["good"], reverse=True)
-    highs = classes_sorted[:top_k]
-    lows  = list(reversed(classes_sorted))[:top_k]
-
-    singles, pairs = _eligible_units(df, class_col, step_col, group_col, gender_col, lang_col)
-    candidates = []
-    
-    try:
-        for high in highs:
-            for low in lows:
-                if high == low: 
+    per_class = state.per_class()
+    fams: List[Tuple] = []
+
+    def singles_where(c, values, val):
+        return [[i] for i in singles.get(c, []) if i in state.rows_of and values[state.rows_of[i][0]] == val]
+
+    def pairs_where(c, kind_key, kind):
+        return [p["ids"] for p in pairs.get(c, []) if p[kind_key] == kind]
+
+    def extremes(metric):
+        order = sorted(per_class.keys(), key=lambda c: per_class[c][metric], reverse=True)
+        return [(h, l) for h in order[:top_k] for l in list(reversed(order))[:top_k] if h != l]
+
+    if objective in ("LANG", "BOTH"):
+        for high, low in extremes("good"):
+            s_low_not = singles_where(low, state.lang, NOTGOOD)
+            p_high_NN = pairs_where(high, "lang_kind", "NN")
+            fams += [
+                (singles_where(high, state.lang, GOOD), high, s_low_not, low, 1, 1, "A"),   # 1↔1
+                (p_high_NN, high, pairs_where(low, "lang_kind", "OO"), low, 1, 1, "A"),     # 2↔2 (NN ↔ OO)
+                (p_high_NN, high, s_low_not, low, 1, 2, "A"),                               # 2↔1+1
+                (singles_where(low, state.lang, GOOD), low, pairs_where(high, "lang_kind", "OO"), high, 2, 1, "B"),
+            ]
+    if objective in ("GENDER", "BOTH"):
+        d = state.deltas()
+        target_gender = BOY if d["boys"] >= d["girls"] else GIRL
+        opp_gender = GIRL if target_gender == BOY else BOY
+        for high, low in extremes("boys" if target_gender == BOY else "girls"):
+            s_low_opp = singles_where(low, state.gender, opp_gender)
+            p_high_target = pairs_where(high, "gender_kind", target_gender)
+            fams += [
+                (singles_where(high, state.gender, target_gender), high, s_low_opp, low, 1, 1, "same_lang"),
+                (p_high_target, high, pairs_where(low, "gender_kind", opp_gender), low, 1, 1, "A"),
+                (p_high_target, high, s_low_opp, low, 1, 2, "A"),
+            ]
+    return fams
+
+def _side_buckets(state: _SwapState, units: List[List[Any]], take: int) -> List[Tuple[Tuple, Any]]:
+    """
+    Ομαδοποιεί τις μονάδες μιας πλευράς κατά υπογραφή = πολυσύνολο (τμήμα, φύλο, γλώσσα) των γραμμών.
+    Ίδια υπογραφή ⇒ ίδια επίδραση στους μετρητές. Επιστρέφει [(υπογραφή, γεννήτρια (θέση, μονάδα))],
+    σε αύξουσα θέση απαρίθμησης: δείκτης στο units (take=1) ή (p, q) του combinations(units, 2) (take=2).
+    """
+    by_sig: Dict[Tuple, List[Tuple[int, List[Any]]]] = {}
+    for pos, u in enumerate(units):
+        rows = [r for i in u for r in state.rows_of.get(i, ())]
+        sig = tuple(sorted((int(state.codes[r]),) + tuple(int(v) for v in state.vals[r]) for r in rows))
+        by_sig.setdefault(sig, []).append((pos, u))
+    if take == 1:
+        return [(sig, (lambda us=us: iter(us))) for sig, us in by_sig.items()]
+    # take == 2: ζεύγη μεμονωμένων, ανά συνδυασμό υπογραφών
+    sigs = list(by_sig)
+    out = []
+    for a in range(len(sigs)):
+        for b in range(a, len(sigs)):
+            ua, ub = by_sig[sigs[a]], by_sig[sigs[b]]
+            if a == b:
+                if len(ua) < 2:
                     continue
-                
-                # 1↔1 (Καλή Γνώση ↔ Όχι Καλή)
-                singles_high_good = df[df[_IDCOL].isin(singles[high]) & (df[lang_col] == GOOD)][_IDCOL].tolist()
-                singles_low_not   = df[df[_IDCOL].isin(singles[low])  & (df[lang_col] == NOTGOOD)][_IDCOL].tolist()
-                
-                for i in singles_high_good:
-                    for j in singles_low_not:
-                        candidates.append(([i], high, [j], low, "Language"))
-                
-                # ✅ ΔΙΟΡΘΩΣΗ: 2↔2 (NN ↔ OO) - ΧΩΡΙΣ φιλτράρισμα σπασμένων δυάδων
-                pairs_high_NN = [p for p in pairs[high] if p["lang_kind"] == "NN"]
-                pairs_low_OO  = [p for p in pairs[low]  if p["lang_kind"] == "OO"]
-                
-                for pNN in pairs_high_NN:
-                    for pOO in pairs_low_OO:
-                        candidates.append((pNN["ids"], high, pOO["ids"], low, "Language"))
-                
-                # ✅ ΔΙΟΡΘΩΣΗ: 2↔1+1 scenarios - ΧΩΡΙΣ φιλτράρισμα σπασμένων
-                if pairs_high_NN and len(singles_low_not) >= 2:
-                    for pNN in pairs_high_NN:
-                        for two in itertools.combinations(singles_low_not, 2):
-                            candidates.append((pNN["ids"], high, list(two), low, "Language"))
-                
-                # Αντίστροφα (OO ↔ Ν+Ν)
-                pairs_high_OO = [p for p in pairs[high] if p["lang_kind"] == "OO"]
-                singles_low_good = df[df[_IDCOL].isin(singles[low]) & (df[lang_col] == GOOD)][_IDCOL].tolist()
-                
-                if pairs_high_OO and len(singles_low_good) >= 2:
-                    for pOO in pairs_high_OO:
-                        for two in itertools.combinations(singles_low_good, 2):
-                            candidates.append((list(two), low, pOO["ids"], high, "Language"))
-                            
-    except Exception as e:
-        print(f"Warning: Error generating language candidates: {e}")
-    
-    return candidates
+                gen = lambda ua=ua: (((p, q), x + y) for (p, x), (q, y) in itertools.combinations(ua, 2))
+            else:
+                # υλοποιείται μόνο όταν φτάσει η σειρά του κάδου
+                gen = lambda ua=ua, ub=ub: iter(sorted(
+                    ((p, q), x + y) if p < q else ((q, p), y + x) for p, x in ua for q, y in ub))
+            out.append((tuple(sorted(sigs[a] + sigs[b])), gen))
+    return out
 
-def _enum_GENDER(df: pd.DataFrame, class_col: str, gender_col: str, lang_col: str,
-                 step_col: str, group_col: str, top_k: int = 2) -> List:
+def _bucket_swaps(f: int, order: str, lang_mismatch: int, gen_A, classA: Any, gen_B, classB: Any):
     """
-    Παράγει υποψήφιες ανταλλαγές για διόρθωση φύλου.
-    ✅ ΔΙΟΡΘΩΣΗ: ΔΕΝ φιλτράρει σπασμένες δυάδες - τις επιτρέπει σε swaps.
+    Οι ανταλλαγές ενός κάδου ως (δείκτης απαρίθμησης, fromA, classA, fromB, classB), σε αύξουσα σειρά.
+    Ο δείκτης αναπαράγει τη σειρά των αρχικών _enum_*: πρώτα η μονάδα A ("A"), πρώτα η B ("B"),
+    ή για φύλο 1↔1 ("same_lang") οι ίδιας γλώσσας πριν από τις υπόλοιπες για κάθε μονάδα A.
     """
-    M = _metrics(df, class_col, gender_col, lang_col)
-    per_class = M["per_class"]
-    deltas = M["deltas"]
-    
-    # Καθορισμός target φύλου (το φύλο με μεγαλύτερη απόκλιση)
-    target_gender = BOY if deltas["boys"] >= deltas["girls"] else GIRL
-    opp_gender = GIRL if target_gender == BOY else BOY
-    
-    # Ταξινόμηση τμημάτων κατά πλήθος target φύλου
-    metric = "boys" if target_gender == BOY else "girls"
-    classes_sorted = sorted(per_class.keys(), key=lambda c: per_class[c][metric], reverse=True)
-    highs = classes_sorted[:top_k]
-    lows  = list(reversed(classes_sorted))[:top_k]
+    if order == "B":
+        for pB, fromB in gen_B():
+            for pA, fromA in gen_A():
+                yield (f, pB, pA), fromA, classA, fromB, classB
+    else:
+        for pA, fromA in gen_A():
+            for pB, fromB in gen_B():
+                yield (f, pA, lang_mismatch, pB), fromA, classA, fromB, classB
 
-    singles, pairs = _eligible_units(df, class_col, step_col, group_col, gender_col, lang_col)
-    candidates = []
-    
-    try:
-        for high in highs:
-            for low in lows:
-                if high == low: 
+def _ranked_swaps(state: _SwapState, singles: Dict[Any, List], pairs: Dict[Any, List],
+                  objective: str, top_k: int = TOP_K_SWAPS) -> List[Tuple]:
+    """
+    Έως top_k εφικτές ανταλλαγές που μειώνουν το penalty, κατά _swap_key.
+    Οι υποψήφιες ομαδοποιούνται σε κάδους ίδιας επίδρασης στους μετρητές: το κλειδί υπολογίζεται
+    μία φορά ανά κάδο, οι κάδοι ταξινομούνται και οι συγκεκριμένες ανταλλαγές παράγονται lazily
+    (μόνο για τους ελέγχους απαραβίαστων/φιλιών) μέχρι να βρεθούν top_k.
+    Σε ισοβαθμία κλειδιού οι κάδοι συγχωνεύονται κατά δείκτη απαρίθμησης (_bucket_swaps),
+    άρα η σειρά είναι ίδια με την πλήρη απαρίθμηση + σταθερή ταξινόμηση.
+    """
+    base_d = state.deltas()
+    base_pen = state.penalty()
+    reason = _reason_from_deltas(base_d, objective)
+
+    buckets = []
+    for f, (units_A, classA, units_B, classB, take_A, take_B, order) in enumerate(
+            _swap_families(state, singles, pairs, objective)):
+        if not units_A or not units_B:
+            continue
+        sides_B = _side_buckets(state, units_B, take_B)
+        for sig_A, gen_A in _side_buckets(state, units_A, take_A):
+            for sig_B, gen_B in sides_B:
+                (_, fromA), (_, fromB) = next(gen_A()), next(gen_B())
+                mv = state.moves(fromA, classB, fromB, classA)
+                key = _swap_key(state, state.counts_after(mv), base_d, base_pen, objective, len(fromA) + len(fromB))
+                if key is None or key[2] >= 0:   # μόνο κάδοι που μειώνουν το penalty
                     continue
-                
-                # 1↔1 (target_gender ↔ opp_gender)
-                ids_high_target = df[df[_IDCOL].isin(singles[high]) & (df[gender_col] == target_gender)][_IDCOL].tolist()
-                ids_low_opp = df[df[_IDCOL].isin(singles[low]) & (df[gender_col] == opp_gender)][_IDCOL].tolist()
-                
-                for i in ids_high_target:
-                    # Προτίμηση ίδιας γλώσσας
-                    lang_i = df.loc[df[_IDCOL] == i, lang_col].iloc[0]
-                    same_lang = df[
-                        df[_IDCOL].isin(singles[low]) & 
-                        (df[gender_col] == opp_gender) & 
-                        (df[lang_col] == lang_i)
-                    ][_IDCOL].tolist()
-                    
-                    for j in same_lang:
-                        candidates.append(([i], high, [j], low, "Gender"))
-                    for j in ids_low_opp:
-                        candidates.append(([i], high, [j], low, "Gender"))
-                
-                # ✅ ΔΙΟΡΘΩΣΗ: 2↔2 - ΧΩΡΙΣ φιλτράρισμα σπασμένων δυάδων
-                pairs_high_target = [p for p in pairs[high] if p["gender_kind"] == target_gender]
-                pairs_low_opp = [p for p in pairs[low] if p["gender_kind"] == opp_gender]
-                
-                for p1 in pairs_high_target:
-                    for p2 in pairs_low_opp:
-                        candidates.append((p1["ids"], high, p2["ids"], low, "Gender"))
-                
-                # ✅ ΔΙΟΡΘΩΣΗ: 2↔1+1 - ΧΩΡΙΣ φιλτράρισμα σπασμένων δυάδων
-                for p1 in pairs_high_target:
-                    if len(ids_low_opp) >= 2:
-                        for two in itertools.combinations(ids_low_opp, 2):
-                            candidates.append((p1["ids"], high, list(two), low, "Gender"))
-                            
-    except Exception as e:
-        print(f"Warning: Error generating gender candidates: {e}")
-    
-    return candidates
-
-def _enum_BOTH(df: pd.DataFrame, class_col: str, gender_col: str, lang_col: str,
-               step_col: str, group_col: str, top_k: int = 2) -> List:
-    """Παράγει υποψήφιες ανταλλαγές για ταυτόχρονη διόρθωση."""
-    candidates = []
-    candidates += _enum_LANG(df, class_col, gender_col, lang_col, step_col, group_col, top_k=top_k)
-    candidates += _enum_GENDER(df, class_col, gender_col, lang_col, step_col, group_col, top_k=top_k)
-    return candidates
+                # υπογραφή μεμονωμένου = ((τμήμα, σύνολο, αγόρια, κορίτσια, καλή γνώση),)
+                mismatch = int(order == "same_lang" and sig_A[0][4] != sig_B[0][4])
+                buckets.append((key, (f, order, mismatch, gen_A, classA, gen_B, classB)))
+    buckets.sort(key=lambda b: b[0])
+
+    out = []
+    for _, group in itertools.groupby(buckets, key=lambda b: b[0]):
+        for _, fromA, classA, fromB, classB in heapq.merge(*(_bucket_swaps(*spec) for _, spec in group)):
+            mv = state.moves(fromA, classB, fromB, classA)
+            if state.protected_ok(mv) and state.friendship_ok(mv):
+                out.append((fromA, classA, fromB, classB, reason))
+                if len(out) >= top_k:
+                    return out
+    return out
 
 def _commit_best_swap_if_improves(df: pd.DataFrame, df_baseline: pd.DataFrame,
                                   class_col: str, gender_col: str, lang_col: str,
-                                  step_col: str, group_col: str, objective: str, swap_idx: int) -> Tuple[pd.DataFrame, bool]:
+                                  step_col: str, group_col: str, objective: str, swap_idx: int,
+                                  state: Optional[_SwapState] = None,
+                                  top_k: int = TOP_K_SWAPS,
+                                  journal: Optional[List[Dict[str, Any]]] = None) -> Tuple[pd.DataFrame, bool]:
     """
     Επιχειρεί να βρει και εφαρμόσει τη βέλτιστη ανταλλαγή με πλήρεις ελέγχους συμμόρφωσης.
     ✅ ΔΙΟΡΘΩΣΗ: Περιλαμβάνει baseline constraints checking.
+    Μόνο η ανταλλαγή που τελικά εφαρμόζεται γράφεται στο df· το `state` ενημερώνεται επί τόπου
+    και, αν δοθεί `journal`, προστίθεται εγγραφή της.
     """
-    
-    # Παραγωγή υποψηφίων
-    if objective == "LANG":
-        candidates = _enum_LANG(df, class_col, gender_col, lang_col, step_col, group_col)
-    elif objective == "GENDER":
-        candidates = _enum_GENDER(df, class_col, gender_col, lang_col, step_col, group_col)
-    else:  # BOTH
-        candidates = _enum_BOTH(df, class_col, gender_col, lang_col, step_col, group_col)
+    if state is None:
+        state = _SwapState(df, df_baseline, class_col, gender_col, lang_col, group_col)
 
-    ranked = _rank_candidates(df, df_baseline, class_col, gender_col, lang_col, step_col, group_col, candidates, objective)
+    # Lazy παραγωγή υποψηφίων σε σειρά κατάταξης· σταματά στις top_k εφικτές βελτιώσεις
+    singles, pairs = _eligible_units(df, class_col, step_col, group_col, gender_col, lang_col)
+    ranked = _ranked_swaps(state, singles, pairs, objective, top_k=top_k)
     if not ranked: 
         return df, False
 
-    base_penalty = penalty_score(df, class_col, gender_col, lang_col)
-
-    # Δοκιμή καλύτερης ανταλλαγής - ήδη φιλτραρισμένη από _rank_candidates
-    for (fromA, classA, fromB, classB, reason) in ranked:
-        try:
-            tmp = _apply_swap(df, class_col, fromA, classB, fromB, classA, reason, swap_idx, step_col, group_col)
-            
-            # Όλοι οι έλεγχοι έχουν ήδη γίνει στο _rank_candidates
-            # Απλά ελέγχουμε τη βελτίωση penalty
-            new_penalty = penalty_score(tmp, class_col, gender_col, lang_col)
-            if new_penalty < base_penalty:
-                return tmp, True
-                
-        except Exception as e:
-            print(f"Warning: Error applying swap: {e}")
-            continue
+    # Η πρώτη είναι η καλύτερη: όλοι οι έλεγχοι και η βελτίωση penalty έχουν ήδη γίνει
+    fromA, classA, fromB, classB, reason = ranked[0]
+    try:
+        mv = state.moves(fromA, classB, fromB, classA)
+        tmp = _apply_swap(df, class_col, fromA, classB, fromB, classA, reason, swap_idx, step_col, group_col)
+        pen_before = state.penalty()
+        state.apply(mv)
+        if journal is not None:
+            journal.append(_journal_entry(swap_idx, fromA, classA, fromB, classB, reason, pen_before, state.penalty()))
+        return tmp, True
+    except Exception as e:
+        print(f"Warning: Error applying swap: {e}")
     
     return df, False
 
+# --------------------------
+# Local search (tabu / simulated annealing)
+# --------------------------
+def _search_units(state: _SwapState, singles: Dict[Any, List], pairs: Dict[Any, List]) -> Tuple[Dict[int, List[Tuple]], Dict[int, List[Tuple]]]:
+    """
+    Κινητές μονάδες ανά κωδικό τμήματος: μεμονωμένοι Β5 και ενωμένες δυάδες Β4.
+    Οι σπασμένες δυάδες μένουν εκτός: κάθε μετακίνησή τους θα τις επανένωνε.
+    """
+    single_by_class: Dict[int, List[Tuple]] = {k: [] for k in range(len(state.classes))}
+    pair_by_class: Dict[int, List[Tuple]] = {k: [] for k in range(len(state.classes))}
+    for ids in singles.values():
+        for i in ids:
+            rows = state.rows_of.get(i, ())
+            if rows and state.codes[rows[0]] >= 0:
+                single_by_class[int(state.codes[rows[0]])].append((i,))
+    seen = set()
+    for plist in pairs.values():
+        for p in plist:
+            if p["is_split"] or p["group_id"] in seen:
+                continue
+            seen.add(p["group_id"])
+            rows = [r for i in p["ids"] for r in state.rows_of.get(i, ())]
+            if rows and state.codes[rows[0]] >= 0:
+                pair_by_class[int(state.codes[rows[0]])].append(tuple(p["ids"]))
+    return single_by_class, pair_by_class
+
+def _random_neighbour(state: _SwapState, single_by_class: Dict[int, List[Tuple]],
+                      pair_by_class: Dict[int, List[Tuple]], rng: random.Random) -> Optional[Tuple]:
+    """Τυχαία ανταλλαγή 1↔1, 2↔2 ή 2↔1+1 μεταξύ δύο τμημάτων: (unitA, a, unitB, b) ή None."""
+    K = len(state.classes)
+    if K < 2:
+        return None
+    a, b = rng.sample(range(K), 2)
+    kind = rng.random()
+    if kind < 0.5:
+        if single_by_class[a] and single_by_class[b]:
+            return rng.choice(single_by_class[a]), a, rng.choice(single_by_class[b]), b
+    elif kind < 0.75:
+        if pair_by_class[a] and pair_by_class[b]:
+            return rng.choice(pair_by_class[a]), a, rng.choice(pair_by_class[b]), b
+    elif pair_by_class[a] and len(single_by_class[b]) >= 2:
+        s1, s2 = rng.sample(single_by_class[b], 2)
+        return rng.choice(pair_by_class[a]), a, s1 + s2, b
+    return None
+
+def _local_search(state: _SwapState, singles: Dict[Any, List], pairs: Dict[Any, List],
+                  method: str, deadline: float, rng: random.Random) -> List[Tuple]:
+    """
+    Tabu ή simulated annealing πάνω στο _SwapState μέχρι το deadline (time.perf_counter()) ή
+    SEARCH_MAX_IDLE διαδοχικούς γύρους χωρίς εφικτό γείτονα.
+    Ίδιοι απαραβίαστοι κανόνες με το greedy (όριο 25, πληθυσμός ≤ TARGET_POP_DIFF, προστατευόμενοι
+    έναντι baseline, καμία νέα διάσπαση/επανένωση ομάδας). Επιτρέπει προσωρινά χειρότερες κινήσεις,
+    αλλά στο τέλος το state επιστρέφει στην καλύτερη λύση.
+    Επιστρέφει τις ανταλλαγές (fromA, classA, fromB, classB, reason, penalty πριν, penalty μετά)
+    από την αρχή ως την καλύτερη λύση.
+    """
+    single_by_class, pair_by_class = _search_units(state, singles, pairs)
+    cur_pen = best_pen = state.penalty()
+    path: List[Tuple] = []   # (swap, units, prev codes)
+    best_len = 0
+    tabu: Dict[Tuple, int] = {}
+    it = idle = 0
+    start = time.perf_counter()
+
+    def evaluate(nb):
+        uA, a, uB, b = nb
+        mv = state.moves(list(uA), state.classes[b], list(uB), state.classes[a])
+        counts = state.counts_after(mv)
+        if not state.size_ok(counts) or state.deltas(counts)["pop"] > TARGET_POP_DIFF:
+            return None
+        if not (state.protected_ok(mv) and state.friendship_ok(mv)):
+            return None
+        return mv, state.penalty(counts)
+
+    def commit(nb, mv, pen):
+        uA, a, uB, b = nb
+        reason = _reason_from_deltas(state.deltas(), "BOTH")
+        prev = {r: int(state.codes[r]) for r in mv}
+        pen_before = state.penalty()
+        state.apply(mv)
+        for u, src, dst in ((uA, a, b), (uB, b, a)):
+            pool = single_by_class if len(u) == 1 else pair_by_class
+            if len(u) == 1 or u in pool[src]:
+                pool[src].remove(u)
+                pool[dst].append(u)
+            else:   # ζεύγος μεμονωμένων (2↔1+1)
+                for i in u:
+                    single_by_class[src].remove((i,))
+                    single_by_class[dst].append((i,))
+        path.append(((list(uA), state.classes[a], list(uB), state.classes[b], reason, pen_before, pen), prev))
+
+    while best_pen > 0 and idle < SEARCH_MAX_IDLE and time.perf_counter() < deadline:
+        it += 1
+        idle += 1
+        if method == "tabu":
+            best_nb = None
+            for _ in range(TABU_SAMPLES):
+                nb = _random_neighbour(state, single_by_class, pair_by_class, rng)
+                if nb is None:
+                    continue
+                ev = evaluate(nb)
+                if ev is None:
+                    continue
+                idle = 0
+                is_tabu = tabu.get(nb[0], 0) > it or tabu.get(nb[2], 0) > it
+                if is_tabu and ev[1] >= best_pen:   # aspiration: μόνο αν βελτιώνει το καλύτερο
+                    continue
+                if best_nb is None or ev[1] < best_nb[2][1]:
+                    best_nb = (nb, None, ev)
+            if best_nb is None:
+                continue
+            nb, _, (mv, pen) = best_nb
+            commit(nb, mv, pen)
+            tabu[nb[0]] = tabu[nb[2]] = it + TABU_TENURE + rng.randint(0, 3)
+        else:
+            nb = _random_neighbour(state, single_by_class, pair_by_class, rng)
+            if nb is None:
+                continue
+            ev = evaluate(nb)
+            if ev is None:
+                continue
+            idle = 0
+            mv, pen = ev
+            frac = min(1.0, (time.perf_counter() - start) / max(1e-9, deadline - start))
+            T = ANNEAL_T0 * (ANNEAL_T_END / ANNEAL_T0) ** frac
+            if pen > cur_pen and rng.random() >= math.exp(-(pen - cur_pen) / T):
+                continue
+            commit(nb, mv, pen)
+        cur_pen = pen
+        if cur_pen < best_pen:
+            best_pen, best_len = cur_pen, len(path)
+
+    # Επιστροφή στην καλύτερη λύση
+    while len(path) > best_len:
+        _, prev = path.pop()
+        state.apply(prev)
+    return [swap for swap, _ in path]
+
+def _materialise_swaps(df: pd.DataFrame, state: _SwapState, class_col: str,
+                       codes_before: np.ndarray) -> pd.DataFrame:
+    """Γράφει στο df την τελική κατάσταση της τοπικής αναζήτησης με μία ανάθεση στη στήλη τμήματος."""
+    changed = np.flatnonzero(state.codes != codes_before)
+    if len(changed) == 0:
+        return df
+    df = df.copy()
+    df.iloc[changed, df.columns.get_loc(class_col)] = [state.classes[k] for k in state.codes[changed]]
+    return df
+
 # --------------------------
 # Public API
 # --------------------------
+def _step6_job(job: Tuple[str, pd.DataFrame, Dict[str, Any]]) -> Tuple[str, Optional[Dict[str, Any]], Optional[BaseException], float]:
+    """Worker: apply_step6 σε ένα σενάριο· τα σφάλματα επιστρέφονται ως τιμή, μαζί με τον χρόνο (sec)."""
+    name, df5, kwargs = job
+    t0 = time.perf_counter()
+    try:
+        return name, apply_step6(df5.copy(), **kwargs), None, time.perf_counter() - t0
+    except Exception as e:
+        return name, None, e, time.perf_counter() - t0
+
+def _run_step6_jobs(jobs: List[Tuple[str, pd.DataFrame, Dict[str, Any]]],
+                    workers: Optional[int] = 1) -> List[Tuple[str, Optional[Dict[str, Any]], Optional[BaseException], float]]:
+    """Εκτελεί τα σενάρια (σειριακά ή, με workers > 1, σε process pool), με αποτελέσματα στη σειρά των jobs."""
+    return run_jobs(_step6_job, jobs, workers)
+
 def apply_step6_to_step5_scenarios(step5_outputs: Dict[str, pd.DataFrame],
                                    *, class_col: str = "ΤΜΗΜΑ", id_col: str = "ID", 
                                    gender_col: str = "ΦΥΛΟ", lang_col: str = "ΚΑΛΗ_ΓΝΩΣΗ_ΕΛΛΗΝΙΚΩΝ", 
                                    step_col: str = "ΒΗΜΑ_ΤΟΠΟΘΕΤΗΣΗΣ", group_col: str = "GROUP_ID", 
-                                   max_iter: int = MAX_ITER) -> Dict[str, Dict]:
+                                   max_iter: int = MAX_ITER, workers: Optional[int] = 1,
+                                   optimizer: str = "greedy", time_limit: float = SEARCH_TIME_LIMIT,
+                                   seed: Optional[int] = None) -> Dict[str, Dict]:
     """
-    Εφαρμόζει το Βήμα 6 σε πολλαπλά σενάρια από το Βήμα 5.
+    Εφαρμόζει το Βήμα 6 σε πολλαπλά σενάρια από το Βήμα 5 (με workers > 1: ένα σενάριο ανά διεργασία).
     
     Args:
         step5_outputs: Dict με σενάρια {"ΣΕΝΑΡΙΟ_1": df5_1, ...}
+        workers: πλήθος διεργασιών (1/None = σειριακά, >1 = process pool)
+        seed: βάση seed τοπικής αναζήτησης (σενάριο i → seed + i)
         
     Returns:
-        Dict με ίδια keys και values {"df": df6, "summary": {...}}
+        Dict με ίδια keys (ίδια σειρά) και values {"df": df6, "summary": {...}}·
+        κάθε summary περιέχει και "wall_time_s".
     """
+    common = dict(class_col=class_col, id_col=id_col, gender_col=gender_col, lang_col=lang_col,
+                  step_col=step_col, group_col=group_col, max_iter=max_iter,
+                  optimizer=optimizer, time_limit=time_limit)
+    jobs = [(name, df5, dict(common, seed=None if seed is None else seed + i))
+            for i, (name, df5) in enumerate(step5_outputs.items())]
+
     results = {}
-    for name, df5 in step5_outputs.items():
-        try:
-            result = apply_step6(df5.copy(), class_col=class_col, id_col=id_col, 
-                               gender_col=gender_col, lang_col=lang_col, 
-                               step_col=step_col, group_col=group_col, max_iter=max_iter)
-            results[name] = result
-        except Exception as e:
-            print(f"Error processing scenario {name}: {e}")
-            results[name] = {"df": df5.copy(), "summary": {"status": "ERROR", "error": str(e)}}
+    for name, result, err, wall in _run_step6_jobs(jobs, workers):
+        if err is not None:
+            print(f"Error processing scenario {name}: {err}")
+            result = {"df": step5_outputs[name].copy(), "summary": {"status": "ERROR", "error": str(err)}, "journal": []}
+        result["summary"]["wall_time_s"] = round(wall, 4)
+        results[name] = result
     
     return results
 
@@ -694,7 +980,9 @@ def apply_step6(df: pd.DataFrame,
                 *, class_col: str = "ΤΜΗΜΑ", id_col: str = "ID", 
                 gender_col: str = "ΦΥΛΟ", lang_col: str = "ΚΑΛΗ_ΓΝΩΣΗ_ΕΛΛΗΝΙΚΩΝ",
                 step_col: str = "ΒΗΜΑ_ΤΟΠΟΘΕΤΗΣΗΣ", group_col: str = "GROUP_ID", 
-                max_iter: int = MAX_ITER) -> Dict[str, Any]:
+                max_iter: int = MAX_ITER, optimizer: str = "greedy",
+                time_limit: float = SEARCH_TIME_LIMIT, seed: Optional[int] = None,
+                audit: bool = True) -> Dict[str, Any]:
     """
     Εφαρμογή Βήματος 6: Τελικός Ποιοτικός και Ποσοτικός Έλεγχος.
     
@@ -715,9 +1003,14 @@ def apply_step6(df: pd.DataFrame,
     Args:
         df: DataFrame με μαθητές μετά το Βήμα 5
         max_iter: Μέγιστος αριθμός επαναλήψεων
+        optimizer: "greedy" (μόνο hill climb) ή "tabu"/"anneal" (τοπική αναζήτηση μετά το greedy)
+        time_limit: Χρονικό όριο (sec) της τοπικής αναζήτησης
+        seed: Seed της τοπικής αναζήτησης (αναπαραγωγιμότητα)
+        audit: αν True, αποδίδονται στο τέλος οι audit στήλες από το journal (render_step6_audit)
         
     Returns:
-        Dict με "df" (βελτιωμένο DataFrame) και "summary" (στατιστικά)
+        Dict με "df" (βελτιωμένο DataFrame), "summary" (στατιστικά) και
+        "journal" (λίστα ανταλλαγών: swap_id, ids/τμήματα, αιτία, penalty πριν/μετά)
     """
     # Αρχικοποίηση
     global _IDCOL
@@ -727,6 +1020,10 @@ def apply_step6(df: pd.DataFrame,
     if "ΤΜΗΜΑ_ΠΡΙΝ_ΒΗΜΑ6" not in df.columns and class_col in df.columns:
         df["ΤΜΗΜΑ_ΠΡΙΝ_ΒΗΜΑ6"] = df[class_col]
 
+    if optimizer not in OPTIMIZERS:
+        raise ValueError(f"Άγνωστος optimizer: {optimizer} (επιτρέπονται: {', '.join(OPTIMIZERS)})")
+    t_start = time.perf_counter()
+
     # Έλεγχος απαραίτητων στηλών
     required_cols = [id_col, class_col, gender_col, lang_col, step_col]
     missing_cols = [col for col in required_cols if col not in df.columns]
@@ -748,12 +1045,6 @@ def apply_step6(df: pd.DataFrame,
         df = df.copy()
         df[group_col] = np.nan
 
-    # Audit στήλες
-    audit_cols = ["ΒΗΜΑ6_ΚΙΝΗΣΗ", "ΑΙΤΙΑ_ΑΛΛΑΓΗΣ", "ΠΗΓΗ_ΒΗΜΑ"]
-    for col in audit_cols:
-        if col not in df.columns:
-            df[col] = None
-
     if available_baselines:
         print(f"Baseline mapping for protected constraints: {available_baselines}")
 
@@ -765,12 +1056,17 @@ def apply_step6(df: pd.DataFrame,
     # Κύριος αλγόριθμος
     iterations = 0
     status = "VALID"
+    state = None
+    search_swaps: List[Tuple] = []
+    journal: List[Dict[str, Any]] = []
     
     try:
+        baseline_counts = _baseline_protected_counts(df_baseline, class_col)
+        state = _SwapState(df, df_baseline, class_col, gender_col, lang_col, group_col,
+                           baseline_counts=baseline_counts)
         while iterations < max_iter:
             iterations += 1
-            metrics = _metrics(df, class_col, gender_col, lang_col)
-            deltas = metrics["deltas"]
+            deltas = state.deltas()
             
             # Έλεγχος στόχων
             within_targets = (
@@ -785,41 +1081,57 @@ def apply_step6(df: pd.DataFrame,
                     # Γ: Ταυτόχρονη απόκλιση - προτεραιότητα στο φύλο
                     df_new, changed = _commit_best_swap_if_improves(
                         df, df_baseline, class_col, gender_col, lang_col, 
-                        step_col, group_col, "GENDER", iterations
+                        step_col, group_col, "GENDER", iterations, state=state, journal=journal
                     )
                     if not changed:
                         # Αν δεν βελτιώθηκε το φύλο, δοκίμασε γλώσσα
                         df_new, changed = _commit_best_swap_if_improves(
                             df, df_baseline, class_col, gender_col, lang_col, 
-                            step_col, group_col, "LANG", iterations
+                            step_col, group_col, "LANG", iterations, state=state, journal=journal
                         )
                 elif deltas["gender"] > TARGET_GENDER_DIFF:
                     # Β: Μόνο φύλο εκτός στόχου
                     df_new, changed = _commit_best_swap_if_improves(
                         df, df_baseline, class_col, gender_col, lang_col, 
-                        step_col, group_col, "GENDER", iterations
+                        step_col, group_col, "GENDER", iterations, state=state, journal=journal
                     )
                 else:
                     # Α: Μόνο γλώσσα εκτός στόχου
                     df_new, changed = _commit_best_swap_if_improves(
                         df, df_baseline, class_col, gender_col, lang_col, 
-                        step_col, group_col, "LANG", iterations
+                        step_col, group_col, "LANG", iterations, state=state, journal=journal
                     )
             else:
                 # Εντός στόχων: συνέχεια βελτίωσης (θα καταγραφεί ως Population)
                 df_new, changed = _commit_best_swap_if_improves(
                     df, df_baseline, class_col, gender_col, lang_col, 
-                    step_col, group_col, "BOTH", iterations
+                    step_col, group_col, "BOTH", iterations, state=state, journal=journal
                 )
             
             if not changed:
                 break
             df = df_new
 
+        # Τοπική αναζήτηση από τη λύση του greedy, μέχρι το χρονικό όριο
+        if optimizer != "greedy":
+            codes_before = state.codes.copy()
+            singles, pairs = _eligible_units(df, class_col, step_col, group_col, gender_col, lang_col)
+            search_swaps = _local_search(state, singles, pairs, optimizer,
+                                         t_start + time_limit, random.Random(seed))
+            n_greedy = len(journal)   # συνεχής αρίθμηση μετά τις ανταλλαγές του greedy
+            for n, (fromA, classA, fromB, classB, reason, pen_before, pen_after) in enumerate(search_swaps):
+                journal.append(_journal_entry(n_greedy + 1 + n, fromA, classA, fromB, classB,
+                                              reason, pen_before, pen_after))
+            df = _materialise_swaps(df, state, class_col, codes_before)
+
     except Exception as e:
         print(f"Error in step 6 iterations: {e}")
         status = "ERROR"
 
+    # Audit στήλες: μία απόδοση από το journal (όχι ανά υποψήφια ανταλλαγή)
+    if audit:
+        df = render_step6_audit(df, journal, id_col=id_col, group_col=group_col)
+
     # Τελικός έλεγχος
     try:
         final_metrics = _metrics(df, class_col, gender_col, lang_col)
@@ -902,7 +1214,8 @@ def apply_step6(df: pd.DataFrame,
         "iterations": iterations,
         "final_deltas": final_metrics.get("deltas", {}),
         "per_class": final_metrics.get("per_class", {}),
-        "broken_friendships_per_class": final_metrics.get("broken_friendships_per_class", {}),
+        "broken_friendships_per_class": (state.broken_per_class() if state is not None and status != "ERROR"
+                                         else final_metrics.get("broken_friendships_per_class", {})),
         "final_penalty": final_penalty,
         "status": status,
         "targets": {
@@ -910,11 +1223,13 @@ def apply_step6(df: pd.DataFrame,
             "gender": TARGET_GENDER_DIFF, 
             "language": TARGET_LANG_DIFF
         },
+        "optimizer": optimizer,
+        "search_swaps": len(search_swaps),
         "protected_columns": available_protected,
         "baseline_mapping": available_baselines
     }
 
-    return {"df": df, "summary": summary}
+    return {"df": df, "summary": summary, "journal": journal}
 
 
 if __name__ == "__main__":
@@ -984,7 +1299,11 @@ def _idx(s: str) -> int:
 
 # ========= Step 5 (preserve L, write M) — optional dependency =========
 
-def export_single_noaudit(in14_path: str, out_path: str):
+def export_single_noaudit(in14_path: str, out_path: str, workers: Optional[int] = 1) -> Dict[str, Dict[str, Any]]:
+    """
+    Προετοιμασία όλων των sheets → Βήμα 6 (workers > 1: process pool) → εγγραφή με τη σειρά των sheets.
+    Επιστρέφει {sheet: summary Βήματος 6} (με "wall_time_s").
+    """
     in14 = Path(in14_path)
     if not in14.exists():
         raise FileNotFoundError(f"Δεν βρέθηκε το αρχείο: {in14}")
@@ -992,51 +1311,60 @@ def export_single_noaudit(in14_path: str, out_path: str):
     xls = pd.ExcelFile(in14)
     sheets = [s for s in xls.sheet_names if s != "Σύνοψη"]
 
+    prepared = []
+    for s in sheets:
+        df = pd.read_excel(in14, sheet_name=s)
+        df = _ensure_base(df)
+        N = _idx(s)
+        s1, s2, s3 = f"ΒΗΜΑ1_ΣΕΝΑΡΙΟ_{N}", f"ΒΗΜΑ2_ΣΕΝΑΡΙΟ_{N}", f"ΒΗΜΑ3_ΣΕΝΑΡΙΟ_{N}"
+        s4, s5 = f"ΒΗΜΑ4_ΣΕΝΑΡΙΟ_{N}", f"ΒΗΜΑ5_ΣΕΝΑΡΙΟ_{N}"
+
+        # Ensure I..K
+        for c in (s1, s2, s3):
+            if c not in df.columns:
+                df[c] = np.nan
+
+        # Ensure L from source (exact)
+        if s4 not in df.columns:
+            c4 = [c for c in df.columns if str(c).startswith("ΒΗΜΑ4_")]
+            if c4:
+                df = df.rename(columns={c4[0]: s4})
+            else:
+                df[s4] = np.nan
+
+        # Step 5: preserve L, write M
+        df5 = df.copy()
+        if s5 not in df5.columns:
+            c5 = [c for c in df5.columns if str(c).startswith("ΒΗΜΑ5_")]
+            if c5:
+                df5 = df5.rename(columns={c5[0]: s5})
+            else:
+                df5[s5] = df5[s4]
+
+        # Prepare Step 6 inputs
+        if "ΤΜΗΜΑ_ΒΗΜΑ1" not in df5.columns: df5["ΤΜΗΜΑ_ΒΗΜΑ1"] = df5[s1]
+        if "ΤΜΗΜΑ_ΒΗΜΑ2" not in df5.columns: df5["ΤΜΗΜΑ_ΒΗΜΑ2"] = df5[s2]
+        if "GROUP_ID" not in df5.columns: df5["GROUP_ID"] = np.nan
+        if "ΒΗΜΑ_ΤΟΠΟΘΕΤΗΣΗΣ" not in df5.columns:
+            df5["ΒΗΜΑ_ΤΟΠΟΘΕΤΗΣΗΣ"] = [4 if str(l).strip() != "" else (5 if str(m).strip() != "" else np.nan) for l, m in zip(df5[s4], df5[s5])]
+        prepared.append((s, N, df5))
+
+    # Run embedded Step 6 (ένα σενάριο ανά job)
+    jobs = [(s, df5, dict(class_col=f"ΒΗΜΑ5_ΣΕΝΑΡΙΟ_{N}", id_col="Α/Α",
+                          gender_col="ΦΥΛΟ", lang_col="ΚΑΛΗ_ΓΝΩΣΗ_ΕΛΛΗΝΙΚΩΝ",
+                          step_col="ΒΗΜΑ_ΤΟΠΟΘΕΤΗΣΗΣ", group_col="GROUP_ID", max_iter=5, audit=False))
+            for s, N, df5 in prepared]
+    outputs = _run_step6_jobs(jobs, workers)
+
+    summaries = {}
     with pd.ExcelWriter(out_path, engine="xlsxwriter") as w:
-        for s in sheets:
-            df = pd.read_excel(in14, sheet_name=s)
-            df = _ensure_base(df)
-            N = _idx(s)
+        for (s, N, df5), (_, out6, err, wall) in zip(prepared, outputs):
+            if err is not None:
+                raise err
+            out6["summary"]["wall_time_s"] = round(wall, 4)
+            summaries[s] = out6["summary"]
             s1, s2, s3 = f"ΒΗΜΑ1_ΣΕΝΑΡΙΟ_{N}", f"ΒΗΜΑ2_ΣΕΝΑΡΙΟ_{N}", f"ΒΗΜΑ3_ΣΕΝΑΡΙΟ_{N}"
             s4, s5, s6c = f"ΒΗΜΑ4_ΣΕΝΑΡΙΟ_{N}", f"ΒΗΜΑ5_ΣΕΝΑΡΙΟ_{N}", f"ΒΗΜΑ6_ΣΕΝΑΡΙΟ_{N}"
-
-            # Ensure I..K
-            for c in (s1, s2, s3):
-                if c not in df.columns:
-                    df[c] = np.nan
-
-            # Ensure L from source (exact)
-            if s4 not in df.columns:
-                c4 = [c for c in df.columns if str(c).startswith("ΒΗΜΑ4_")]
-                if c4:
-                    df = df.rename(columns={c4[0]: s4})
-                else:
-                    df[s4] = np.nan
-
-            # Step 5: preserve L, write M
-            df5 = df.copy()
-            if s5 not in df5.columns:
-                c5 = [c for c in df5.columns if str(c).startswith("ΒΗΜΑ5_")]
-                if c5:
-                    df5 = df5.rename(columns={c5[0]: s5})
-                else:
-                    df5[s5] = df5[s4]
-
-            # Prepare Step 6 inputs
-            if "ΤΜΗΜΑ_ΒΗΜΑ1" not in df5.columns: df5["ΤΜΗΜΑ_ΒΗΜΑ1"] = df5[s1]
-            if "ΤΜΗΜΑ_ΒΗΜΑ2" not in df5.columns: df5["ΤΜΗΜΑ_ΒΗΜΑ2"] = df5[s2]
-            if "GROUP_ID" not in df5.columns: df5["GROUP_ID"] = np.nan
-            if "ΒΗΜΑ_ΤΟΠΟΘΕΤΗΣΗΣ" not in df5.columns:
-                df5["ΒΗΜΑ_ΤΟΠΟΘΕΤΗΣΗΣ"] = [4 if str(l).strip() != "" else (5 if str(m).strip() != "" else np.nan) for l, m in zip(df5[s4], df5[s5])]
-
-            # Run embedded Step 6
-            out6 = apply_step6(
-                df5.copy(),
-                class_col=s5, id_col="Α/Α",
-                gender_col="ΦΥΛΟ", lang_col="ΚΑΛΗ_ΓΝΩΣΗ_ΕΛΛΗΝΙΚΩΝ",
-                step_col="ΒΗΜΑ_ΤΟΠΟΘΕΤΗΣΗΣ", group_col="GROUP_ID",
-                max_iter=5
-            )
             df6 = out6["df"].copy()
 
             # Ensure N column and order strictly A–H + I..N (no audit after)
@@ -1055,6 +1383,7 @@ def export_single_noaudit(in14_path: str, out_path: str):
             ws = w.sheets[f"ΣΕΝΑΡΙΟ_{N}"]
             for i in range(len(out.columns)):
                 ws.set_column(i, i, 22)
+    return summaries
 
 if __name__ == "__main__":
     if len(sys.argv) < 3:
@@ -18,11 +18,13 @@ step_7_final_score_CORRECTED.py
 - Ποινή = (4-1)*3 = 9 (αν >1)
 """
 from __future__ import annotations
-import random
+import random, hashlib
+from functools import lru_cache
 from typing import Iterable, List, Tuple, Dict, Any, Optional
 import pandas as pd
 import numpy as np
 import re
+from friends_parser import parse_list_cell, parse_column
 
 RANDOM_SEED = 42
 random.seed(RANDOM_SEED)
@@ -40,24 +42,7 @@ def _is_yes(x) -> bool:
 def _is_no(x) -> bool:
     return _norm_str(x) in NO_TOKENS
 
-def _parse_friends_cell(x) -> List[str]:
-    """Δέχεται λίστα ή string. Επιστρέφει λίστα ονομάτων (stripped)."""
-    if isinstance(x, list):
-        return [str(t).strip() for t in x if str(t).strip()]
-    s = str(x) if x is not None else ""
-    s = s.strip()
-    if not s or s.upper() == "NAN":
-        return []
-    # Προσπάθησε python-literal list
-    try:
-        val = eval(s, {}, {})
-        if isinstance(val, list):
-            return [str(t).strip() for t in val if str(t).strip()]
-    except Exception:
-        pass
-    # Αλλιώς split σε κοινούς διαχωριστές
-    parts = re.split(r"[,\|\;/·\n]+", s)
-    return [p.strip() for p in parts if p.strip()]
+_parse_friends_cell = parse_list_cell
 
 def _infer_num_classes_from_values(vals: Iterable[str]) -> int:
     """Επιστρέφει #τμημάτων κοιτώντας labels τύπου Α1, Α2, ..."""
@@ -103,14 +88,12 @@ def _pairwise_differences_sum(counts: Dict[str, int]) -> int:
     Υπολογίζει το άθροισμα διαφορών όλων των ζευγαριών (για tie-breaking).
     Για τμήματα Α1(25), Α2(23), Α3(23):
     |25-23| + |25-23| + |23-23| = 2+2+0 = 4
+    Ταξινόμηση + προθεματικά αθροίσματα, O(K log K): η i-οστή μικρότερη τιμή
+    εμφανίζεται με + σε i ζεύγη και με − σε (K-1-i).
     """
-    values = list(counts.values())
-    total_diff = 0
+    values = sorted(counts.values())
     n = len(values)
-    for i in range(n):
-        for j in range(i+1, n):
-            total_diff += abs(values[i] - values[j])
-    return total_diff
+    return sum(v * (2 * i - (n - 1)) for i, v in enumerate(values))
 
 def _pairwise_penalty(counts: Dict[str, int], free: int, weight: int) -> int:
     """
@@ -120,16 +103,19 @@ def _pairwise_penalty(counts: Dict[str, int], free: int, weight: int) -> int:
     - Ζεύγος Α1-Α3: |10-6|=4 → (4-1)*2 = 6  
     - Ζεύγος Α2-Α3: |7-6|=1  → (1-1)*2 = 0
     - Συνολική ποινή = 4+6+0 = 10
+    Two-pointer πάνω σε ταξινομημένες τιμές, O(K log K): για κάθε v_j, οι
+    c_j μικρότερες τιμές με v_i < v_j - free συνεισφέρουν c_j*(v_j - free) - Σv_i.
     """
-    values = list(counts.values())
+    values = sorted(counts.values())
     penalty = 0
-    n = len(values)
-    for i in range(n):
-        for j in range(i+1, n):
-            diff = abs(values[i] - values[j])
-            if diff > free:
-                penalty += (diff - free) * weight
-    return penalty
+    prefix = [0]
+    c = 0
+    for v in values:
+        while values[c] < v - free:
+            c += 1
+        penalty += c * (v - free) - prefix[c]
+        prefix.append(prefix[-1] + v)
+    return penalty * weight
 
 def _pair_conflict_penalty(aZ, aI, bZ, bI) -> int:
     """Ποινή παιδαγωγικής σύγκρουσης ανά ζεύγος (unchanged)."""
@@ -159,45 +145,271 @@ def _all_conflicts_sum(df: pd.DataFrame, scenario_col: str) -> int:
         s += _class_conflict_sum(class_df)
     return s
 
+@lru_cache(maxsize=16)
+def _mutual_pairs_cached(names: Tuple[str, ...], cells: Tuple[Any, ...]) -> Tuple[Tuple[str,str], ...]:
+    """
+    Κάθε σύνολο φίλων διατρέχεται μία φορά με έλεγχο αντίστροφης συμμετοχής — O(συνολικές αναφορές).
+    Η στήλη γίνεται bulk parse σε ids (parse_column)· άγνωστα ονόματα δεν σχηματίζουν ποτέ δυάδα.
+    """
+    ids = parse_column(pd.Series(list(cells), dtype=object), names).tolist()
+    name2friends = {a: {names[j] for j in row} for a, row in zip(names, ids)}
+    pairs = set()
+    for a, friends in name2friends.items():
+        for b in friends:
+            if b != a and a in name2friends.get(b, ()):
+                pairs.add((a, b) if a < b else (b, a))
+    return tuple(sorted(pairs))
+
 def _mutual_pairs(df: pd.DataFrame) -> List[Tuple[str,str]]:
-    """Βρίσκει όλες τις *πλήρως αμοιβαίες* δυάδες από «ΦΙΛΟΙ» (unchanged)."""
+    """Βρίσκει όλες τις *πλήρως αμοιβαίες* δυάδες από «ΦΙΛΟΙ» (memo ανά roster)."""
     if "ΦΙΛΟΙ" not in df.columns:
         return []
-    name2friends = {}
-    for _, r in df.iterrows():
-        name = str(r.get("ΟΝΟΜΑ")).strip()
-        friends = set(_parse_friends_cell(r.get("ΦΙΛΟΙ")))
-        name2friends[name] = friends
-    pairs = set()
-    names = sorted(name2friends.keys())
-    for i, a in enumerate(names):
-        for b in names[i+1:]:
-            if a in name2friends.get(b, set()) and b in name2friends.get(a, set()):
-                pairs.add(tuple(sorted((a,b))))
-    return sorted(pairs)
+    names = tuple(str(x).strip() for x in (df["ΟΝΟΜΑ"] if "ΟΝΟΜΑ" in df.columns else [None] * len(df)))
+    cells = tuple(df["ΦΙΛΟΙ"].tolist())
+    try:
+        return list(_mutual_pairs_cached(names, cells))
+    except TypeError:  # μη-hashable κελιά (π.χ. list) → χωρίς memo
+        return list(_mutual_pairs_cached.__wrapped__(names, cells))
 
-def _broken_friendships_count(df: pd.DataFrame, scenario_col: str, critical_pairs: Optional[List[Tuple[str,str]]] = None,
-                              count_unassigned_as_broken: bool=False) -> int:
-    """Μετρά πόσες αμοιβαίες δυάδες ΔΕΝ κατέληξαν στο ίδιο τμήμα (unchanged)."""
+def _pair_rows(df: pd.DataFrame, critical_pairs: Optional[List[Tuple[str,str]]] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Γραμμές (ra, rb) των δυάδων φιλίας (αμοιβαίες ή critical_pairs).
+    Τελευταία εμφάνιση ονόματος κερδίζει· άγνωστο όνομα → γραμμή len(df) (= χωρίς τμήμα).
+    """
     if critical_pairs is None:
         pairs = _mutual_pairs(df)
     else:
         pairs = [tuple(sorted((str(a).strip(), str(b).strip()))) for a,b in critical_pairs]
-    name2class = {str(r["ΟΝΟΜΑ"]).strip(): r.get(scenario_col) for _, r in df.iterrows()}
-    broken = 0
-    for a,b in pairs:
-        ca = name2class.get(a, np.nan)
-        cb = name2class.get(b, np.nan)
-        if pd.isna(ca) or pd.isna(cb):
-            if count_unassigned_as_broken:
-                broken += 1
-            continue
-        if str(ca) != str(cb):
-            broken += 1
+    n = len(df)
+    if not pairs:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    row_of = {str(nm).strip(): i for i, nm in enumerate(df["ΟΝΟΜΑ"].tolist())}
+    ra = np.array([row_of.get(a, n) for a, _ in pairs], dtype=np.int64)
+    rb = np.array([row_of.get(b, n) for _, b in pairs], dtype=np.int64)
+    return ra, rb
+
+def _broken_per_column(df: pd.DataFrame, codes: np.ndarray, critical_pairs: Optional[List[Tuple[str,str]]] = None,
+                       count_unassigned_as_broken: bool=False) -> np.ndarray:
+    """Σπασμένες δυάδες ανά στήλη του (N × S) πίνακα κωδικών — lookup γραμμών, όχι iterrows."""
+    n, S = codes.shape
+    ra, rb = _pair_rows(df, critical_pairs)
+    if not len(ra):
+        return np.zeros(S, dtype=np.int64)
+    ext = np.vstack([codes, np.full((1, S), -1, dtype=codes.dtype)])
+    ca, cb = ext[ra], ext[rb]
+    assigned = (ca >= 0) & (cb >= 0)
+    broken = (assigned & (ca != cb)).sum(axis=0)
+    if count_unassigned_as_broken:
+        broken = broken + (~assigned).sum(axis=0)
     return broken
 
+def _broken_friendships_count(df: pd.DataFrame, scenario_col: str, critical_pairs: Optional[List[Tuple[str,str]]] = None,
+                              count_unassigned_as_broken: bool=False) -> int:
+    """Μετρά πόσες αμοιβαίες δυάδες ΔΕΝ κατέληξαν στο ίδιο τμήμα."""
+    codes = _class_code_matrix(df, [scenario_col])[0]
+    return int(_broken_per_column(df, codes, critical_pairs, count_unassigned_as_broken)[0])
+
+# ------------------------ Batch scoring (NumPy) ------------------------
+
+_LABEL_RE = re.compile(r"^Α\d+$")
+
+def _encode_roster(df: pd.DataFrame) -> Dict[str, np.ndarray]:
+    """Κωδικοποίηση roster ΜΙΑ φορά: boolean πίνακες ανά μαθητή για φύλο, γνώση, ζωηρό/ιδιαιτερότητα."""
+    n = len(df)
+    false = np.zeros(n, dtype=bool)
+    if "ΦΥΛΟ" in df.columns:
+        g = df["ΦΥΛΟ"].map(_norm_str).to_numpy()
+        boys, girls = g == "Α", g == "Κ"
+    else:
+        boys, girls = false, false
+    if "ΚΑΛΗ_ΓΝΩΣΗ_ΕΛΛΗΝΙΚΩΝ" in df.columns:
+        good = df["ΚΑΛΗ_ΓΝΩΣΗ_ΕΛΛΗΝΙΚΩΝ"].map(_is_yes).to_numpy(dtype=bool)
+    elif "ΓΝΩΣΗ_ΕΛΛΗΝΙΚΩΝ" in df.columns:
+        good = df["ΓΝΩΣΗ_ΕΛΛΗΝΙΚΩΝ"].map(lambda v: _norm_str(v) in {"ΚΑΛΗ", "Ν", "GOOD"}).to_numpy(dtype=bool)
+    else:
+        good = false
+    zi = df[["ΖΩΗΡΟΣ", "ΙΔΙΑΙΤΕΡΟΤΗΤΑ"]].fillna("")
+    lively = zi["ΖΩΗΡΟΣ"].map(_is_yes).to_numpy(dtype=bool)
+    special = zi["ΙΔΙΑΙΤΕΡΟΤΗΤΑ"].map(_is_yes).to_numpy(dtype=bool)
+    return {"boys": boys, "girls": girls, "good": good,
+            "special": special, "lively_only": lively & ~special}
+
+def _class_code_matrix(df: pd.DataFrame, scenario_cols: List[str]) -> Tuple[np.ndarray, np.ndarray, List[str]]:
+    """
+    Στοιβάζει τις στήλες σεναρίων σε (N × S) πίνακες κωδικών:
+    - codes: κωδικός κάθε (str) τιμής, -1 για κενό — για σύγκριση «ίδιο τμήμα» στις φιλίες
+    - lab:   θέση στο ταξινομημένο `labels` (μόνο Α\d+), -1 αλλιώς — για μετρήσεις/ποινές
+    """
+    n, S = len(df), len(scenario_cols)
+    raw = np.empty((n, S), dtype=object)
+    for j, c in enumerate(scenario_cols):
+        v = df[c]
+        raw[:, j] = np.where(v.isna().to_numpy(), None, v.astype(str).to_numpy())
+    codes, uniques = pd.factorize(raw.ravel())
+    codes = codes.reshape(n, S)
+    labels = sorted(u for u in uniques if _LABEL_RE.match(u))
+    pos = {u: i for i, u in enumerate(labels)}
+    lut = np.array([pos.get(u, -1) for u in uniques] + [-1], dtype=np.int64)
+    return codes, lut[codes], labels
+
+def _conflict_from_counts(ni, nz):
+    """Ποινή συγκρούσεων τμήματος από πλήθη: ζεύγη Ι-Ι → 5, Ι-Ζ → 4, Ζ-Ζ → 3 (Ζ = ζωηρός χωρίς ιδιαιτερότητα)."""
+    return 5 * (ni * (ni - 1) // 2) + 4 * ni * nz + 3 * (nz * (nz - 1) // 2)
+
+def _pairwise_batch(counts: np.ndarray, present: np.ndarray, free: int, weight: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    (S × L) μετρήσεις → (άθροισμα διαφορών, ποινή) ανά σενάριο, μόνο για ζεύγη παρόντων τμημάτων.
+    Ίδια ιδέα με _pairwise_differences_sum/_pairwise_penalty ανά γραμμή, O(S·L log L): ταξινόμηση
+    με τα απόντα τμήματα στο τέλος, προθεματικά αθροίσματα και searchsorted για το κατώφλι `free`.
+    """
+    S, L = counts.shape
+    m = present.sum(axis=1)
+    big = int(counts.max(initial=0)) + 1
+    vals = np.sort(np.where(present, counts, big), axis=1)
+    pos = np.arange(L)
+    valid = pos[None, :] < m[:, None]
+    vals = np.where(valid, vals, 0)
+
+    diff = (vals * (2 * pos[None, :] - (m[:, None] - 1))).sum(axis=1)
+
+    # c_j = πλήθος παρόντων v_i < v_j - free (απόντα = big, άρα δεν μετρώνται)· searchsorted
+    # σε όλες τις γραμμές μαζί, με μετατόπιση κάθε γραμμής ώστε να μη «διαρρέει» στην προηγούμενη
+    stride = big + free + 2
+    offset = (np.arange(S) * stride)[:, None]
+    keys = np.where(valid, vals, big) + offset
+    c = np.searchsorted(keys.ravel(), (vals - free + offset).ravel(), side="left").reshape(S, L)
+    c -= (np.arange(S) * L)[:, None]
+    prefix = np.concatenate([np.zeros((S, 1), dtype=np.int64), np.cumsum(vals, axis=1)], axis=1)
+    pen = np.where(valid, c * (vals - free) - np.take_along_axis(prefix, c, axis=1), 0).sum(axis=1)
+    return diff, pen * weight
+
+def score_scenarios(df: pd.DataFrame, scenario_cols: List[str], num_classes: Optional[int] = None,
+                    critical_pairs: Optional[List[Tuple[str,str]]]=None,
+                    count_unassigned_as_broken: bool=False) -> List[Dict[str, Any]]:
+    """
+    Βαθμολογεί ΟΛΕΣ τις στήλες σεναρίων σε ένα πέρασμα — ίδια αποτελέσματα με score_one_scenario ανά στήλη.
+    Roster/φιλίες κωδικοποιούνται μία φορά· μετρήσεις με bincount πάνω στον (N × S) πίνακα, ποινές vectorised.
+    """
+    cols = [c for c in scenario_cols if c in df.columns]
+    if not cols:
+        return []
+    n, S = len(df), len(cols)
+    codes, lab, labels = _class_code_matrix(df, cols)
+    L = max(len(labels), 1)
+    enc = _encode_roster(df)
+
+    rows, cidx = np.nonzero(lab >= 0)
+    flat = lab[rows, cidx] + cidx * L
+    def _count(mask=None) -> np.ndarray:
+        f = flat if mask is None else flat[mask[rows]]
+        return np.bincount(f, minlength=S * L).reshape(S, L).astype(np.int64)
+
+    pop, boys, girls, good = _count(), _count(enc["boys"]), _count(enc["girls"]), _count(enc["good"])
+    present = pop > 0
+    pop_diff, pop_pen = _pairwise_batch(pop, present, free=1, weight=3)
+    boys_diff, boys_pen = _pairwise_batch(boys, present, free=1, weight=2)
+    girls_diff, girls_pen = _pairwise_batch(girls, present, free=1, weight=2)
+    greek_diff, greek_pen = _pairwise_batch(good, present, free=2, weight=1)
+
+    conflict = _conflict_from_counts(_count(enc["special"]), _count(enc["lively_only"])).sum(axis=1)
+
+    broken = _broken_per_column(df, codes, critical_pairs, count_unassigned_as_broken)
+
+    def _as_dict(arr: np.ndarray, s: int) -> Dict[str, int]:
+        return {labels[k]: int(arr[s, k]) for k in np.flatnonzero(present[s])}
+
+    out = []
+    for s, c in enumerate(cols):
+        k = num_classes
+        if k is None:
+            k = int(present[s].sum()) or 2
+        out.append(_score_record(
+            c, k, _as_dict(pop, s), _as_dict(boys, s), _as_dict(girls, s), _as_dict(good, s),
+            pop_diff[s], boys_diff[s], girls_diff[s], greek_diff[s],
+            pop_pen[s], boys_pen[s], girls_pen[s], greek_pen[s], conflict[s], broken[s]))
+    return out
+
+# ------------------------ Fingerprints σεναρίων ------------------------
+
+def scenario_fingerprint(values: Iterable[Any], keys: Optional[Iterable[Any]] = None) -> str:
+    """
+    Κανονικό hash της διαμέρισης σε τμήματα, αναλλοίωτο σε μετονομασία ετικετών Α\d+:
+    οι ετικέτες αριθμούνται με σειρά πρώτης εμφάνισης· κενά και μη-ετικέτες κρατούνται αυτούσια.
+    Ίδιο fingerprint ⇒ ίδιο score Βήματος 7 (διαφέρουν μόνο τα ονόματα τμημάτων).
+    Χωρίς `keys` οι γραμμές ταυτίζονται με τη θέση τους (αρκεί μέσα στο ίδιο DataFrame)· με `keys`
+    (π.χ. ΟΝΟΜΑ) οι γραμμές ταξινομούνται σταθερά κατά κλειδί και το κλειδί μπαίνει στο hash,
+    ώστε να συγκρίνονται σωστά DataFrames από διαφορετικά runs με άλλη σειρά/πλήθος γραμμών.
+    """
+    values = list(values)
+    prefix = [""] * len(values)
+    if keys is not None:
+        keys = ["" if k is None or pd.isna(k) else str(k) for k in keys]
+        order = sorted(range(len(values)), key=keys.__getitem__)
+        values = [values[i] for i in order]
+        prefix = [keys[i] + "\x1e" for i in order]
+    seen: Dict[str, int] = {}
+    toks = []
+    for pre, v in zip(prefix, values):
+        if v is None or pd.isna(v):
+            toks.append(pre)
+            continue
+        lab = str(v)
+        toks.append(pre + (str(seen.setdefault(lab, len(seen))) if _LABEL_RE.match(lab) else "~" + lab))
+    return hashlib.sha1("\x1f".join(toks).encode("utf-8")).hexdigest()[:16]
+
+def dedup_scenarios(df: pd.DataFrame, scenario_cols: List[str]) -> Dict[str, Dict[str, Any]]:
+    """
+    Ομαδοποίηση στηλών σεναρίων με ίδιο fingerprint:
+    {πρώτη στήλη: {"fingerprint": ..., "aliases": [επόμενες ίδιες στήλες]}}, με σειρά εμφάνισης.
+    """
+    groups: Dict[str, Dict[str, Any]] = {}
+    rep_of: Dict[str, str] = {}
+    for c in scenario_cols:
+        if c not in df.columns or c in groups:
+            continue
+        fp = scenario_fingerprint(df[c].tolist())
+        if fp in rep_of:
+            groups[rep_of[fp]]["aliases"].append(c)
+        else:
+            rep_of[fp] = c
+            groups[c] = {"fingerprint": fp, "aliases": []}
+    return groups
+
 # ------------------------ ΔΙΟΡΘΩΜΕΝΗ Public API ------------------------
 
+def _score_record(scenario_col, num_classes, pop_counts, boys_counts, girls_counts, good_counts,
+                  total_pop_diff, total_boys_diff, total_girls_diff, total_greek_diff,
+                  population_penalty, boys_penalty, girls_penalty, greek_penalty,
+                  conflict_penalty, broken) -> Dict[str, Any]:
+    """Κοινή μορφή αποτελέσματος για score_one_scenario / score_scenarios."""
+    gender_penalty = boys_penalty + girls_penalty
+    broken_friendships_penalty = 5 * broken
+    total = population_penalty + gender_penalty + greek_penalty + conflict_penalty + broken_friendships_penalty
+
+    return {
+        "scenario_col": scenario_col,
+        "num_classes": num_classes,
+        "population_counts": pop_counts,
+        "boys_counts": boys_counts,
+        "girls_counts": girls_counts,
+        "good_greek_counts": good_counts,
+        # ΔΙΟΡΘΩΣΗ: Χρήση συνολικών διαφορών για tie-breaking
+        "diff_population": int(total_pop_diff),
+        "diff_boys": int(total_boys_diff),
+        "diff_girls": int(total_girls_diff), 
+        "diff_gender_total": int(total_boys_diff + total_girls_diff),  # για tie-breaking
+        "diff_greek": int(total_greek_diff),
+        "population_penalty": int(population_penalty),
+        "boys_penalty": int(boys_penalty),
+        "girls_penalty": int(girls_penalty),
+        "gender_penalty": int(gender_penalty),
+        "greek_penalty": int(greek_penalty),
+        "conflict_penalty": int(conflict_penalty),
+        "broken_friendships": int(broken),
+        "broken_friendships_penalty": int(broken_friendships_penalty),
+        "total_score": int(total),
+    }
+
 def score_one_scenario(df: pd.DataFrame, scenario_col: str, num_classes: Optional[int] = None,
                        critical_pairs: Optional[List[Tuple[str,str]]]=None,
                        count_unassigned_as_broken: bool=False) -> Dict[str, Any]:
@@ -222,7 +434,6 @@ def score_one_scenario(df: pd.DataFrame, scenario_col: str, num_classes: Optiona
     
     boys_penalty = _pairwise_penalty(boys_counts, free=1, weight=2)
     girls_penalty = _pairwise_penalty(girls_counts, free=1, weight=2)
-    gender_penalty = boys_penalty + girls_penalty
 
     # 3. ΔΙΟΡΘΩΣΗ: Γνώση ελληνικών - ποινή ανά ζεύγος  
     good_counts = _counts_per_class(df, scenario_col, label_filter=_good_greek_filter)
@@ -234,33 +445,11 @@ def score_one_scenario(df: pd.DataFrame, scenario_col: str, num_classes: Optiona
 
     # 5. Σπασμένες φιλίες (unchanged)
     broken = _broken_friendships_count(df, scenario_col, critical_pairs, count_unassigned_as_broken)
-    broken_friendships_penalty = 5 * broken
 
-    total = population_penalty + gender_penalty + greek_penalty + conflict_penalty + broken_friendships_penalty
-
-    return {
-        "scenario_col": scenario_col,
-        "num_classes": num_classes,
-        "population_counts": pop_counts,
-        "boys_counts": boys_counts,
-        "girls_counts": girls_counts,
-        "good_greek_counts": good_counts,
-        # ΔΙΟΡΘΩΣΗ: Χρήση συνολικών διαφορών για tie-breaking
-        "diff_population": int(total_pop_diff),
-        "diff_boys": int(total_boys_diff),
-        "diff_girls": int(total_girls_diff), 
-        "diff_gender_total": int(total_boys_diff + total_girls_diff),  # για tie-breaking
-        "diff_greek": int(total_greek_diff),
-        "population_penalty": int(population_penalty),
-        "boys_penalty": int(boys_penalty),
-        "girls_penalty": int(girls_penalty),
-        "gender_penalty": int(gender_penalty),
-        "greek_penalty": int(greek_penalty),
-        "conflict_penalty": int(conflict_penalty),
-        "broken_friendships": int(broken),
-        "broken_friendships_penalty": int(broken_friendships_penalty),
-        "total_score": int(total),
-    }
+    return _score_record(scenario_col, num_classes, pop_counts, boys_counts, girls_counts, good_counts,
+                         total_pop_diff, total_boys_diff, total_girls_diff, total_greek_diff,
+                         population_penalty, boys_penalty, girls_penalty, greek_penalty,
+                         conflict_penalty, broken)
 
 def pick_best_scenario(df: pd.DataFrame, scenario_cols: List[str], num_classes: Optional[int]=None,
                        critical_pairs: Optional[List[Tuple[str,str]]]=None,
@@ -272,11 +461,15 @@ def pick_best_scenario(df: pd.DataFrame, scenario_cols: List[str], num_classes:
     if num_classes is None and scenario_cols:
         num_classes = _infer_num_classes_from_values(df[scenario_cols[0]].values)
 
-    scores = [score_one_scenario(df, c, num_classes, critical_pairs, count_unassigned_as_broken)
-              for c in scenario_cols if c in df.columns]
+    # Ίδιες διαμερίσεις βαθμολογούνται μία φορά· οι διπλές αναφέρονται ως aliases
+    groups = dedup_scenarios(df, scenario_cols)
+    # Όλα τα σενάρια σε ένα πέρασμα (βλ. score_scenarios)
+    scores = score_scenarios(df, list(groups), num_classes, critical_pairs, count_unassigned_as_broken)
+    for s in scores:
+        s.update(groups[s["scenario_col"]])
 
     if not scores:
-        return {"best": None, "scores": []}
+        return {"best": None, "scores": [], "aliases": {}}
 
     # ΔΙΟΡΘΩΣΗ: Tie-breaking με συνολικές διαφορές
     scores_sorted = sorted(
@@ -303,19 +496,140 @@ def pick_best_scenario(df: pd.DataFrame, scenario_cols: List[str], num_classes:
     random.seed(random_seed)
     best = random.choice(top)
 
-    return {"best": best, "scores": scores_sorted[:max(k_best,1)]}
+    aliases = {c: g["aliases"] for c, g in groups.items() if g["aliases"]}
+    return {"best": best, "scores": scores_sorted[:max(k_best,1)], "aliases": aliases}
+
+# ------------------------ Delta rescoring (what-if μετακινήσεις) ------------------------
+
+class ScenarioScoreState:
+    """
+    Score ενός σεναρίου που ενημερώνεται σταδιακά, για «τι γίνεται αν μετακινήσω τον Χ στο Α3».
+    - μετρητές ανά τμήμα (πληθυσμός, αγόρια, κορίτσια, καλή γνώση, Ι/Ζ για συγκρούσεις)
+    - ευρετήριο γραμμή → δυάδες φιλίας, για σπασμένες φιλίες σε O(βαθμός)
+    move()/swap() κοστίζουν O(K log K + βαθμός) και επιστρέφουν ό,τι θα έδινε
+    score_one_scenario στο τροποποιημένο σενάριο· undo() αναιρεί την τελευταία ενέργεια.
+    Ο μαθητής δίνεται ως ΟΝΟΜΑ (τελευταία εμφάνιση) ή ως θέση γραμμής (int).
+    """
+    def __init__(self, df: pd.DataFrame, scenario_col: str, num_classes: Optional[int] = None,
+                 critical_pairs: Optional[List[Tuple[str,str]]] = None,
+                 count_unassigned_as_broken: bool = False):
+        self.scenario_col = scenario_col
+        self.num_classes = num_classes
+        self.count_unassigned_as_broken = count_unassigned_as_broken
+        n = len(df)
+        col = df[scenario_col]
+        self.cls: List[Optional[str]] = [None if pd.isna(v) else str(v) for v in col.tolist()] + [None]
+        enc = _encode_roster(df)
+        self.flags = {k: enc[k].tolist() for k in ("boys", "girls", "good", "special", "lively_only")}
+        self.row_of = {str(nm).strip(): i for i, nm in enumerate(df["ΟΝΟΜΑ"].tolist())} if "ΟΝΟΜΑ" in df.columns else {}
+
+        self.counts: Dict[str, Dict[str, int]] = {k: {} for k in ("pop",) + tuple(self.flags)}
+        for r in range(n):
+            self._add(r, self.cls[r], +1)
+
+        ra, rb = _pair_rows(df, critical_pairs)
+        self.pairs = list(zip(ra.tolist(), rb.tolist()))
+        self.pairs_of: Dict[int, List[int]] = {}
+        for p, (a, b) in enumerate(self.pairs):
+            self.pairs_of.setdefault(a, []).append(p)
+            if b != a:
+                self.pairs_of.setdefault(b, []).append(p)
+        self.broken = sum(self._pair_broken(p) for p in range(len(self.pairs)))
+        self.history: List[List[Tuple[int, Optional[str]]]] = []
+
+    # ---- εσωτερικά ----
+    def _add(self, r: int, lab: Optional[str], sign: int) -> None:
+        if lab is None or not _LABEL_RE.match(lab):
+            return
+        pop = self.counts["pop"]
+        pop[lab] = pop.get(lab, 0) + sign
+        for k, flag in self.flags.items():
+            c = self.counts[k]
+            c[lab] = c.get(lab, 0) + (sign if flag[r] else 0)
+        if pop[lab] == 0:   # άδειο τμήμα δεν μετρά (όπως στο _counts_per_class)
+            for c in self.counts.values():
+                del c[lab]
+
+    def _pair_broken(self, p: int) -> int:
+        ca, cb = self.cls[self.pairs[p][0]], self.cls[self.pairs[p][1]]
+        if ca is None or cb is None:
+            return int(self.count_unassigned_as_broken)
+        return int(ca != cb)
+
+    def _set(self, r: int, lab: Optional[str]) -> Optional[str]:
+        prev = self.cls[r]
+        if lab == prev:
+            return prev
+        touched = self.pairs_of.get(r, [])
+        self.broken -= sum(self._pair_broken(p) for p in touched)
+        self._add(r, prev, -1)
+        self.cls[r] = lab
+        self._add(r, lab, +1)
+        self.broken += sum(self._pair_broken(p) for p in touched)
+        return prev
+
+    def _row(self, student: Any) -> int:
+        if isinstance(student, (int, np.integer)) and not isinstance(student, bool):
+            if not 0 <= student < len(self.cls) - 1:
+                raise IndexError(f"Γραμμή εκτός ορίων: {student}")
+            return int(student)
+        key = str(student).strip()
+        if key not in self.row_of:
+            raise KeyError(f"Άγνωστος μαθητής: {student}")
+        return self.row_of[key]
+
+    # ---- δημόσιο API ----
+    def class_of(self, student: Any) -> Optional[str]:
+        return self.cls[self._row(student)]
+
+    def move(self, student: Any, to_class: Any) -> Dict[str, Any]:
+        """Μετακίνηση μαθητή στο `to_class` (None/NaN = χωρίς τμήμα) → νέο score."""
+        r = self._row(student)
+        lab = None if to_class is None or (isinstance(to_class, float) and pd.isna(to_class)) else str(to_class)
+        self.history.append([(r, self._set(r, lab))])
+        return self.score()
+
+    def swap(self, a: Any, b: Any) -> Dict[str, Any]:
+        """Ανταλλαγή τμημάτων δύο μαθητών → νέο score."""
+        ra, rb = self._row(a), self._row(b)
+        ca, cb = self.cls[ra], self.cls[rb]
+        self.history.append([(ra, self._set(ra, cb)), (rb, self._set(rb, ca))])
+        return self.score()
+
+    def undo(self) -> Dict[str, Any]:
+        """Αναίρεση της τελευταίας move/swap (χωρίς ιστορικό: no-op)."""
+        if self.history:
+            for r, prev in reversed(self.history.pop()):
+                self._set(r, prev)
+        return self.score()
+
+    def score(self) -> Dict[str, Any]:
+        """Τρέχον αναλυτικό score — ίδια μορφή/τιμές με score_one_scenario."""
+        c = self.counts
+        num_classes = self.num_classes if self.num_classes is not None else (len(c["pop"]) or 2)
+        conflict = sum(_conflict_from_counts(c["special"][lab], c["lively_only"][lab]) for lab in c["pop"])
+        ordered = {k: dict(sorted(v.items())) for k, v in c.items()}
+        pop, boys, girls, good = ordered["pop"], ordered["boys"], ordered["girls"], ordered["good"]
+        return _score_record(
+            self.scenario_col, num_classes, pop, boys, girls, good,
+            _pairwise_differences_sum(pop), _pairwise_differences_sum(boys),
+            _pairwise_differences_sum(girls), _pairwise_differences_sum(good),
+            _pairwise_penalty(pop, free=1, weight=3), _pairwise_penalty(boys, free=1, weight=2),
+            _pairwise_penalty(girls, free=1, weight=2), _pairwise_penalty(good, free=2, weight=1),
+            conflict, self.broken)
 
 # ------------------------ Helper functions (unchanged but updated) ------------------------
 
 def score_to_dataframe(df: pd.DataFrame, scenario_cols: List[str], **kwargs) -> pd.DataFrame:
     """Μετατρέπει scores σε DataFrame για εύκολη προβολή."""
     rows = []
-    for c in scenario_cols:
-        if c not in df.columns:
-            continue
-        s = score_one_scenario(df, c, **kwargs)
+    groups = dedup_scenarios(df, scenario_cols)
+    for s in score_scenarios(df, list(groups), **kwargs):
+        c = s["scenario_col"]
         rows.append({
             "SCENARIO": c,
+            "ALIASES": ", ".join(groups[c]["aliases"]),
+            "FINGERPRINT": groups[c]["fingerprint"],
             "TOTAL": s["total_score"],
             "POP_DIFF": s["diff_population"],
             "BOYS_DIFF": s["diff_boys"],
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 from typing import List, Dict, Set, Optional
-import pandas as pd, re, ast
+import pandas as pd, re
+from friends_parser import parse_list_cell
 
 # ✅ Βασικοί τίτλοι που κρατάμε σε κάθε minimal export
 CORE_COLUMNS_DEFAULT = [
@@ -23,7 +24,6 @@ COLUMN_FIXES = {
     "ΓΝΩΣΗ_ΕΛΛΗΝΙΚΩΝ": "ΚΑΛΗ_ΓΝΩΣΗ_ΕΛΛΗΝΙΚΩΝ",
 }
 
-SAFE_SEP = re.compile(r"[,\|\;/·\n]+")
 
 def norm_yesno(val: object) -> str:
     s = str(val).strip().upper()
@@ -50,22 +50,7 @@ def normalize_columns(df: pd.DataFrame) -> pd.DataFrame:
         df["ΟΝΟΜΑ"] = df["ΟΝΟΜΑ"].astype(str).str.strip()
     return df
 
-def parse_friends_cell(x) -> List[str]:
-    if isinstance(x, list):
-        return [str(s).strip() for s in x if str(s).strip()]
-    if pd.isna(x):
-        return []
-    s = str(x).strip()
-    if not s:
-        return []
-    try:
-        v = ast.literal_eval(s)
-        if isinstance(v, list):
-            return [str(t).strip() for t in v if str(t).strip()]
-    except Exception:
-        pass
-    parts = SAFE_SEP.split(s)
-    return [p.strip() for p in parts if p.strip() and p.strip().lower() != "nan"]
+parse_friends_cell = parse_list_cell
 
 def are_mutual_friends(df: pd.DataFrame, a: str, b: str) -> bool:
     ra = df[df["ΟΝΟΜΑ"].astype(str) == str(a)]
@@ -11,28 +11,9 @@ step_3_helpers_FIXED.py
 
 from typing import List, Tuple, Dict, Set
 import pandas as pd
-import re, ast
+from friends_parser import parse_list_cell
 
-SAFE_SEP = re.compile(r"[,\|\;/·\n]+")
-
-def parse_friends_string(x) -> List[str]:
-    if isinstance(x, list):
-        return [str(s).strip() for s in x if str(s).strip()]
-    if pd.isna(x):
-        return []
-    s = str(x).strip()
-    if not s:
-        return []
-    # Προσπάθεια ως Python list: "['Α','Β']"
-    try:
-        val = ast.literal_eval(s)
-        if isinstance(val, list):
-            return [str(t).strip() for t in val if str(t).strip()]
-    except Exception:
-        pass
-    # Διαφορετικά, split με ασφαλές regex
-    parts = SAFE_SEP.split(s)
-    return [p.strip() for p in parts if p.strip() and p.strip().lower()!="nan"]
+parse_friends_string = parse_list_cell
 
 def are_mutual_pair(df: pd.DataFrame, a: str, b: str) -> bool:
     ra = df[df["ΟΝΟΜΑ"].astype(str)==str(a)]